@@ -0,0 +1,222 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+
+import anyio.to_thread
+import orjson
+
+from db_setup import DB_POOL_MAX_SIZE
+from metrics import HTTP_REQUESTS_SHED
+from replicas import replica_router
+from routing import route_path
+
+# Admission control.
+# Under a spike every request used to queue for a thread and then for a
+# connection, until they all timed out together. AdmissionMiddleware admits at
+# most ADMISSION_MAX_CONCURRENCY requests at a time, by default as many as the
+# pools have connections, and sizes the thread limiter to match, so an admitted
+# request finds a thread and rarely waits for a connection.
+# A request over the limit waits up to ADMISSION_QUEUE_TIMEOUT seconds for a
+# slot, and only while fewer than ADMISSION_QUEUE_SIZE others wait, otherwise it
+# gets a 503 right away. Routes in ROUTE_CONCURRENCY_LIMITS also have a limit of
+# their own, so a few exports can't take every slot, and each client gets
+# RATE_LIMIT requests per second from a token bucket before getting a 429.
+# Every rejection carries Retry-After and is counted in /metrics.
+
+# Capacity of the primary plus the replicas
+_POOL_CAPACITY = DB_POOL_MAX_SIZE * (1 + len(replica_router.replicas))
+
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", str(_POOL_CAPACITY)))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", str(ADMISSION_MAX_CONCURRENCY * 4)))
+# Shorter than DB_POOL_TIMEOUT, a request is better off rejected here than after it got a thread
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+# A few threads more than admitted requests, for the admin endpoints admission lets through
+THREAD_LIMIT = int(os.getenv("THREAD_LIMIT", str(ADMISSION_MAX_CONCURRENCY + 4)))
+# Comma separated "METHOD /route/template=limit" list
+ROUTE_CONCURRENCY_LIMITS = os.getenv("ROUTE_CONCURRENCY_LIMITS",
+                                     "GET /records/export=2,GET /workout_exercises/export=2")
+# Requests per second per client, 0 turns rate limiting off
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", str(max(RATE_LIMIT * 2, 1))))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# Monitoring has to keep working while the app sheds load
+EXEMPT_PREFIXES = ("/admin/", "/metrics")
+
+
+def parse_route_limits(value: str) -> dict:
+    """
+    Parses "GET /records/export=2" into {("GET", "/records/export"): 2}
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, limit = item.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        limits[(method.upper(), path.strip())] = int(limit)
+    return limits
+
+
+class ConcurrencyLimit:
+    """
+    Semaphore whose waiters give up after a timeout, and that refuses new waiters once max_waiting wait
+    """
+
+    def __init__(self, limit: int, max_waiting: int, timeout: float):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting or self.timeout <= 0:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except TimeoutError:
+                self.shed += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, "shed": self.shed}
+
+
+class TokenBucket:
+    """
+    Per-client token buckets, each refilled at rate tokens per second up to burst
+
+    Holds at most max_clients buckets, the least recently seen client is dropped first
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.shed = 0
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at), least recently seen first
+
+    def take(self, client: str) -> float:
+        """
+        Takes a token for client, returns 0 or the seconds until one is available
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            # A dropped client comes back with a full bucket, as if it had been idle
+            while len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+            bucket = (self.burst, now)
+        else:
+            self._buckets.move_to_end(client)
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens < 1:
+            self._buckets[client] = (tokens, now)
+            self.shed += 1
+            return (1 - tokens) / self.rate
+        self._buckets[client] = (tokens - 1, now)
+        return 0.0
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets), "shed": self.shed}
+
+
+_global_limit = ConcurrencyLimit(ADMISSION_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+# Routes wait no longer than for the global limit, but never queue more requests than they may run
+_route_limits = {route: ConcurrencyLimit(limit, limit, ADMISSION_QUEUE_TIMEOUT)
+                 for route, limit in parse_route_limits(ROUTE_CONCURRENCY_LIMITS).items()}
+# Requests with other methods can't have a route limit and skip the route lookup
+_limited_methods = {method for method, _ in _route_limits}
+_rate_limit = TokenBucket(RATE_LIMIT, RATE_LIMIT_BURST, RATE_LIMIT_MAX_CLIENTS) if RATE_LIMIT > 0 else None
+
+
+def configure_thread_limiter():
+    """
+    Sizes the thread limiter sync endpoints and dependencies run on, call it from the event loop
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_LIMIT
+
+
+def admission_stats() -> dict:
+    return {
+        "thread_limit": THREAD_LIMIT,
+        "db_pool_capacity": _POOL_CAPACITY,
+        "queue_timeout": ADMISSION_QUEUE_TIMEOUT,
+        "global": {**_global_limit.stats(), "max_waiting": ADMISSION_QUEUE_SIZE},
+        "routes": {f"{method} {path}": limit.stats() for (method, path), limit in _route_limits.items()},
+        "rate_limit": _rate_limit.stats() if _rate_limit is not None else None,
+    }
+
+
+def _client(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(retry_after))).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware that rejects requests the app has no capacity for with 503 or 429
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        if _rate_limit is not None:
+            wait = _rate_limit.take(_client(scope))
+            if wait:
+                HTTP_REQUESTS_SHED.labels("rate_limit").inc()
+                await _reject(send, 429, "Too many requests", wait)
+                return
+
+        route_limit = None
+        if scope["method"] in _limited_methods:
+            route_limit = _route_limits.get((scope["method"], route_path(scope)))
+        if route_limit is not None and not await route_limit.acquire():
+            HTTP_REQUESTS_SHED.labels("route_concurrency").inc()
+            await _reject(send, 503, "Too many concurrent requests for this route", 1)
+            return
+        try:
+            if not await _global_limit.acquire():
+                HTTP_REQUESTS_SHED.labels("concurrency").inc()
+                await _reject(send, 503, "Server is at capacity", 1)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _global_limit.release()
+        finally:
+            if route_limit is not None:
+                route_limit.release()
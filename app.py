@@ -1,14 +1,96 @@
 import os
 
-from typing import Any, List
+from contextlib import asynccontextmanager
+from typing import Any, List, Optional
 import psycopg2
-from db_setup import get_connection
-from fastapi import FastAPI, HTTPException, status, Depends
-from db import create_user_db, get_user_db, update_user_db, delete_user_db, get_users_db, get_records_db, get_categories_db, get_exercise_db, get_exercises_db, get_record_db, get_workout_db, get_repmaxs_db, get_workouts_db, update_records_db, update_repmax_db, update_workout_db, create_category_db, create_exercise_db, create_record_db, create_repmax_db, create_workout_db, delete_category_db, delete_exercise_db, delete_record_db, delete_repmax_db, delete_workout_db, get_workout_exercises_by_workout_id_db, get_workout_exercises_db, create_workout_exercise_db, delete_workout_exercise_db, update_workout_exercise_db
-from schemas import UserCreate, UserUpdate, RecordCreate, RecordUpdate, RepmaxCreate, RepmaxUpdate, WorkoutCreate, WorkoutUpdate, ExerciseCreate, ExerciseUpdate, CategoryCreate, WorkoutExerciseCreate, WorkoutExerciseResponse, WorkoutExerciseUpdate, UserResponse, ExerciseResponse, WorkoutResponse, RecordResponse, RepmaxResponse, CategoryResponse
+from db_setup import DB_MODE, connect, get_connection, pool, async_pool
+from fastapi import FastAPI, HTTPException, Body, Query, Request, Response, status, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from db import create_user_db, get_user_db, update_user_db, delete_user_db, get_users_db, get_records_db, get_categories_db, get_exercise_db, get_exercises_db, update_exercise_db, get_record_db, get_workout_db, get_repmaxs_db, get_workouts_db, update_records_db, update_repmax_db, update_workout_db, create_category_db, create_exercise_db, create_record_db, create_repmax_db, create_workout_db, delete_category_db, delete_exercise_db, delete_record_db, delete_repmax_db, delete_workout_db, get_workout_exercises_by_workout_id_db, get_workout_exercises_db, create_workout_exercise_db, delete_workout_exercise_db, update_workout_exercise_db, export_records_db, export_workout_exercises_db, get_full_workout_db, get_user_dashboard_db, get_personal_bests_db, get_leaderboard_db, create_records_bulk_db, create_repmaxs_bulk_db, create_workout_exercises_bulk_db
+from schemas import UserCreate, UserUpdate, RecordCreate, RecordUpdate, RepmaxCreate, RepmaxUpdate, WorkoutCreate, WorkoutUpdate, ExerciseCreate, ExerciseUpdate, CategoryCreate, WorkoutExerciseCreate, WorkoutExerciseResponse, WorkoutExerciseUpdate, UserResponse, ExerciseResponse, WorkoutResponse, RecordResponse, RepmaxResponse, CategoryResponse, Page, user_page_adapter, exercise_page_adapter, record_page_adapter, repmax_page_adapter, workout_page_adapter, workout_exercise_page_adapter, BulkCreateResponse, FullWorkoutResponse, DashboardResponse, PersonalBestResponse, LeaderboardEntry, LoginRequest, TokenResponse, IngestReceipt
+from cache import cache_stats
+from prepared import prepared_stats
+from slowlog import start_explainer, stop_explainer, worst_queries
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, make_page
+from responses import EXPORT_BATCH_SIZE, json_response, ndjson_chunk
+from bulk import bulk_result, validate_items
 from psycopg2.errors import IntegrityError,ForeignKeyViolation
-
-app = FastAPI()
+from psycopg_pool import PoolTimeout
+from custom_exceptions import PoolTimeoutError
+from async_routes import install_async_routes
+from etags import ETagMiddleware
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, metrics_response, register_pool_metrics
+from logs import LogContextMiddleware, configure_logging, start_logging, stop_logging
+from replicas import ReadYourWritesMiddleware, ReplicaFallbackMiddleware, get_read_connection, replica_router
+from auth import authorize_user_write, current_user_id, hash_password, login_user
+from admission import AdmissionMiddleware, admission_stats, configure_thread_limiter
+from ingest import RECORD_INGEST, ingester
+
+
+# ingest.py writes its batches on the sync pool in either DB_MODE
+SYNC_POOL_NEEDED = DB_MODE != "async" or RECORD_INGEST
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warms up the connection pools on startup and closes them on shutdown
+
+    In async mode the sync pool is only opened for the record ingester,
+    every endpoint that queries the database has an async version
+    """
+    start_logging()
+    configure_thread_limiter()
+    if SYNC_POOL_NEEDED:
+        await run_in_threadpool(pool.open)
+    if DB_MODE == "async":
+        await async_pool.open(wait=True)
+        await replica_router.open_async()
+    await run_in_threadpool(replica_router.open)
+    start_explainer(connect)
+    if RECORD_INGEST:
+        await run_in_threadpool(ingester.start)
+    yield
+    if RECORD_INGEST:
+        await run_in_threadpool(ingester.stop)
+    await run_in_threadpool(stop_explainer)
+    await run_in_threadpool(replica_router.close)
+    if DB_MODE == "async":
+        await replica_router.close_async()
+        await async_pool.close()
+    if SYNC_POOL_NEEDED:
+        await run_in_threadpool(pool.close)
+    stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ETagMiddleware)
+# Outside ETagMiddleware, which compresses the responses it caches itself
+app.add_middleware(CompressionMiddleware)
+# Inside MetricsMiddleware, so the requests it sheds are counted and timed too
+app.add_middleware(AdmissionMiddleware)
+# Outside admission and ETags, a retried read goes through both again
+app.add_middleware(ReplicaFallbackMiddleware)
+# Added after ETagMiddleware so it runs before it and also times the 304s it answers
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+# Outermost, so every log record of a request carries its id
+app.add_middleware(LogContextMiddleware)
+configure_logging()
+register_pool_metrics(pool if SYNC_POOL_NEEDED else None, async_pool if DB_MODE == "async" else None)
+
+
+@app.exception_handler(PoolTimeoutError)
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: Exception):
+    """
+    All connections are busy, tell the client to back off instead of hanging
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={'detail': str(exc)}, headers={'Retry-After': '1'})
 
 # Home
 
@@ -20,17 +102,125 @@ def get_status():
     """
     return "Running on localhost:8000..."
 
+
+@app.get("/admin/pool")
+def get_pool_stats():
+    """
+    Returns connection pool statistics for monitoring
+    """
+    if DB_MODE == "async":
+        return async_pool.get_stats()
+    return pool.stats()
+
+
+@app.get("/admin/replicas")
+def get_replica_stats():
+    """
+    Returns the health, lag and pool statistics of the read replicas
+    """
+    return replica_router.stats()
+
+
+@app.get("/admin/admission")
+def get_admission_stats():
+    """
+    Returns admission limits, requests in flight and waiting, and how many were shed
+    """
+    return admission_stats()
+
+
+@app.get("/admin/ingest")
+def get_ingest_stats():
+    """
+    Returns how many queued records are waiting, written and rejected
+    """
+    return ingester.stats()
+
+
+@app.get("/admin/cache")
+def get_cache_stats():
+    """
+    Returns hit/miss/eviction counters of the in-process caches
+    """
+    return cache_stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Returns request, query and pool metrics in Prometheus text format
+    """
+    return metrics_response()
+
+
+@app.get("/admin/slow-queries")
+def get_slow_queries(limit: int = Query(20, ge=1, le=200)):
+    """
+    Returns the slowest recent queries, with a plan where one was captured
+    """
+    return worst_queries(limit)
+
+
+@app.get("/admin/prepared")
+def get_prepared_stats():
+    """
+    Returns prepared statement counters and the planning time they saved
+    """
+    return prepared_stats()
+
+def stream_ndjson(export_db, request: Request):
+    """
+    Yields the rows of export_db as newline delimited JSON, one chunk per batch
+
+    The connection is checked out here rather than through Depends,
+    since dependencies are torn down before a streaming body is sent
+    """
+    with replica_router.connection(request.scope) as con:
+        for batch in export_db(con, EXPORT_BATCH_SIZE):
+            yield ndjson_chunk(batch)
+
+
+def bulk_create(items: list, schema, to_row, create_bulk_db, con):
+    """
+    Validates every item on its own, inserts the valid ones in one transaction
+    and reports the rejected ones by their index in the request body
+
+    Raises exception if more than MAX_BULK_SIZE items are sent
+    """
+    rows, positions, errors = validate_items(items, schema, to_row)
+    inserted, db_errors = create_bulk_db(con, rows)
+    return bulk_result(items, positions, errors, inserted, db_errors)
+
 #                                                        Users Endpoints
 
 
+@app.post("/login", response_model=TokenResponse)
+async def login(credentials: LoginRequest):
+    """
+    Returns a bearer token for the user
+
+    Raises exception if the name or password is wrong
+    """
+    return await login_user(credentials.name, credentials.password)
+
+
+@app.get("/users/me", status_code=200, response_model=UserResponse)
+def get_current_user(user_id: int = Depends(current_user_id), con: Any = Depends(get_read_connection)):
+    """
+    Returns the user the bearer token belongs to
+
+    Registered before /users/{user_id} so "me" isn't parsed as a user ID
+    """
+    return get_user_db(con, user_id)
+
+
 @app.get("/users/{user_id}", status_code=200, response_model = UserResponse)
-def get_user(user_id: int):
+def get_user(user_id: int, con: Any = Depends(get_read_connection)):
     """
     Returns a user by ID
 
     Raises exception if user is not found
     """
-    con = get_connection()
     user = get_user_db(con, user_id)
     if user:
         return user
@@ -38,26 +228,61 @@ def get_user(user_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-@app.get("/users", status_code=200, response_model=List[UserResponse])
-def get_users():
+@app.get("/users/{user_id}/dashboard", status_code=200, response_model=DashboardResponse)
+def get_user_dashboard(user_id: int, records_limit: int = Query(10, ge=1, le=100),
+                       workouts_limit: int = Query(5, ge=1, le=100), con: Any = Depends(get_read_connection)):
     """
-    Returns a list of all users
+    Returns a user's profile, latest records, current repmax per exercise
+    and recent workouts in one request
+
+    Raises exception if user is not found
     """
-    con = get_connection()
-    return get_users_db(con)
+    return get_user_dashboard_db(con, user_id, records_limit, workouts_limit)
+
+
+@app.get("/users/{user_id}/personal-bests", status_code=200, response_model=List[PersonalBestResponse])
+def get_personal_bests(user_id: int, con: Any = Depends(get_read_connection)):
+    """
+    Returns the user's heaviest repmax for every exercise
+
+    Raises exception if user is not found
+    """
+    return get_personal_bests_db(con, user_id)
+
+
+@app.get("/users", status_code=200, response_model=Page[UserResponse])
+def get_users(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
+    """
+    Returns one page of users
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = get_users_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), user_page_adapter)
+
+
+def with_connection(db_function, *args):
+    """
+    Runs db_function on a pooled connection
+
+    For endpoints that hash a password first, so no connection sits idle while they wait for the hash
+    """
+    with pool.connection() as con:
+        return db_function(con, *args)
 
 
 @app.post("/users", status_code=status.HTTP_201_CREATED)
-def create_user(user: UserCreate, con: Any = Depends(get_connection)):
+async def create_user(user: UserCreate):
     """
     Creates a user
 
     Raises exception if name already exists.
     Also raises exception if something went wrong when creating the user
     """
+    password = await hash_password(user.password)
     try:
-        result = create_user_db(con, user.password, user.name,
-                                user.weight, user.user_record_id, user.height)
+        result = await run_in_threadpool(with_connection, create_user_db, password, user.name,
+                                         user.weight, user.user_record_id, user.height)
         if result:
             return {'message': f'User created sucessfully with id: {result}'}
         raise HTTPException(
@@ -67,26 +292,26 @@ def create_user(user: UserCreate, con: Any = Depends(get_connection)):
             status_code=409, detail="Name already exists.")
 
 
-@app.patch('/users/{user_id}', status_code=status.HTTP_200_OK)
-def update_user(user_id: int, user: UserUpdate, con: Any = Depends(get_connection)):
+@app.patch('/users/{user_id}', status_code=status.HTTP_200_OK, dependencies=[Depends(authorize_user_write)])
+async def update_user(user_id: int, user: UserUpdate):
     """
     Updates one or more fields in a user by ID
 
+    Only the user itself may do so, with a bearer token from /login,
+    unless AUTH_USER_WRITES is off.
     Raises exception if name already exists, or if no input was provided.
 
     """
-    try:
-        # Extract fields from UserUpdate and iterate over them
-        # Only include fields that are set
-        update_data = user.model_dump(exclude_unset=True)
-        if not update_data:
-            raise ValueError("No fields provided for update.")
-
-        for column, value in update_data.items():
-            # The function gets called for every row to enable the option to update serveral rows at once
-            update_user_db(con, user_id, update_column=column,
-                           update_value=value)
+    update_data = user.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+    if update_data.get('password') is not None:
+        update_data['password'] = await hash_password(update_data['password'])
 
+    try:
+        # All fields are written by one UPDATE in one transaction
+        await run_in_threadpool(with_connection, update_user_db, user_id, update_data)
         return {'message': 'User updated successfully'}
 
     except IntegrityError:
@@ -94,11 +319,13 @@ def update_user(user_id: int, user: UserUpdate, con: Any = Depends(get_connectio
             status_code=409, detail="Username or email already exists.")
 
 
-@app.delete('/users/{user_id}')
+@app.delete('/users/{user_id}', dependencies=[Depends(authorize_user_write)])
 def delete_user(user_id: int, con: Any = Depends(get_connection)):
     """
     Deletes a user by ID
 
+    Only the user itself may do so, with a bearer token from /login,
+    unless AUTH_USER_WRITES is off.
     Raises exception if user could not be found
     """
     result = delete_user_db(con, user_id)
@@ -110,14 +337,23 @@ def delete_user(user_id: int, con: Any = Depends(get_connection)):
 #                                                   Records Endpoints
 
 
+@app.get("/records/export")
+def export_records(request: Request):
+    """
+    Streams every record as newline delimited JSON
+
+    Registered before /records/{user_id} so "export" isn't parsed as a user ID
+    """
+    return StreamingResponse(stream_ndjson(export_records_db, request), media_type="application/x-ndjson")
+
+
 @app.get("/records/{user_id}", status_code=200, response_model=RecordResponse)
-def get_record(user_id: int):
+def get_record(user_id: int, con: Any = Depends(get_read_connection)):
     """
     Returns records by user ID
 
     Raises exception if user is not found
     """
-    con = get_connection()
     record = get_record_db(con, user_id)
     if record:
         return record
@@ -125,13 +361,15 @@ def get_record(user_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-@app.get("/records", status_code=200, response_model=List[RecordResponse])
-def get_records():
+@app.get("/records", status_code=200, response_model=Page[RecordResponse])
+def get_records(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
     """
-    Returns a list of all users
+    Returns one page of records
+
+    Pass the returned next_after token as after to fetch the next page
     """
-    con = get_connection()
-    return get_records_db(con)
+    rows = get_records_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), record_page_adapter)
 
 
 @app.post("/records", status_code=status.HTTP_201_CREATED)
@@ -144,7 +382,7 @@ def create_record(record: RecordCreate, con: Any = Depends(get_connection)):
     """
     try:
         result = create_record_db(
-            con, record.workout_id, record.user_id, record.record_time)
+            con, record.workout_id, record.user_id, record.record_date, record.record_time)
         if result:
             return {'message': f'Record created sucessfully with id: {result}'}
         raise HTTPException(
@@ -154,6 +392,43 @@ def create_record(record: RecordCreate, con: Any = Depends(get_connection)):
             status_code=409, detail="Record already exists.")
 
 
+async def queue_record(record: RecordCreate, response: Response):
+    """
+    Queues a record to be written in the next batch, serves POST /records when RECORD_INGEST is on
+
+    Poll the Location header for when the record is written
+    """
+    receipt_id = await run_in_threadpool(ingester.accept, record)
+    response.headers['Location'] = f'/records/ingest/{receipt_id}'
+    return {'receipt_id': receipt_id, 'status': 'queued'}
+
+
+@app.get("/records/ingest/{receipt_id}", status_code=200, response_model=IngestReceipt)
+def get_ingest_receipt(receipt_id: str):
+    """
+    Returns whether a queued record was written, and its id once it was
+
+    Raises exception if the receipt is unknown or older than INGEST_RECEIPT_TTL
+    """
+    receipt = ingester.receipt(receipt_id)
+    if receipt is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Receipt not found")
+    return receipt
+
+
+@app.post("/records/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+def create_records_bulk(records: List[Any] = Body(..., description="A list of RecordCreate objects"), con: Any = Depends(get_connection)):
+    """
+    Creates many records in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return bulk_create(records, RecordCreate,
+                       lambda r: (r.workout_id, r.user_id, r.record_date, r.record_time),
+                       create_records_bulk_db, con)
+
+
 @app.put('/records/{record_id}', status_code=status.HTTP_200_OK)
 def update_record(record_id: int, record_time: RecordUpdate, con: Any = Depends(get_connection)):
     """
@@ -188,13 +463,12 @@ def delete_record(record_id: int, con: Any = Depends(get_connection)):
 
 
 @app.get("/exercises/{exercise_id}", status_code=200, response_model=ExerciseResponse)
-def get_exercise(exercise_id: int):
+def get_exercise(exercise_id: int, con: Any = Depends(get_read_connection)):
     """
     Returns a user by ID
 
     Raises exception if user is not found
     """
-    con = get_connection()
     exercise = get_exercise_db(con, exercise_id)
     if exercise:
         return exercise
@@ -202,13 +476,28 @@ def get_exercise(exercise_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-@app.get("/exercises", status_code=200, response_model=List[ExerciseResponse])
-def get_exercises():
+@app.get("/exercises/{exercise_id}/leaderboard", status_code=200, response_model=List[LeaderboardEntry])
+def get_leaderboard(exercise_id: int, limit: int = Query(20, ge=1, le=100),
+                    weight_class: Optional[str] = None, con: Any = Depends(get_read_connection)):
+    """
+    Returns the top lifters of an exercise by their personal best,
+    optionally only those in one bodyweight class
+
+    Raises exception if exercise is not found or weight_class is unknown
+    """
+    get_exercise_db(con, exercise_id)
+    return get_leaderboard_db(con, exercise_id, limit, weight_class)
+
+
+@app.get("/exercises", status_code=200, response_model=Page[ExerciseResponse])
+def get_exercises(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
     """
-    Returns a list of all exercises
+    Returns one page of exercises
+
+    Pass the returned next_after token as after to fetch the next page
     """
-    con = get_connection()
-    return get_exercises_db(con)
+    rows = get_exercises_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), exercise_page_adapter)
 
 
 @app.post("/exercises", status_code=status.HTTP_201_CREATED)
@@ -221,7 +510,8 @@ def create_exercise(exercise: ExerciseCreate, con: Any = Depends(get_connection)
     """
     try:
         result = create_exercise_db(con, exercise.name, exercise.weight,
-                                    exercise.repmax_id, exercise.category_id, exercise.base_exercise)
+                                    exercise.repmax_id, exercise.primary_muscle, exercise.secondary_muscle,
+                                    exercise.category_id, exercise.base_exercise)
         if result:
             return {'message': f'Exercise created sucessfully with id: {result}'}
         raise HTTPException(
@@ -239,18 +529,14 @@ def update_exercise(exercise_id: int, exercise: ExerciseUpdate, con: Any = Depen
     Raises exception if exercise already exists, or if no input was provided.
 
     """
-    try:
-        # Extract fields from ExerciseUpdate and iterate over them
-        # Only include fields that are set
-        update_data = exercise.model_dump(exclude_unset=True)
-        if not update_data:
-            raise ValueError("No fields provided for update.")
-
-        for column, value in update_data.items():
-            # The function gets called for every row to enable the option to update several rows at once
-            update_user_db(con, exercise_id, update_column=column,
-                           update_value=value)
+    update_data = exercise.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
 
+    try:
+        # All fields are written by one UPDATE in one transaction
+        update_exercise_db(con, exercise_id, update_data)
         return {'message': 'Exercise updated successfully'}
 
     except IntegrityError:
@@ -276,13 +562,12 @@ def delete_exercise(exercise_id: int, con: Any = Depends(get_connection)):
 
 
 @app.get("/workouts/{workout_id}", status_code=200, response_model=WorkoutResponse)
-def get_workout(workout_id: int):
+def get_workout(workout_id: int, con: Any = Depends(get_read_connection)):
     """
     Returns a workout by ID
 
     Raises exception if workout is not found
     """
-    con = get_connection()
     workout = get_workout_db(con, workout_id)
     if workout:
         return workout
@@ -290,13 +575,25 @@ def get_workout(workout_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-@app.get("/workouts", status_code=200, response_model=List[WorkoutResponse])
-def get_workout():
+@app.get("/workouts/{workout_id}/full", status_code=200, response_model=FullWorkoutResponse)
+def get_full_workout(workout_id: int, con: Any = Depends(get_read_connection)):
     """
-    Returns a list of all workouts
+    Returns a workout with its exercises, in order, and each exercise's details
+
+    Replaces fetching the workout, its workout_exercises and every exercise one by one
     """
-    con = get_connection()
-    return get_workouts_db(con)
+    return get_full_workout_db(con, workout_id)
+
+
+@app.get("/workouts", status_code=200, response_model=Page[WorkoutResponse])
+def get_workouts(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
+    """
+    Returns one page of workouts
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = get_workouts_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), workout_page_adapter)
 
 
 @app.post("/workouts", status_code=status.HTTP_201_CREATED)
@@ -327,18 +624,14 @@ def update_workout(workout_id: int, workout: WorkoutUpdate, con: Any = Depends(g
     Raises exception if workout already exists, or if no input was provided.
 
     """
-    try:
-        # Extract fields from WorkoutUpdate and iterate over them
-        # Only include fields that are set
-        update_data = workout.model_dump(exclude_unset=True)
-        if not update_data:
-            raise ValueError("No fields provided for update.")
-
-        for column, value in update_data.items():
-            # The function gets called for every row to enable the option to update serveral rows at once
-            update_workout_db(con, workout_id, update_column=column,
-                              update_value=value)
+    update_data = workout.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
 
+    try:
+        # All fields are written by one UPDATE in one transaction
+        update_workout_db(con, workout_id, update_data)
         return {'message': 'Workout updated successfully'}
 
     except IntegrityError:
@@ -362,13 +655,15 @@ def delete_workout(workout_id: int, con: Any = Depends(get_connection)):
 
 #                                                   Repmax Endpoints
 
-@app.get("/repmaxs", status_code=200, response_model=List[RepmaxResponse])
-def get_repmaxs():
+@app.get("/repmaxs", status_code=200, response_model=Page[RepmaxResponse])
+def get_repmaxs(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
     """
-    Returns a list of all repmaxs
+    Returns one page of repmaxs
+
+    Pass the returned next_after token as after to fetch the next page
     """
-    con = get_connection()
-    return get_repmaxs_db(con)
+    rows = get_repmaxs_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), repmax_page_adapter)
 
 
 @app.post("/repmaxs", status_code=status.HTTP_201_CREATED)
@@ -391,6 +686,19 @@ def create_repmax(repmax: RepmaxCreate, con: Any = Depends(get_connection)):
             status_code=409, detail="Repmax already exists.")
 
 
+@app.post("/repmaxs/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+def create_repmaxs_bulk(repmaxs: List[Any] = Body(..., description="A list of RepmaxCreate objects"), con: Any = Depends(get_connection)):
+    """
+    Creates many repmaxs in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return bulk_create(repmaxs, RepmaxCreate,
+                       lambda r: (r.exercise_id, r.user_id, r.weight),
+                       create_repmaxs_bulk_db, con)
+
+
 @app.patch('/repmaxs/{repmax_id}', status_code=status.HTTP_200_OK)
 def update_repmax(repmax_id: int, repmax: RepmaxUpdate, con: Any = Depends(get_connection)):
     """
@@ -399,18 +707,14 @@ def update_repmax(repmax_id: int, repmax: RepmaxUpdate, con: Any = Depends(get_c
     Raises exception if repmax already exists, or if no input was provided.
 
     """
-    try:
-        # Extract fields from RepmaxUpdate and iterate over them
-        # Only include fields that are set
-        update_data = repmax.model_dump(exclude_unset=True)
-        if not update_data:
-            raise ValueError("No fields provided for update.")
-
-        for column, value in update_data.items():
-            # The function gets called for every row to enable the option to update serveral rows at once
-            update_repmax_db(con, repmax_id, update_column=column,
-                             update_value=value)
+    update_data = repmax.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
 
+    try:
+        # All fields are written by one UPDATE in one transaction
+        update_repmax_db(con, repmax_id, update_data)
         return {'message': 'Repmax updated successfully'}
 
     except IntegrityError:
@@ -436,11 +740,10 @@ def delete_repmax(repmax_id: int, con: Any = Depends(get_connection)):
 
 
 @app.get("/categories", status_code=200, response_model=List[CategoryResponse])
-def get_categories():
+def get_categories(con: Any = Depends(get_read_connection)):
     """
     Returns a list of all categories
     """
-    con = get_connection()
     return get_categories_db(con)
 
 
@@ -480,29 +783,37 @@ def delete_category(user_id: int, con: Any = Depends(get_connection)):
 #                               Workout_exercises Endpoints
 
 
-@app.get("/workout_exercises", response_model=List[WorkoutExerciseResponse], status_code=200)
-def get_workout_exercises(con: Any = Depends(get_connection)):
+@app.get("/workout_exercises", response_model=Page[WorkoutExerciseResponse], status_code=200)
+def get_workout_exercises(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_read_connection)):
     """
-    Fetches all workout-exercise relationships
+    Fetches one page of workout-exercise relationships
+
+    Pass the returned next_after token as after to fetch the next page
     """
+    after_id = decode_cursor(after)
     try:
-        workout_exercises = get_workout_exercises_db(con)
-        if not workout_exercises:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="No workout-exercise relationships found."
-            )
-        return workout_exercises
+        rows = get_workout_exercises_db(con, limit, after_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while fetching workout-exercise relationships: {str(e)}"
         )
+    return json_response(make_page(rows, limit, 'workout_exercise_id'), workout_exercise_page_adapter)
+
+
+
+@app.get("/workout_exercises/export")
+def export_workout_exercises(request: Request):
+    """
+    Streams every workout-exercise relationship as newline delimited JSON
 
+    Registered before /workout_exercises/{id} so "export" isn't parsed as an ID
+    """
+    return StreamingResponse(stream_ndjson(export_workout_exercises_db, request), media_type="application/x-ndjson")
 
 
 @app.get("/workout_exercises/{id}", response_model=WorkoutExerciseResponse, status_code=200)
-def get_workout_exercise(id: int, con: Any = Depends(get_connection)):
+def get_workout_exercise(id: int, con: Any = Depends(get_read_connection)):
     """
     Fetches a single workout-exercise relationship by ID
     """
@@ -528,7 +839,8 @@ def create_workout_exercise(workout_exercise: WorkoutExerciseCreate, con: Any =
     Creates a new workout-exercise relationship
     """
     try:
-        result_id = create_workout_exercise_db(con, workout_exercise.workout_id, workout_exercise.exercise_id)
+        result_id = create_workout_exercise_db(con, workout_exercise.workout_id, workout_exercise.exercise_id,
+                                               workout_exercise.sets, workout_exercise.reps, workout_exercise.rest_time)
         return {"message": f"Workout-Exercise relationship created successfully with ID {result_id}"}
     except ForeignKeyViolation:
         raise HTTPException(
@@ -548,6 +860,19 @@ def create_workout_exercise(workout_exercise: WorkoutExerciseCreate, con: Any =
 
 
 
+@app.post("/workout_exercises/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+def create_workout_exercises_bulk(workout_exercises: List[Any] = Body(..., description="A list of WorkoutExerciseCreate objects"), con: Any = Depends(get_connection)):
+    """
+    Creates many workout-exercise relationships in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return bulk_create(workout_exercises, WorkoutExerciseCreate,
+                       lambda w: (w.workout_id, w.exercise_id, w.sets, w.reps, w.rest_time),
+                       create_workout_exercises_bulk_db, con)
+
+
 @app.patch("/workout_exercises/{workout_exercise_id}")
 def update_workout_exercise(workout_exercise_id: int, workout_exercise: WorkoutExerciseUpdate, con: Any = Depends(get_connection)):
     """
@@ -561,8 +886,7 @@ def update_workout_exercise(workout_exercise_id: int, workout_exercise: WorkoutE
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="No fields provided for update")
 
-    for column, value in update_data.items():
-        update_workout_exercise_db(con, workout_exercise_id, column, value)
+    update_workout_exercise_db(con, workout_exercise_id, update_data)
 
     return {"message": "Workout exercise updated successfully"}
 
@@ -585,3 +909,14 @@ def delete_workout_exercise(id: int, con: Any = Depends(get_connection)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while deleting the workout-exercise relationship: {str(e)}"
         )
+
+
+# Keep this at the bottom of the file, after every sync endpoint is registered
+if DB_MODE == "async":
+    install_async_routes(app)
+
+if RECORD_INGEST:
+    # Replaces POST /records of either DB_MODE
+    app.router.routes[:] = [route for route in app.router.routes
+                            if not (isinstance(route, APIRoute) and route.path == "/records" and "POST" in route.methods)]
+    app.post("/records", status_code=status.HTTP_202_ACCEPTED, response_model=IngestReceipt)(queue_record)
@@ -0,0 +1,704 @@
+from typing import Any, List, Optional
+
+from fastapi import APIRouter, Body, FastAPI, HTTPException, Query, Request, status, Depends
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from psycopg.errors import IntegrityError, ForeignKeyViolation
+
+import db_async
+from db_setup import async_pool, get_async_connection
+from replicas import get_async_read_connection, replica_router
+from auth import authorize_user_write, current_user_id, hash_password
+from schemas import UserCreate, UserUpdate, RecordCreate, RecordUpdate, RepmaxCreate, RepmaxUpdate, WorkoutCreate, WorkoutUpdate, ExerciseCreate, ExerciseUpdate, CategoryCreate, WorkoutExerciseCreate, WorkoutExerciseResponse, WorkoutExerciseUpdate, UserResponse, ExerciseResponse, WorkoutResponse, RecordResponse, RepmaxResponse, CategoryResponse, Page, user_page_adapter, exercise_page_adapter, record_page_adapter, repmax_page_adapter, workout_page_adapter, workout_exercise_page_adapter, BulkCreateResponse, FullWorkoutResponse, DashboardResponse, PersonalBestResponse, LeaderboardEntry
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, make_page
+from responses import EXPORT_BATCH_SIZE, json_response, ndjson_chunk
+from bulk import bulk_result, validate_items
+
+# async def versions of the endpoints in app.py, backed by db_async.
+# They are only served when DB_MODE=async, see install_async_routes.
+# Every endpoint that queries the database has one, apart from the
+# record ingester, which writes on the sync pool in either mode.
+
+router = APIRouter()
+
+
+def install_async_routes(app: FastAPI):
+    """
+    Replaces the sync endpoints of app with their async versions.
+    Sync endpoints without an async version are kept as they are.
+    """
+    overridden = {(route.path, method)
+                  for route in router.routes for method in route.methods}
+    app.router.routes[:] = [
+        route for route in app.router.routes
+        if not (isinstance(route, APIRoute)
+                and any((route.path, method) in overridden for method in route.methods))
+    ]
+    app.include_router(router)
+
+
+async def stream_ndjson(export_db, request: Request):
+    """
+    Yields the rows of export_db as newline delimited JSON, one chunk per batch
+
+    The connection is checked out here rather than through Depends,
+    since dependencies are torn down before a streaming body is sent
+    """
+    async with replica_router.async_connection(request.scope) as con:
+        async for batch in export_db(con, EXPORT_BATCH_SIZE):
+            yield ndjson_chunk(batch)
+
+
+async def bulk_create(items: list, schema, to_row, create_bulk_db, con):
+    """
+    Validates every item on its own, inserts the valid ones in one transaction
+    and reports the rejected ones by their index in the request body
+
+    Raises exception if more than MAX_BULK_SIZE items are sent
+    """
+    rows, positions, errors = validate_items(items, schema, to_row)
+    inserted, db_errors = await create_bulk_db(con, rows)
+    return bulk_result(items, positions, errors, inserted, db_errors)
+
+
+#                                                        Users Endpoints
+
+
+@router.get("/users/me", status_code=200, response_model=UserResponse)
+async def get_current_user(user_id: int = Depends(current_user_id), con: Any = Depends(get_async_read_connection)):
+    """
+    Returns the user the bearer token belongs to
+
+    Registered before /users/{user_id} so "me" isn't parsed as a user ID
+    """
+    return await db_async.get_user_db(con, user_id)
+
+
+@router.get("/users/{user_id}", status_code=200, response_model=UserResponse)
+async def get_user(user_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns a user by ID
+
+    Raises exception if user is not found
+    """
+    user = await db_async.get_user_db(con, user_id)
+    if user:
+        return user
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.get("/users/{user_id}/dashboard", status_code=200, response_model=DashboardResponse)
+async def get_user_dashboard(user_id: int, records_limit: int = Query(10, ge=1, le=100),
+                             workouts_limit: int = Query(5, ge=1, le=100), con: Any = Depends(get_async_read_connection)):
+    """
+    Returns a user's profile, latest records, current repmax per exercise
+    and recent workouts in one request
+
+    Raises exception if user is not found
+    """
+    return await db_async.get_user_dashboard_db(con, user_id, records_limit, workouts_limit)
+
+
+@router.get("/users/{user_id}/personal-bests", status_code=200, response_model=List[PersonalBestResponse])
+async def get_personal_bests(user_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns the user's heaviest repmax for every exercise
+
+    Raises exception if user is not found
+    """
+    return await db_async.get_personal_bests_db(con, user_id)
+
+
+@router.get("/users", status_code=200, response_model=Page[UserResponse])
+async def get_users(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns one page of users
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_users_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), user_page_adapter)
+
+
+@router.post("/users", status_code=status.HTTP_201_CREATED)
+async def create_user(user: UserCreate):
+    """
+    Creates a user
+
+    Raises exception if name already exists.
+    Also raises exception if something went wrong when creating the user
+    """
+    # Hashed before a connection is checked out, so none sits idle waiting for the hash
+    password = await hash_password(user.password)
+    try:
+        async with async_pool.connection() as con:
+            result = await db_async.create_user_db(con, password, user.name,
+                                                   user.weight, user.user_record_id, user.height)
+        if result:
+            return {'message': f'User created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='User not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Name already exists.")
+
+
+@router.patch('/users/{user_id}', status_code=status.HTTP_200_OK, dependencies=[Depends(authorize_user_write)])
+async def update_user(user_id: int, user: UserUpdate):
+    """
+    Updates one or more fields in a user by ID
+
+    Only the user itself may do so, with a bearer token from /login,
+    unless AUTH_USER_WRITES is off.
+    Raises exception if name already exists, or if no input was provided.
+    """
+    update_data = user.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+    if update_data.get('password') is not None:
+        update_data['password'] = await hash_password(update_data['password'])
+
+    try:
+        # All fields are written by one UPDATE in one transaction
+        async with async_pool.connection() as con:
+            await db_async.update_user_db(con, user_id, update_data)
+        return {'message': 'User updated successfully'}
+
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Username or email already exists.")
+
+
+@router.delete('/users/{user_id}', dependencies=[Depends(authorize_user_write)])
+async def delete_user(user_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a user by ID
+
+    Only the user itself may do so, with a bearer token from /login,
+    unless AUTH_USER_WRITES is off.
+    Raises exception if user could not be found
+    """
+    result = await db_async.delete_user_db(con, user_id)
+    if result:
+        return {'message': f"User with id {result['user_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+#                                                   Records Endpoints
+
+
+@router.get("/records/export")
+async def export_records(request: Request):
+    """
+    Streams every record as newline delimited JSON
+
+    Registered before /records/{user_id} so "export" isn't parsed as a user ID
+    """
+    return StreamingResponse(stream_ndjson(db_async.export_records_db, request), media_type="application/x-ndjson")
+
+
+@router.get("/records/{user_id}", status_code=200, response_model=RecordResponse)
+async def get_record(user_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns records by user ID
+
+    Raises exception if user is not found
+    """
+    record = await db_async.get_record_db(con, user_id)
+    if record:
+        return record
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.get("/records", status_code=200, response_model=Page[RecordResponse])
+async def get_records(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns one page of records
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_records_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), record_page_adapter)
+
+
+@router.post("/records", status_code=status.HTTP_201_CREATED)
+async def create_record(record: RecordCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates a record
+
+    Raises exception if record already exists.
+    Also raises exception if something went wrong when creating the record
+    """
+    try:
+        result = await db_async.create_record_db(
+            con, record.workout_id, record.user_id, record.record_date, record.record_time)
+        if result:
+            return {'message': f'Record created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='Record not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Record already exists.")
+
+
+@router.post("/records/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+async def create_records_bulk(records: List[Any] = Body(..., description="A list of RecordCreate objects"), con: Any = Depends(get_async_connection)):
+    """
+    Creates many records in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return await bulk_create(records, RecordCreate,
+                             lambda r: (r.workout_id, r.user_id, r.record_date, r.record_time),
+                             db_async.create_records_bulk_db, con)
+
+
+@router.put('/records/{record_id}', status_code=status.HTTP_200_OK)
+async def update_record(record_id: int, record_time: RecordUpdate, con: Any = Depends(get_async_connection)):
+    """
+    Updates record time in a user by ID
+
+    Raises exception if no input was provided.
+    """
+    await db_async.update_records_db(con, record_id, record_time)
+    return {'message': 'Record updated successfully'}
+
+
+@router.delete('/records/{record_id}')
+async def delete_record(record_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a record by ID
+
+    Raises exception if record could not be found
+    """
+    result = await db_async.delete_record_db(con, record_id)
+    if result:
+        return {'message': f"Record with id {result['record_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Exercises Endpoints
+
+
+@router.get("/exercises/{exercise_id}", status_code=200, response_model=ExerciseResponse)
+async def get_exercise(exercise_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns an exercise by ID
+
+    Raises exception if exercise is not found
+    """
+    exercise = await db_async.get_exercise_db(con, exercise_id)
+    if exercise:
+        return exercise
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.get("/exercises/{exercise_id}/leaderboard", status_code=200, response_model=List[LeaderboardEntry])
+async def get_leaderboard(exercise_id: int, limit: int = Query(20, ge=1, le=100),
+                          weight_class: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns the top lifters of an exercise by their personal best,
+    optionally only those in one bodyweight class
+
+    Raises exception if exercise is not found or weight_class is unknown
+    """
+    await db_async.get_exercise_db(con, exercise_id)
+    return await db_async.get_leaderboard_db(con, exercise_id, limit, weight_class)
+
+
+@router.get("/exercises", status_code=200, response_model=Page[ExerciseResponse])
+async def get_exercises(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns one page of exercises
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_exercises_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), exercise_page_adapter)
+
+
+@router.post("/exercises", status_code=status.HTTP_201_CREATED)
+async def create_exercise(exercise: ExerciseCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates an exercise
+
+    Raises exception if exercise already exists.
+    Also raises exception if something went wrong when creating the exercise
+    """
+    try:
+        result = await db_async.create_exercise_db(con, exercise.name, exercise.weight,
+                                                   exercise.repmax_id, exercise.primary_muscle, exercise.secondary_muscle,
+                                                   exercise.category_id, exercise.base_exercise)
+        if result:
+            return {'message': f'Exercise created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='Exericse not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Exercise already exists.")
+
+
+@router.patch('/exercises/{exercise_id}', status_code=status.HTTP_200_OK)
+async def update_exercise(exercise_id: int, exercise: ExerciseUpdate, con: Any = Depends(get_async_connection)):
+    """
+    Updates one or more fields in an exercise by ID
+
+    Raises exception if exercise already exists, or if no input was provided.
+    """
+    update_data = exercise.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+
+    try:
+        # All fields are written by one UPDATE in one transaction
+        await db_async.update_exercise_db(con, exercise_id, update_data)
+        return {'message': 'Exercise updated successfully'}
+
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Exercise already exists.")
+
+
+@router.delete('/exercises/{exercise_id}')
+async def delete_exercise(exercise_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a exercise by ID
+
+    Raises exception if exercise could not be found
+    """
+    result = await db_async.delete_exercise_db(con, exercise_id)
+    if result:
+        return {'message': f"Exercise with id {result['exercise_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Workouts Endpoints
+
+
+@router.get("/workouts/{workout_id}", status_code=200, response_model=WorkoutResponse)
+async def get_workout(workout_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns a workout by ID
+
+    Raises exception if workout is not found
+    """
+    workout = await db_async.get_workout_db(con, workout_id)
+    if workout:
+        return workout
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.get("/workouts/{workout_id}/full", status_code=200, response_model=FullWorkoutResponse)
+async def get_full_workout(workout_id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns a workout with its exercises, in order, and each exercise's details
+
+    Replaces fetching the workout, its workout_exercises and every exercise one by one
+    """
+    return await db_async.get_full_workout_db(con, workout_id)
+
+
+@router.get("/workouts", status_code=200, response_model=Page[WorkoutResponse])
+async def get_workouts(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns one page of workouts
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_workouts_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), workout_page_adapter)
+
+
+@router.post("/workouts", status_code=status.HTTP_201_CREATED)
+async def create_workout(workout: WorkoutCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates a workout
+
+    Raises exception if workout already exists.
+    Also raises exception if something went wrong when creating the workout
+    """
+    try:
+        result = await db_async.create_workout_db(con, workout.name, workout.timecap,
+                                                  workout.record_id, workout.for_kids)
+        if result:
+            return {'message': f'Workout created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='Workout not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Workout already exists.")
+
+
+@router.patch('/workouts/{workout_id}', status_code=status.HTTP_200_OK)
+async def update_workout(workout_id: int, workout: WorkoutUpdate, con: Any = Depends(get_async_connection)):
+    """
+    Updates one or more fields in a workout by ID
+
+    Raises exception if workout already exists, or if no input was provided.
+    """
+    update_data = workout.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+
+    try:
+        # All fields are written by one UPDATE in one transaction
+        await db_async.update_workout_db(con, workout_id, update_data)
+        return {'message': 'Workout updated successfully'}
+
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Workout already exists.")
+
+
+@router.delete('/workouts/{workout_id}')
+async def delete_workout(workout_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a workout by ID
+
+    Raises exception if workout could not be found
+    """
+    result = await db_async.delete_workout_db(con, workout_id)
+    if result:
+        return {'message': f"Workout with id {result['workout_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Repmax Endpoints
+
+@router.get("/repmaxs", status_code=200, response_model=Page[RepmaxResponse])
+async def get_repmaxs(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Returns one page of repmaxs
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_repmaxs_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'id'), repmax_page_adapter)
+
+
+@router.post("/repmaxs", status_code=status.HTTP_201_CREATED)
+async def create_repmax(repmax: RepmaxCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates a repmax
+
+    Raises exception if repmax already exists.
+    Also raises exception if something went wrong when creating the repmax
+    """
+    try:
+        result = await db_async.create_repmax_db(
+            con, repmax.exercise_id, repmax.user_id, repmax.weight)
+        if result:
+            return {'message': f'Repmax created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='Repmax not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Repmax already exists.")
+
+
+@router.post("/repmaxs/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+async def create_repmaxs_bulk(repmaxs: List[Any] = Body(..., description="A list of RepmaxCreate objects"), con: Any = Depends(get_async_connection)):
+    """
+    Creates many repmaxs in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return await bulk_create(repmaxs, RepmaxCreate,
+                             lambda r: (r.exercise_id, r.user_id, r.weight),
+                             db_async.create_repmaxs_bulk_db, con)
+
+
+@router.patch('/repmaxs/{repmax_id}', status_code=status.HTTP_200_OK)
+async def update_repmax(repmax_id: int, repmax: RepmaxUpdate, con: Any = Depends(get_async_connection)):
+    """
+    Updates one or more fields in a repmax by ID
+
+    Raises exception if repmax already exists, or if no input was provided.
+    """
+    update_data = repmax.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+
+    try:
+        # All fields are written by one UPDATE in one transaction
+        await db_async.update_repmax_db(con, repmax_id, update_data)
+        return {'message': 'Repmax updated successfully'}
+
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Repmax already exists.")
+
+
+@router.delete('/repmaxs/{repmax_id}')
+async def delete_repmax(repmax_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a repmax by ID
+
+    Raises exception if repmax could not be found
+    """
+    result = await db_async.delete_repmax_db(con, repmax_id)
+    if result:
+        return {'message': f"Repmax with id {result['repmax_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Categories Endpoints
+
+
+@router.get("/categories", status_code=200, response_model=List[CategoryResponse])
+async def get_categories(con: Any = Depends(get_async_read_connection)):
+    """
+    Returns a list of all categories
+    """
+    return await db_async.get_categories_db(con)
+
+
+@router.post("/categories", status_code=status.HTTP_201_CREATED)
+async def create_category(category: CategoryCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates a category
+
+    Raises exception if category already exists.
+    Also raises exception if something went wrong when creating the category
+    """
+    try:
+        result = await db_async.create_category_db(con, category.name)
+        if result:
+            return {'message': f'Category created sucessfully with id: {result}'}
+        raise HTTPException(
+            detail='Category not created properly', status_code=400)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="Category already exists.")
+
+
+@router.delete('/categories/{category_id}')
+async def delete_category(category_id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a category by ID
+
+    Raises exception if category could not be found
+    """
+    result = await db_async.delete_category_db(con, category_id)
+    if result:
+        return {'message': f"Category with id {result['category_id']} deleted"}
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                               Workout_exercises Endpoints
+
+
+@router.get("/workout_exercises", response_model=Page[WorkoutExerciseResponse], status_code=200)
+async def get_workout_exercises(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, con: Any = Depends(get_async_read_connection)):
+    """
+    Fetches one page of workout-exercise relationships
+
+    Pass the returned next_after token as after to fetch the next page
+    """
+    rows = await db_async.get_workout_exercises_db(con, limit, decode_cursor(after))
+    return json_response(make_page(rows, limit, 'workout_exercise_id'), workout_exercise_page_adapter)
+
+
+@router.get("/workout_exercises/export")
+async def export_workout_exercises(request: Request):
+    """
+    Streams every workout-exercise relationship as newline delimited JSON
+
+    Registered before /workout_exercises/{id} so "export" isn't parsed as an ID
+    """
+    return StreamingResponse(stream_ndjson(db_async.export_workout_exercises_db, request),
+                             media_type="application/x-ndjson")
+
+
+@router.get("/workout_exercises/{id}", response_model=WorkoutExerciseResponse, status_code=200)
+async def get_workout_exercise(id: int, con: Any = Depends(get_async_read_connection)):
+    """
+    Fetches a single workout-exercise relationship by ID
+    """
+    workout_exercise = await db_async.get_workout_exercises_by_workout_id_db(con, id)
+    if not workout_exercise:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Workout-Exercise relationship with ID {id} not found."
+        )
+    return workout_exercise
+
+
+@router.post("/workout_exercises", response_model=dict, status_code=201)
+async def create_workout_exercise(workout_exercise: WorkoutExerciseCreate, con: Any = Depends(get_async_connection)):
+    """
+    Creates a new workout-exercise relationship
+    """
+    try:
+        result_id = await db_async.create_workout_exercise_db(con, workout_exercise.workout_id, workout_exercise.exercise_id,
+                                                              workout_exercise.sets, workout_exercise.reps, workout_exercise.rest_time)
+        return {"message": f"Workout-Exercise relationship created successfully with ID {result_id}"}
+    except ForeignKeyViolation:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid workout_id or exercise_id provided."
+        )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Duplicate workout-exercise relationship detected."
+        )
+
+
+@router.post("/workout_exercises/bulk", status_code=status.HTTP_201_CREATED, response_model=BulkCreateResponse)
+async def create_workout_exercises_bulk(workout_exercises: List[Any] = Body(..., description="A list of WorkoutExerciseCreate objects"), con: Any = Depends(get_async_connection)):
+    """
+    Creates many workout-exercise relationships in one transaction
+
+    Returns the new IDs in request order, items that failed
+    validation are listed in errors instead of failing the whole batch
+    """
+    return await bulk_create(workout_exercises, WorkoutExerciseCreate,
+                             lambda w: (w.workout_id, w.exercise_id, w.sets, w.reps, w.rest_time),
+                             db_async.create_workout_exercises_bulk_db, con)
+
+
+@router.patch("/workout_exercises/{workout_exercise_id}")
+async def update_workout_exercise(workout_exercise_id: int, workout_exercise: WorkoutExerciseUpdate, con: Any = Depends(get_async_connection)):
+    """
+    Updates one or more fields in a workout_exercises by ID
+
+    Raises exception if no input was provided.
+    """
+    update_data = workout_exercise.model_dump(exclude_unset=True)
+    if not update_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="No fields provided for update")
+
+    await db_async.update_workout_exercise_db(con, workout_exercise_id, update_data)
+
+    return {"message": "Workout exercise updated successfully"}
+
+
+@router.delete("/workout_exercises/{id}")
+async def delete_workout_exercise(id: int, con: Any = Depends(get_async_connection)):
+    """
+    Deletes a workout-exercise relationship by ID
+    """
+    result = await db_async.delete_workout_exercise_db(con, id)
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Workout-Exercise relationship with ID {id} not found."
+        )
+    return {"message": f"Workout-Exercise relationship with ID {id} deleted successfully."}
@@ -0,0 +1,219 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+
+import db_async
+from db import get_credentials_db, get_password_hash_db, session_cache, update_password_hash_db
+from db_setup import DB_MODE, async_pool, pool
+
+# Password hashing and bearer tokens.
+# Passwords are stored as scrypt hashes. Hashing runs on its own small
+# executor, so logins and sign-ups can never tie up the threads that serve
+# requests, and at most AUTH_HASH_WORKERS hashes are computed at a time.
+# POST /login trades name and password for a signed token. The token carries
+# the user id, its expiry and a fingerprint of the password hash, so changing
+# the password invalidates every token issued before. Every request checks the
+# token's signature and expiry, which is one HMAC. Whether the fingerprint
+# still matches the password hash is kept in session_cache, so only the first
+# request of a session queries the database.
+
+AUTH_SECRET = os.getenv("AUTH_SECRET")
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", "3600"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+# PATCH and DELETE /users/{user_id} need a token of that user, set to false
+# to keep serving clients that predate /login while they migrate
+AUTH_USER_WRITES = os.getenv("AUTH_USER_WRITES", "true").lower() == "true"
+
+# 16 MiB of memory and roughly 50 ms of CPU per hash
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+logger = logging.getLogger("trainify.auth")
+
+if not AUTH_SECRET:
+    # Every worker would sign with its own key and reject the tokens of the others
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError("AUTH_SECRET must be set when running more than one worker")
+    logger.warning("AUTH_SECRET is not set, using a random key. Tokens only work in this process "
+                   "until it restarts, and not across workers")
+    AUTH_SECRET = secrets.token_hex(32)
+_key = AUTH_SECRET.encode()
+
+_hash_pool = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024)
+
+
+def _hash_password(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def _verify_password(password: str, stored: str) -> bool:
+    if not stored.startswith("scrypt$"):
+        # Saved before passwords were hashed, login_user rehashes it
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, n, r, p, salt, digest = stored.split("$")
+    return hmac.compare_digest(_scrypt(password, _unb64(salt), int(n), int(r), int(p)), _unb64(digest))
+
+
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes password on the hashing executor
+    """
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, _hash_password, password)
+
+
+async def verify_password(password: str, stored: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, _verify_password, password, stored)
+
+
+# Compared against when the name is unknown, so a failed login takes as long either way
+_DUMMY_HASH = _hash_password(secrets.token_hex(8))
+
+
+def _fingerprint(stored: str) -> str:
+    return hashlib.blake2b(stored.encode(), digest_size=6).hexdigest()
+
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(_key, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, stored: str) -> tuple[str, int]:
+    """
+    Returns a token for user_id and when it expires, as a unix timestamp
+    """
+    expires_at = int(time.time()) + TOKEN_TTL
+    payload = f"{user_id}.{expires_at}.{_fingerprint(stored)}"
+    return f"{payload}.{_sign(payload)}", expires_at
+
+
+def _parse_token(token: str) -> tuple[int, int, str, str] | None:
+    try:
+        user_id, expires_at, fingerprint, signature = token.split(".")
+        return int(user_id), int(expires_at), fingerprint, signature
+    except ValueError:
+        return None
+
+
+def _unauthorized(detail: str = "Not authenticated") -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail,
+                         headers={"WWW-Authenticate": "Bearer"})
+
+
+def _with_connection(db_function, *args):
+    with pool.connection() as con:
+        return db_function(con, *args)
+
+
+async def _query(db_function, async_db_function, *args):
+    """
+    Runs db_function on the sync pool, or its db_async twin on the async pool when DB_MODE=async
+    """
+    if DB_MODE == "async":
+        async with async_pool.connection() as con:
+            return await async_db_function(con, *args)
+    return await run_in_threadpool(_with_connection, db_function, *args)
+
+
+async def login_user(name: str, password: str) -> dict:
+    """
+    Checks name and password and returns a new token
+
+    A password stored in plain text, or hashed with older parameters, is rehashed
+
+    Raises 401 if the name or the password is wrong
+    """
+    credentials = await _query(get_credentials_db, db_async.get_credentials_db, name)
+    stored = credentials['password'] if credentials else _DUMMY_HASH
+    if not await verify_password(password, stored) or credentials is None:
+        raise _unauthorized("Wrong name or password")
+
+    user_id = credentials['user_id']
+    if needs_rehash(stored):
+        new_hash = await hash_password(password)
+        if await _query(update_password_hash_db, db_async.update_password_hash_db, user_id, stored, new_hash):
+            stored = new_hash
+    token, expires_at = issue_token(user_id, stored)
+    return {"access_token": token, "token_type": "bearer", "expires_at": expires_at}
+
+
+async def _check_fingerprint(user_id: int, fingerprint: str) -> bool:
+    stored = await _query(get_password_hash_db, db_async.get_password_hash_db, user_id)
+    return stored is not None and hmac.compare_digest(_fingerprint(stored), fingerprint)
+
+
+async def current_user_id(request: Request) -> int:
+    """
+    FastAPI dependency returning the id of the user the bearer token belongs to
+
+    Raises 401 if the token is missing, invalid or expired
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _unauthorized()
+    parsed = _parse_token(token)
+    if parsed is None:
+        raise _unauthorized("Invalid token")
+    user_id, expires_at, fingerprint, signature = parsed
+    # Checked on every request, the signature covers the expiry and the fingerprint
+    if not hmac.compare_digest(_sign(f"{user_id}.{expires_at}.{fingerprint}"), signature):
+        raise _unauthorized("Invalid token")
+    if expires_at <= time.time():
+        raise _unauthorized("Token expired")
+
+    found, _ = session_cache.lookup((user_id, fingerprint))
+    if found:
+        return user_id
+    generation = session_cache.generation
+    # The password may have changed, or the user been deleted, since the token was issued
+    if not await _check_fingerprint(user_id, fingerprint):
+        raise _unauthorized("Invalid token")
+    session_cache.store((user_id, fingerprint), True, generation)
+    return user_id
+
+
+def require_user(user_id: int, authenticated_id: int):
+    """
+    Raises 403 unless the authenticated user is user_id
+    """
+    if user_id != authenticated_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to change another user")
+
+
+async def authorize_user_write(user_id: int, request: Request):
+    """
+    FastAPI dependency of PATCH and DELETE /users/{user_id}
+
+    Raises 401 without a valid token and 403 if it belongs to another user,
+    unless AUTH_USER_WRITES is off
+    """
+    if AUTH_USER_WRITES:
+        require_user(user_id, await current_user_id(request))
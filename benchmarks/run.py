@@ -0,0 +1,350 @@
+"""
+End-to-end load benchmark for the API.
+
+Boots app.py under uvicorn against a dedicated Postgres database, seeds it,
+drives the request mixes from workloads.py at fixed concurrency levels and
+reports throughput and p50/p95/p99 latency per route as JSON.
+
+    python benchmarks/run.py --scenario mixed --concurrency 1 8 32
+    python benchmarks/run.py --save-baseline       # store this run as the baseline
+    python benchmarks/run.py --max-regression 10   # exit 1 if anything got 10% worse
+
+The seed truncates every table, so it refuses to run against the database in .env.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+from dotenv import dotenv_values, find_dotenv, load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from migrations import migrate  # noqa: E402
+from seed import credentials, seed  # noqa: E402
+from workloads import HOT_ROWS, SCENARIOS, Workload  # noqa: E402
+
+DEFAULT_OUTPUT = ROOT / "benchmarks" / "last_run.json"
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load benchmark for the Trainify API")
+    parser.add_argument("--database", default="trainify_bench",
+                        help="database to seed and benchmark against, created if missing (default trainify_bench)")
+    parser.add_argument("--scenario", nargs="+", default=["mixed"], choices=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured per run")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--exercises", type=int, default=50)
+    parser.add_argument("--records-per-user", type=int, default=20)
+    parser.add_argument("--repmaxs-per-user", type=int, default=10)
+    parser.add_argument("--workouts-per-user", type=int, default=2)
+    parser.add_argument("--exercises-per-workout", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the dataset and the request mix")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in --database")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="exit 1 if a route's p95 or throughput is this many percent worse than the baseline")
+    return parser.parse_args()
+
+
+def connection_settings(database: str) -> dict:
+    load_dotenv(override=True)
+    return {
+        "dbname": database,
+        "user": os.getenv("DATABASE_USER", "postgres"),
+        "password": os.getenv("PASSWORD"),
+        "host": os.getenv("DATABASE_HOST", "localhost"),
+        "port": os.getenv("DATABASE_PORT", "5432"),
+    }
+
+
+def check_database(database: str):
+    """
+    db_setup loads .env with override=True, so a DATABASE_NAME there would
+    point the server (and not the seeded database) at the real data
+    """
+    configured = dotenv_values(find_dotenv(str(ROOT / ".env"))).get("DATABASE_NAME")
+    if configured and configured != database:
+        sys.exit(f".env sets DATABASE_NAME={configured}, which would override --database {database}. "
+                 f"Move .env aside or point it at the benchmark database.")
+
+
+def ensure_database(settings: dict):
+    maintenance = psycopg2.connect(**{**settings, "dbname": "postgres"})
+    maintenance.autocommit = True
+    try:
+        with maintenance.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (settings["dbname"],))
+            if cursor.fetchone() is None:
+                cursor.execute(f'CREATE DATABASE "{settings["dbname"]}";')
+    finally:
+        maintenance.close()
+
+
+def prepare_data(args, settings: dict) -> dict:
+    ensure_database(settings)
+    con = psycopg2.connect(**settings)
+    try:
+        migrate(con)
+        if args.skip_seed:
+            counts = {}
+            with con, con.cursor() as cursor:
+                for table in ("users", "exercises", "records", "repmax", "workouts", "workout_exercises"):
+                    cursor.execute(f"SELECT count(*) FROM {table};")
+                    counts[table] = cursor.fetchone()[0]
+            return counts
+        return seed(con, args.users, args.exercises, args.records_per_user, args.repmaxs_per_user,
+                    args.workouts_per_user, args.exercises_per_workout, random.Random(args.seed))
+    finally:
+        con.close()
+
+
+def start_server(args, log):
+    # One key for every worker, so a token from /login works on all of them
+    env = {**os.environ, "DATABASE_NAME": args.database,
+           "AUTH_SECRET": os.environ.get("AUTH_SECRET", "trainify-benchmark-secret")}
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            con = http.client.HTTPConnection("127.0.0.1", args.port, timeout=1)
+            con.request("GET", "/")
+            if con.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    log.seek(0)
+    sys.exit("uvicorn did not come up:\n" + log.read().decode(errors="replace"))
+
+
+def worker(workload: Workload, port: int, measure_from: float, stop_at: float, results: dict):
+    con = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.perf_counter() < stop_at:
+        route, method, path, body, extra_headers = workload.next_request()
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        headers.update(extra_headers or {})
+        started = time.perf_counter()
+        try:
+            con.request(method, path, body=payload, headers=headers)
+            response = con.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            con.close()
+            con = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            data, status = b"", 0
+        elapsed = time.perf_counter() - started
+
+        if route == "GET /records":
+            workload.page_done(data if status == 200 else b"")
+        if started < measure_from:
+            continue
+        stats = results.setdefault(route, {"latencies": [], "errors": 0, "statuses": {}})
+        stats["latencies"].append(elapsed)
+        stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        if not 200 <= status < 400:
+            stats["errors"] += 1
+    con.close()
+
+
+def percentile_ms(cuts: list, p: int) -> float:
+    return round(cuts[p - 1] * 1000, 3)
+
+
+def summarize(route_stats: dict, duration: float) -> dict:
+    latencies = sorted(route_stats["latencies"])
+    # quantiles needs two points, a single sample is every percentile
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": route_stats["errors"],
+        "statuses": {str(status): count for status, count in sorted(route_stats["statuses"].items())},
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": percentile_ms(cuts, 50),
+        "p95_ms": percentile_ms(cuts, 95),
+        "p99_ms": percentile_ms(cuts, 99),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def log_in(port: int, counts: dict) -> dict:
+    """
+    Logs in the users the PATCH workloads write to and returns their tokens
+
+    Users whose login fails get no token, their PATCHes then show up as errors
+    """
+    tokens = {}
+    con = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        for user_id in range(1, min(HOT_ROWS, counts.get("users", 0)) + 1):
+            name, password = credentials(user_id)
+            con.request("POST", "/login", body=json.dumps({"name": name, "password": password}).encode(),
+                        headers={"Content-Type": "application/json"})
+            response = con.getresponse()
+            data = response.read()
+            if response.status == 200:
+                tokens[user_id] = json.loads(data)["access_token"]
+    finally:
+        con.close()
+    return tokens
+
+
+def run_once(args, scenario: str, concurrency: int, counts: dict, tokens: dict) -> dict:
+    now = time.perf_counter()
+    measure_from = now + args.warmup
+    stop_at = measure_from + args.duration
+    per_thread = [{} for _ in range(concurrency)]
+    threads = [
+        threading.Thread(target=worker, args=(Workload(scenario, counts, random.Random(args.seed + i), tokens),
+                                              args.port, measure_from, stop_at, per_thread[i]))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = {}
+    for results in per_thread:
+        for route, stats in results.items():
+            target = merged.setdefault(route, {"latencies": [], "errors": 0, "statuses": {}})
+            target["latencies"].extend(stats["latencies"])
+            target["errors"] += stats["errors"]
+            for status, count in stats["statuses"].items():
+                target["statuses"][status] = target["statuses"].get(status, 0) + count
+
+    routes = {route: summarize(stats, args.duration) for route, stats in sorted(merged.items())}
+    total = sum(route["requests"] for route in routes.values())
+    errors = sum(route["errors"] for route in routes.values())
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "duration_s": args.duration,
+        "throughput_rps": round(total / args.duration, 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "routes": routes,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, max_regression: float | None) -> bool:
+    """
+    Prints p95 and throughput changes per route against the baseline
+
+    Returns True if any route regressed by more than max_regression percent
+    """
+    previous = {(run["scenario"], run["concurrency"]): run for run in baseline["runs"]}
+    regressed = False
+    print(f"\nCompared to baseline {baseline['meta'].get('commit')} ({baseline['meta'].get('started_at')})")
+    print(f"{'scenario':<8} {'conc':>4}  {'route':<34} {'p95 ms':>18} {'rps':>18}")
+    for run in results["runs"]:
+        before_run = previous.get((run["scenario"], run["concurrency"]))
+        if before_run is None:
+            continue
+        for route, now in run["routes"].items():
+            before = before_run["routes"].get(route)
+            if before is None:
+                continue
+            p95_change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            rps_change = ((now["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+                          if before["throughput_rps"] else 0.0)
+            flag = ""
+            if max_regression is not None and (p95_change > max_regression or -rps_change > max_regression):
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"{run['scenario']:<8} {run['concurrency']:>4}  {route:<34} "
+                  f"{now['p95_ms']:>9.2f} ({p95_change:+6.1f}%) {now['throughput_rps']:>9.1f} ({rps_change:+6.1f}%){flag}")
+    return regressed
+
+
+def main():
+    args = parse_args()
+    check_database(args.database)
+    settings = connection_settings(args.database)
+
+    print(f"Preparing {args.database}...")
+    counts = prepare_data(args, settings)
+    print("Rows: " + ", ".join(f"{table}={count}" for table, count in counts.items()))
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "uvicorn_workers": args.workers,
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+            "rows": counts,
+            "env": {key: os.environ[key] for key in sorted(os.environ)
+                    if key.startswith(("DB_", "CACHE_", "PREPARED_", "STRICT_", "RESPONSE_"))},
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryFile() as log:
+        server = start_server(args, log)
+        try:
+            tokens = log_in(args.port, counts)
+            for scenario in args.scenario:
+                for concurrency in args.concurrency:
+                    run = run_once(args, scenario, concurrency, counts, tokens)
+                    results["runs"].append(run)
+                    print(f"{scenario:<8} concurrency {concurrency:>3}: {run['throughput_rps']:>8.1f} req/s, "
+                          f"errors {run['error_rate']:.2%}")
+                    for route, stats in run["routes"].items():
+                        print(f"    {route:<34} p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  "
+                              f"p99 {stats['p99_ms']:>8.2f} ms  {stats['throughput_rps']:>8.1f} req/s")
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"\nWrote {args.output}")
+
+    regressed = False
+    if args.baseline.exists() and not args.save_baseline:
+        regressed = compare(results, json.loads(args.baseline.read_text()), args.max_regression)
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import random
+
+from psycopg2.extras import execute_values
+
+# Fills a benchmark database with a dataset of configurable size.
+# Ids are predictable (every table is truncated with RESTART IDENTITY first),
+# so the workloads can pick valid ids without asking the API.
+
+TABLES = ('workout_exercises', 'workouts', 'repmax', 'records', 'exercises', 'categories', 'users')
+CATEGORIES = ('Strength', 'Cardio', 'Flexibility', 'Endurance')
+MUSCLES = ('Chest', 'Back', 'Legs', 'Shoulders', 'Arms', 'Core', 'Glutes')
+
+
+def credentials(user_id: int) -> tuple[str, str]:
+    """
+    Name and password of a seeded user
+    """
+    return f"lifter_{user_id - 1}", f"pw{user_id - 1}"
+
+
+def seed(con, users: int, exercises: int, records_per_user: int, repmaxs_per_user: int,
+         workouts_per_user: int, exercises_per_workout: int, rng: random.Random) -> dict:
+    """
+    Replaces the contents of every table with generated rows
+
+    Returns the number of rows per table, which the workloads use as id ranges
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE;")
+
+            execute_values(cursor, "INSERT INTO users (password, name, weight, user_record_id, height) VALUES %s",
+                           [(credentials(user_id)[1], credentials(user_id)[0], rng.randint(50, 140), None,
+                             rng.randint(150, 210)) for user_id in range(1, users + 1)], page_size=1000)
+            execute_values(cursor, "INSERT INTO categories (name) VALUES %s",
+                           [(name,) for name in CATEGORIES])
+            execute_values(cursor, """INSERT INTO exercises (exercise_name, exercise_weight, repmax_id, primary_muscle,
+                                      secondary_muscle, category_id, base_exercise) VALUES %s""",
+                           [(f"exercise_{i}", rng.randint(0, 200), None, rng.choice(MUSCLES), rng.choice(MUSCLES),
+                             rng.randint(1, len(CATEGORIES)), rng.random() < 0.3)
+                            for i in range(exercises)], page_size=1000)
+            execute_values(cursor, "INSERT INTO records (workout_id, user_id, record_date, record_time) VALUES %s",
+                           [(1, user_id, f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                             f"{rng.randint(0, 2):02d}:{rng.randint(0, 59):02d}:00")
+                            for user_id in range(1, users + 1) for _ in range(records_per_user)], page_size=1000)
+            execute_values(cursor, "INSERT INTO repmax (exercise_id, user_id, weight) VALUES %s",
+                           [(rng.randint(1, exercises), user_id, rng.randint(20, 300))
+                            for user_id in range(1, users + 1) for _ in range(repmaxs_per_user)], page_size=1000)
+
+            # Workouts hang off the user's own records
+            workouts = [(f"workout_{user_id}_{i}", rng.choice((20, 30, 45, 60)),
+                         (user_id - 1) * records_per_user + rng.randint(1, records_per_user), rng.random() < 0.1)
+                        for user_id in range(1, users + 1) for i in range(workouts_per_user)] if records_per_user else []
+            execute_values(cursor, "INSERT INTO workouts (workout_name, timecap, record_id, for_kids) VALUES %s",
+                           workouts, page_size=1000)
+            execute_values(cursor, "INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, rest_time) VALUES %s",
+                           [(workout_id, rng.randint(1, exercises), rng.randint(1, 6), rng.randint(1, 15), rng.choice((60, 90, 120)))
+                            for workout_id in range(1, len(workouts) + 1) for _ in range(exercises_per_workout)], page_size=1000)
+            cursor.execute("ANALYZE;")
+
+    return {
+        'users': users,
+        'exercises': exercises,
+        'records': users * records_per_user,
+        'repmax': users * repmaxs_per_user,
+        'workouts': len(workouts),
+        'workout_exercises': len(workouts) * exercises_per_workout,
+    }
@@ -0,0 +1,88 @@
+import json
+import random
+
+# Request mixes the benchmark can drive.
+# A request is (route, method, path, body, headers), route is the label the latencies
+# are reported under. Every worker thread owns one Workload, so the pagination
+# cursors it follows are never shared between threads.
+
+# name -> {request kind: weight}
+SCENARIOS = {
+    'read': {'dashboard': 40, 'records_page': 30, 'leaderboard': 15, 'full_workout': 15},
+    'write': {'bulk_records': 100},
+    'patch': {'patch_workout_exercise': 60, 'patch_user': 40},
+    'mixed': {'dashboard': 30, 'records_page': 20, 'leaderboard': 10, 'full_workout': 10,
+              'bulk_records': 5, 'patch_workout_exercise': 15, 'patch_user': 10},
+}
+
+PAGE_SIZE = 50
+PAGES_PER_SCAN = 5
+BULK_SIZE = 100
+# PATCHes go to a small set of rows, so writers really contend on them
+HOT_ROWS = 20
+
+
+class Workload:
+    def __init__(self, scenario: str, counts: dict, rng: random.Random, tokens: dict):
+        kinds = SCENARIOS[scenario]
+        self.kinds = list(kinds)
+        self.weights = list(kinds.values())
+        self.counts = counts
+        self.rng = rng
+        # user_id -> bearer token of the hot users, PATCH /users/{id} needs the user's own
+        self.tokens = tokens
+        self.next_after = None
+        self.pages_left = 0
+
+    def _id(self, table: str) -> int:
+        return self.rng.randint(1, max(1, self.counts[table]))
+
+    def _hot_id(self, table: str) -> int:
+        return self.rng.randint(1, max(1, min(HOT_ROWS, self.counts[table])))
+
+    def next_request(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        request = getattr(self, kind)()
+        return request if len(request) == 5 else (*request, None)
+
+    def page_done(self, response_body: bytes):
+        """
+        Remembers where the last records page ended, so the next one continues from there
+        """
+        try:
+            self.next_after = json.loads(response_body).get('next_after')
+        except (ValueError, AttributeError):
+            self.next_after = None
+
+    def dashboard(self):
+        return 'GET /users/{id}/dashboard', 'GET', f"/users/{self._id('users')}/dashboard", None
+
+    def records_page(self):
+        if self.pages_left == 0 or not self.next_after:
+            self.pages_left = PAGES_PER_SCAN
+            self.next_after = None
+        self.pages_left -= 1
+        path = f"/records?limit={PAGE_SIZE}"
+        if self.next_after:
+            path += f"&after={self.next_after}"
+        return 'GET /records', 'GET', path, None
+
+    def leaderboard(self):
+        return 'GET /exercises/{id}/leaderboard', 'GET', f"/exercises/{self._id('exercises')}/leaderboard", None
+
+    def full_workout(self):
+        return 'GET /workouts/{id}/full', 'GET', f"/workouts/{self._id('workouts')}/full", None
+
+    def bulk_records(self):
+        body = [{'workout_id': 1, 'user_id': self._id('users'), 'record_date': '2025-06-01T00:00:00',
+                 'record_time': f"00:{self.rng.randint(10, 59)}:00"} for _ in range(BULK_SIZE)]
+        return 'POST /records/bulk', 'POST', '/records/bulk', body
+
+    def patch_workout_exercise(self):
+        return ('PATCH /workout_exercises/{id}', 'PATCH', f"/workout_exercises/{self._hot_id('workout_exercises')}",
+                {'sets': self.rng.randint(1, 6), 'reps': self.rng.randint(1, 15)})
+
+    def patch_user(self):
+        user_id = self._hot_id('users')
+        headers = {'Authorization': f"Bearer {self.tokens.get(user_id, '')}"}
+        return 'PATCH /users/{id}', 'PATCH', f"/users/{user_id}", {'weight': self.rng.randint(50, 140)}, headers
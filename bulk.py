@@ -0,0 +1,47 @@
+import os
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+
+# Shared by the bulk endpoints of app.py and async_routes.py.
+# Every item is validated on its own, so one bad item only rejects itself,
+# and the rejected ones are reported by their index in the request body.
+
+MAX_BULK_SIZE = int(os.getenv("MAX_BULK_SIZE", "1000"))
+
+
+def validate_items(items: list, schema, to_row):
+    """
+    Validates items against schema and converts the valid ones with to_row
+
+    Returns (rows, positions, errors), positions maps every row back to its item
+    Raises exception if more than MAX_BULK_SIZE items are sent
+    """
+    if len(items) > MAX_BULK_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {MAX_BULK_SIZE} items can be created at once")
+
+    rows, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            model = schema.model_validate(item)
+        except ValidationError as e:
+            errors.append({'index': index, 'errors': e.errors(include_url=False, include_context=False, include_input=False)})
+            continue
+        positions.append(index)
+        rows.append(to_row(model))
+    return rows, positions, errors
+
+
+def bulk_result(items: list, positions: list, errors: list, inserted: list, db_errors: dict) -> dict:
+    """
+    Puts the ids and errors of the insert back into request order
+    """
+    ids = [None] * len(items)
+    for position, new_id in zip(positions, inserted):
+        ids[position] = new_id
+    for row_index, message in db_errors.items():
+        errors.append({'index': positions[row_index], 'errors': [message]})
+
+    errors.sort(key=lambda error: error['index'])
+    return {'ids': ids, 'errors': errors}
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Small in-process LRU caches with a time to live.
+# Every cache registers itself in CACHES so its counters can be scraped.
+# Writes in this process invalidate entries right away, the TTL bounds how
+# long a write made by another worker process can go unnoticed.
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+
+CACHES = {}
+
+# Set by read_through(), lookups then miss and values are loaded from the database
+_read_through = ContextVar("read_through", default=False)
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        # Bumped by every invalidation, so a value loaded before a write
+        # finished is never stored after the write invalidated its key
+        self._generation = 0
+        self._invalidated_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        CACHES[name] = self
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def lookup(self, key):
+        """
+        Returns (True, value) on a hit and (False, None) on a miss
+        """
+        with self._lock:
+            if _read_through.get():
+                self.misses += 1
+                return False, None
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value, generation: int, staleness: float = 0.0):
+        """
+        Stores value unless something was invalidated since generation was read
+
+        staleness is how far behind the primary the value may be (see replicas.py),
+        such a value is only stored once the last invalidation is older than that
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            if staleness and time.monotonic() - self._invalidated_at < staleness:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, load, staleness: float = 0.0):
+        """
+        Returns the cached value for key, or calls load() and caches its result
+        """
+        found, value = self.lookup(key)
+        if found:
+            return value
+        generation = self._generation
+        value = load()
+        self.store(key, value, generation, staleness)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        """
+        Drops every entry whose key matches predicate
+        """
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+@contextmanager
+def read_through():
+    """
+    Makes every cache miss inside the block, the values loaded instead still refresh the caches
+
+    ETagMiddleware builds the bodies it keeps under a table version with it, so a row
+    another worker changed a moment ago is never cached under the version that includes the change
+    """
+    token = _read_through.set(True)
+    try:
+        yield
+    finally:
+        _read_through.reset(token)
+
+
+def staleness(con) -> float:
+    """
+    Seconds the data read through con may lag behind the primary, 0 for the primary itself
+    """
+    return getattr(con, "max_staleness", 0.0)
+
+
+def cache_stats() -> dict:
+    """
+    Returns the counters of every registered cache
+    """
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,178 @@
+import os
+import zlib
+
+import brotli
+from fastapi.concurrency import run_in_threadpool
+
+# gzip and brotli response compression.
+# CompressionMiddleware picks the encoding from Accept-Encoding and compresses
+# every text/JSON response of at least COMPRESSION_MIN_SIZE bytes, streamed
+# responses like the NDJSON exports chunk by chunk. ETagMiddleware compresses
+# the GET responses it caches itself, once per body, and keeps the compressed
+# bytes next to the plain ones, so a cached catalog page is never compressed twice.
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# Bodies larger than this are compressed in the thread pool instead of on the event loop
+THREAD_COMPRESS_SIZE = 64 * 1024
+
+# Preferred first when the client accepts both equally
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """
+    Returns the encoding to answer with, None for an uncompressed response
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    best = None
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    """
+    compress() that keeps large bodies off the event loop
+    """
+    if len(body) > THREAD_COMPRESS_SIZE:
+        return await run_in_threadpool(compress, body, encoding)
+    return compress(body, encoding)
+
+
+class StreamCompressor:
+    """
+    Compresses a streamed body, every chunk is flushed so the client can use it right away
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def is_compressible(headers: list) -> bool:
+    """
+    True for text/JSON responses that aren't encoded yet
+    """
+    content_type = b""
+    for name, value in headers:
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value
+    return content_type.decode("latin-1").startswith(COMPRESSIBLE_TYPES)
+
+
+def _vary(headers: list) -> list:
+    for index, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[index] = (name, value + b", Accept-Encoding")
+            return headers
+    return [*headers, (b"vary", b"Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing responses the client accepts compressed
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        stream = None
+
+        async def send_wrapper(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                if is_compressible(message.get("headers", [])):
+                    # Held back until the first body chunk shows how big the body is
+                    start = message
+                    return
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or (start is None and stream is None):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                headers = [(name, value) for name, value in start["headers"] if name != b"content-length"]
+                if not more_body:
+                    # The whole body in one message
+                    if len(body) < COMPRESSION_MIN_SIZE:
+                        await send(start)
+                        start = None
+                        await send(message)
+                        return
+                    body = await compress_async(body, encoding)
+                    headers = _vary(headers) + [(b"content-encoding", encoding.encode()),
+                                                (b"content-length", str(len(body)).encode())]
+                    await send({**start, "headers": headers})
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                stream = StreamCompressor(encoding)
+                await send({**start, "headers": _vary(headers) + [(b"content-encoding", encoding.encode())]})
+                start = None
+
+            data = stream.chunk(body) if body else b""
+            if not more_body:
+                data += stream.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
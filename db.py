@@ -1,12 +1,178 @@
+import logging
+import os
 from datetime import datetime
 
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 from fastapi import HTTPException, status
-from psycopg2.errors import ForeignKeyViolation
+from psycopg2.errors import ForeignKeyViolation, IntegrityError
+
+import prepared
+from cache import TTLCache, staleness
+from metrics import TimedDictCursor
 
 # This file is responsible for making database queries,
 # which the fastapi endpoints/routes can use.
 
+logger = logging.getLogger("trainify.db")
+
+# Read-through caches for the by-id getters that almost every screen hits.
+# The update/delete functions below invalidate them.
+user_cache = TTLCache('users')
+exercise_cache = TTLCache('exercises')
+workout_cache = TTLCache('workouts')
+
+# Leaderboards are polled every few seconds by the gym screens.
+# Keyed by (exercise_id, weight_class, limit), dropped whenever a repmax
+# of that exercise changes, the short TTL covers writes from other workers.
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "5"))
+leaderboard_cache = TTLCache('leaderboards', ttl=LEADERBOARD_TTL)
+
+# Password fingerprints auth.py already found to match the database, keyed by
+# (user_id, fingerprint). Dropped when the user's password changes or the
+# user is deleted, the TTL covers those writes in other workers.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+session_cache = TTLCache('sessions', ttl=SESSION_CACHE_TTL)
+
+# Bodyweight classes a leaderboard can be narrowed to,
+# name -> (heavier than, up to and including) in kg
+WEIGHT_CLASSES = {
+    '-59': (None, 59), '-66': (59, 66), '-74': (66, 74), '-83': (74, 83),
+    '-93': (83, 93), '-105': (93, 105), '-120': (105, 120), '120+': (120, None),
+}
+
+# Fields a PATCH may change per table, mapped to their column names.
+# Only names from here are ever formatted into a query, which keeps
+# the dynamic UPDATE below safe from sql-injection.
+UPDATABLE_COLUMNS = {
+    'users': ('user_id', {'name': 'name', 'password': 'password', 'weight': 'weight',
+                          'user_record_id': 'user_record_id', 'height': 'height'}),
+    'exercises': ('exercise_id', {'name': 'exercise_name', 'weight': 'exercise_weight',
+                                  'repmax_id': 'repmax_id', 'primary_muscle': 'primary_muscle',
+                                  'secondary_muscle': 'secondary_muscle', 'category_id': 'category_id',
+                                  'base_exercise': 'base_exercise'}),
+    'repmax': ('repmax_id', {'exercise_id': 'exercise_id', 'user_id': 'user_id', 'weight': 'weight'}),
+    'workouts': ('workout_id', {'name': 'workout_name', 'timecap': 'timecap',
+                                'record_id': 'record_id', 'for_kids': 'for_kids'}),
+    'workout_exercises': ('workout_exercise_id', {'sets': 'sets', 'reps': 'reps', 'rest_time': 'rest_time'}),
+}
+
+
+def build_update_query(table: str, row_id: int, update_data: dict):
+    """
+    Builds one UPDATE ... RETURNING statement setting every field in update_data
+
+    Raises exception if no value is passed or a field can't be updated
+    """
+    if not update_data:
+        raise ValueError('No value was passed')
+
+    primary_key, columns = UPDATABLE_COLUMNS[table]
+    invalid = set(update_data) - set(columns)
+    if invalid:
+        raise ValueError(f"Invalid column name: {', '.join(sorted(invalid))}")
+
+    assignments = ', '.join(f"{columns[field]} = %s" for field in update_data)
+    query = f"""
+            UPDATE {table}
+            SET {assignments}
+            WHERE {primary_key} = %s
+            RETURNING *;
+            """
+    return query, (*update_data.values(), row_id)
+
+
+TABLE_VERSIONS = prepared.register('table_versions', """
+    SELECT table_name, sum(version)::bigint FROM table_versions
+    WHERE table_name = ANY(%s)
+    GROUP BY table_name;
+""")
+
+
+def get_table_versions_db(con, tables) -> dict:
+    """
+    Fetches the change counter of every table in tables, the sum of its shards
+    """
+    with con:
+        with con.cursor() as cursor:
+            prepared.execute(cursor, TABLE_VERSIONS, (list(tables),))
+            return dict(cursor.fetchall())
+
+
+def update_row_db(con, table: str, row_id: int, update_data: dict):
+    """
+    Updates all fields in update_data in a single statement and transaction,
+    so a row is never left half-updated
+
+    Returns the updated row
+    Raises exception if the row is not found
+    """
+    query, params = build_update_query(table, row_id, update_data)
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            cursor.execute(query, params, name="update_row_db")
+            result = cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+def insert_many_db(con, table: str, columns: tuple, primary_key: str, rows: list, on_inserted=None):
+    """
+    Inserts rows with one multi-row INSERT ... RETURNING in one transaction
+
+    Returns (ids, errors): ids is aligned with rows and holds None for every
+    row that wasn't inserted, errors maps the index of those rows to the reason.
+    If the fast path hits a constraint violation, the rows are retried one by
+    one behind savepoints so only the offending rows are rejected.
+    on_inserted(cursor, inserted) runs inside the same transaction with a list of
+    (index, id) pairs, on the slow path once per row behind that row's savepoint,
+    so a violation it raises only rejects its own row.
+    """
+    if not rows:
+        return [], {}
+
+    query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES %s
+            RETURNING {primary_key};
+            """
+    try:
+        with con:
+            with con.cursor() as cursor:
+                cursor.label = "insert_many_db"
+                # One page holds every row, so ids come back in input order
+                inserted = execute_values(cursor, query, rows, page_size=len(rows), fetch=True)
+                ids = [row[0] for row in inserted]
+                if on_inserted is not None:
+                    on_inserted(cursor, list(enumerate(ids)))
+                return ids, {}
+    except IntegrityError:
+        pass
+
+    single_query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+            RETURNING {primary_key};
+            """
+    ids, errors = [], {}
+    with con:
+        with con.cursor() as cursor:
+            for index, row in enumerate(rows):
+                cursor.execute("SAVEPOINT bulk_row", name="insert_many_db")
+                try:
+                    cursor.execute(single_query, row, name="insert_many_db")
+                    new_id = cursor.fetchone()[0]
+                    if on_inserted is not None:
+                        on_inserted(cursor, [(index, new_id)])
+                    cursor.execute("RELEASE SAVEPOINT bulk_row", name="insert_many_db")
+                    ids.append(new_id)
+                except IntegrityError as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT bulk_row", name="insert_many_db")
+                    ids.append(None)
+                    errors[index] = e.diag.message_primary or str(e)
+    return ids, errors
+
+
 #                                                       Users
 
 
@@ -15,36 +181,110 @@ def get_user_db(con, user_id: int):
     Fetches one user based on the id
     raises: Error if user was not found
     """
+    # Copy the cached row, so callers can't change what's in the cache
+    user = user_cache.get_or_load(user_id, lambda: dict(_fetch_user_db(con, user_id)), staleness(con))
+    return dict(user)
+
+
+FETCH_USER = prepared.register('fetch_user', """
+    SELECT user_id AS id, name, weight, user_record_id, height
+    FROM users
+    WHERE user_id = %s
+""")
+
+
+def _fetch_user_db(con, user_id: int):
+    """
+    Fetches one user straight from the database
+    raises: Error if user was not found
+    """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM users
-                           WHERE user_id = %s
-                           """,
-                (user_id,),
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, FETCH_USER, (user_id,))
             result = cursor.fetchone()
             if result:
                 return result
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-def get_users_db(con):
+USERS_PAGE = prepared.register('users_page', """
+    SELECT user_id AS id, name, weight, user_record_id, height
+    FROM users
+    WHERE user_id > %s
+    ORDER BY user_id
+    LIMIT %s;
+""")
+
+
+def get_users_db(con, limit: int, after_id: int = 0):
     """
-    Fetches all users
+    Fetches one page of users, ordered by user_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM users;
-                           """
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, USERS_PAGE, (after_id, limit + 1))
             result = cursor.fetchall()
             return result
 
 
+USER_DASHBOARD = prepared.register('user_dashboard', """
+    WITH profile AS (
+        SELECT user_id AS id, name, weight, user_record_id, height
+        FROM users
+        WHERE user_id = %(user_id)s
+    ),
+    latest_records AS (
+        SELECT record_id AS id, workout_id, user_id, record_date, record_time
+        FROM records
+        WHERE user_id = %(user_id)s
+        ORDER BY record_date DESC, record_id DESC
+        LIMIT %(records_limit)s
+    ),
+    current_repmaxs AS (
+        -- The most recently entered repmax of every exercise
+        SELECT DISTINCT ON (exercise_id) repmax_id AS id, exercise_id, user_id, weight
+        FROM repmax
+        WHERE user_id = %(user_id)s
+        ORDER BY exercise_id, repmax_id DESC
+    ),
+    recent_workouts AS (
+        SELECT w.workout_id AS id, w.workout_name AS name, w.timecap, w.record_id, w.for_kids,
+               r.record_date
+        FROM workouts w
+        JOIN records r ON r.record_id = w.record_id
+        WHERE r.user_id = %(user_id)s
+        ORDER BY r.record_date DESC, w.workout_id DESC
+        LIMIT %(workouts_limit)s
+    )
+    SELECT
+        (SELECT row_to_json(profile) FROM profile) AS user,
+        (SELECT COALESCE(json_agg(lr ORDER BY lr.record_date DESC, lr.id DESC), '[]')
+         FROM latest_records lr) AS latest_records,
+        (SELECT COALESCE(json_agg(cr ORDER BY cr.exercise_id), '[]')
+         FROM current_repmaxs cr) AS repmaxs,
+        (SELECT COALESCE(json_agg(rw ORDER BY rw.record_date DESC, rw.id DESC), '[]')
+         FROM recent_workouts rw) AS recent_workouts;
+""")
+
+
+def get_user_dashboard_db(con, user_id: int, records_limit: int, workouts_limit: int):
+    """
+    Fetches everything the home screen shows for one user in a single round trip:
+    the profile, the latest records, the current repmax per exercise
+    and the most recent workouts
+    raises: Error if user was not found
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, USER_DASHBOARD, {'user_id': user_id, 'records_limit': records_limit, 'workouts_limit': workouts_limit})
+            result = cursor.fetchone()
+            if result and result['user']:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
 def create_user_db(con, password, name, weight, user_record_id, height):
     """
     Creates new user
@@ -53,7 +293,7 @@ def create_user_db(con, password, name, weight, user_record_id, height):
     """
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
                 cursor.execute(
                     """
                     INSERT INTO users(password,name,weight,user_record_id,height)
@@ -61,10 +301,11 @@ def create_user_db(con, password, name, weight, user_record_id, height):
                     RETURNING user_id
                     """,
                     (password, name, weight, user_record_id, height),
+                    name="create_user_db",
                 )
                 result = cursor.fetchone()
                 if result:
-                    print(f"User {name} was created successfully!")
+                    logger.info("User %s was created", name, extra={"entity": "user", "id": result['user_id']})
                     return result['user_id']
     except ForeignKeyViolation:
         # Transaction will automatically rollback due to the context manager
@@ -74,39 +315,21 @@ def create_user_db(con, password, name, weight, user_record_id, height):
         )
 
 
-def update_user_db(con, user_id: int, update_column: str, update_value: str):
+def update_user_db(con, user_id: int, update_data: dict):
     """
-    Update one or more values in user
+    Updates every field in update_data for one user at once
 
-    Raises exception if no value is passed or the column name is invalid
-    Also raises exception if the user is not found 
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the user is not found
     """
-
-    # Validation to avoid sql-injection
-    valid_columns = {'name', 'password', 'name',
-                     'weight', 'user_record_id', 'height'}
-    if update_column not in valid_columns:
-        raise ValueError(f"Invalid column name: {update_column}")
-
-    # Check if value is empty
-    if not update_value:
-        raise ValueError('No value was passed')
-
-    query = f"""
-            UPDATE users
-            SET {update_column} = %s
-            WHERE user_id = %s
-            RETURNING user_id;
-            """
-
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (update_value, user_id))
-            result = cursor.fetchone()
-            if result:
-                print(f"User was updated successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    result = update_row_db(con, 'users', user_id, update_data)
+    user_cache.invalidate(user_id)
+    # Name and bodyweight are shown on the leaderboards
+    leaderboard_cache.clear()
+    if 'password' in update_data:
+        session_cache.discard_if(lambda key: key[0] == user_id)
+    logger.info("User was updated", extra={"entity": "user", "id": user_id})
+    return result
 
 
 def delete_user_db(con, user_id: int):
@@ -116,7 +339,7 @@ def delete_user_db(con, user_id: int):
     Raises exception if user is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            DELETE FROM users
@@ -124,27 +347,77 @@ def delete_user_db(con, user_id: int):
                            RETURNING user_id;
                            """,
                 (user_id,),
+                name="delete_user_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"User was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("User was deleted", extra={"entity": "user", "id": user_id})
+        user_cache.invalidate(user_id)
+        session_cache.discard_if(lambda key: key[0] == user_id)
+        # Cascades to records and from there to workouts, and to repmax
+        workout_cache.clear()
+        leaderboard_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+def get_credentials_db(con, name: str):
+    """
+    Fetches the id and password hash of the user called name, None if there is none
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            cursor.execute("SELECT user_id, password FROM users WHERE name = %s;", (name,), name="get_credentials_db")
+            return cursor.fetchone()
+
+
+def get_password_hash_db(con, user_id: int):
+    """
+    Fetches the password hash of one user, None if the user doesn't exist
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            cursor.execute("SELECT password FROM users WHERE user_id = %s;", (user_id,), name="get_password_hash_db")
+            result = cursor.fetchone()
+    return result['password'] if result else None
+
+
+def update_password_hash_db(con, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """
+    Replaces the stored hash of a user, unless the password changed since old_hash was read
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s;",
+                           (new_hash, user_id, old_hash), name="update_password_hash_db")
+            updated = cursor.rowcount == 1
+    if updated:
+        user_cache.invalidate(user_id)
+        session_cache.discard_if(lambda key: key[0] == user_id)
+    return updated
 
 
 #                                                   Exercises
 
-def get_exercises_db(con):
+EXERCISES_PAGE = prepared.register('exercises_page', """
+    SELECT exercise_id AS id, exercise_name AS name, exercise_weight AS weight, repmax_id,
+           primary_muscle, secondary_muscle, category_id, base_exercise
+    FROM exercises
+    WHERE exercise_id > %s
+    ORDER BY exercise_id
+    LIMIT %s;
+""")
+
+
+def get_exercises_db(con, limit: int, after_id: int = 0):
     """
-    Fetches all users
+    Fetches one page of exercises, ordered by exercise_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM exercises;
-                           """
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, EXERCISES_PAGE, (after_id, limit + 1))
             result = cursor.fetchall()
             return result
 
@@ -152,17 +425,30 @@ def get_exercises_db(con):
 def get_exercise_db(con, exercise_id: int):
     """
     Fetches one exercise based on the id
-    raises: Error if movie was not found
+    raises: Error if exercise was not found
+    """
+    # Copy the cached row, so callers can't change what's in the cache
+    exercise = exercise_cache.get_or_load(exercise_id, lambda: dict(_fetch_exercise_db(con, exercise_id)),
+                                          staleness(con))
+    return dict(exercise)
+
+
+FETCH_EXERCISE = prepared.register('fetch_exercise', """
+    SELECT exercise_id AS id, exercise_name AS name, exercise_weight AS weight, repmax_id,
+           primary_muscle, secondary_muscle, category_id, base_exercise
+    FROM exercises
+    WHERE exercise_id = %s
+""")
+
+
+def _fetch_exercise_db(con, exercise_id: int):
+    """
+    Fetches one exercise straight from the database
+    raises: Error if exercise was not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM exercises
-                           WHERE exercise_id = %s
-                           """,
-                (exercise_id,),
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, FETCH_EXERCISE, (exercise_id,))
             result = cursor.fetchone()
             if result:
                 return result
@@ -177,20 +463,20 @@ def create_exercise_db(con, name, weight, repmax_id, primary_muscle, secondary_m
     """
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
                 cursor.execute(
                     """
-                    INSERT INTO exercises(name,weight,repmax_id,primary_muscle,secondary_muscle,category_id, base_exercise)
+                    INSERT INTO exercises(exercise_name,exercise_weight,repmax_id,primary_muscle,secondary_muscle,category_id, base_exercise)
                     VALUES(%s,%s,%s,%s,%s,%s,%s)
                     RETURNING exercise_id
                     """,
                     (name, weight, repmax_id,
                      primary_muscle, secondary_muscle, category_id, base_exercise),
+                    name="create_exercise_db",
                 )
                 result = cursor.fetchone()
                 if result:
-                    print(f"Exercise {
-                          name} was created successfully!")
+                    logger.info("Exercise %s was created", name, extra={"entity": "exercise", "id": result['exercise_id']})
                     return result['exercise_id']
     except ForeignKeyViolation:
         # Transaction will automatically rollback due to the context manager
@@ -200,39 +486,17 @@ def create_exercise_db(con, name, weight, repmax_id, primary_muscle, secondary_m
         )
 
 
-def update_exercise_db(con, exercise_id: int, update_column: str, update_value: str):
+def update_exercise_db(con, exercise_id: int, update_data: dict):
     """
-    Update one or more values in exercises
+    Updates every field in update_data for one exercise at once
 
-    Raises exception if no value is passed or the column name is invalid
-    Also raises exception if the exercise is not found 
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the exercise is not found
     """
-
-    # Validation to avoid sql-injection
-    valid_columns = {'name', 'weight', 'repmax_id',
-                     'primary_muscle', 'secondary_muscle', 'category_id', 'base_exercise'}
-    if update_column not in valid_columns:
-        raise ValueError(f"Invalid column name: {update_column}")
-
-    # Check if value is empty
-    if not update_value:
-        raise ValueError('No value was passed')
-
-    query = f"""
-            UPDATE exercises
-            SET {update_column} = %s
-            WHERE exercise_id = %s
-            RETURNING exercise_id;
-            """
-
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (update_value, exercise_id))
-            result = cursor.fetchone()
-            if result:
-                print(f"Exercise was updated successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    result = update_row_db(con, 'exercises', exercise_id, update_data)
+    exercise_cache.invalidate(exercise_id)
+    logger.info("Exercise was updated", extra={"entity": "exercise", "id": exercise_id})
+    return result
 
 
 def delete_exercise_db(con, exercise_id: int):
@@ -242,58 +506,96 @@ def delete_exercise_db(con, exercise_id: int):
     Raises exception if exercise is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
-                           DELETE FROM exercise
+                           DELETE FROM exercises
                            WHERE exercise_id = %s
                            RETURNING exercise_id;
                            """,
                 (exercise_id,),
+                name="delete_exercise_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"Exercise was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("Exercise was deleted", extra={"entity": "exercise", "id": exercise_id})
+        exercise_cache.invalidate(exercise_id)
+        # Cascades to the workouts using the exercise
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
 #                                                    Records
 
 
+FETCH_RECORD = prepared.register('fetch_record', """
+    SELECT record_id AS id, workout_id, user_id, record_date, record_time
+    FROM records
+    WHERE user_id = %s
+""")
+
+
 def get_record_db(con, user_id: int):
     """
     Fetches one record based on the id
     raises: Error if user was not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM records
-                           WHERE user_id = %s
-                           """,
-                (user_id,),
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, FETCH_RECORD, (user_id,))
             result = cursor.fetchone()
             if result:
                 return result
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-def get_records_db(con):
+RECORDS_PAGE = prepared.register('records_page', """
+    SELECT record_id AS id, workout_id, user_id, record_date, record_time
+    FROM records
+    WHERE record_id > %s
+    ORDER BY record_id
+    LIMIT %s;
+""")
+
+
+def get_records_db(con, limit: int, after_id: int = 0):
     """
-    Fetches all records
+    Fetches one page of records, ordered by record_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, RECORDS_PAGE, (after_id, limit + 1))
+            result = cursor.fetchall()
+            return result
+
+
+def export_records_db(con, batch_size: int):
+    """
+    Streams every record in batches of batch_size rows
+
+    Uses a server-side cursor, so only one batch is held in memory at a time
+    """
+    with con:
+        with con.cursor(name="export_records", cursor_factory=TimedDictCursor) as cursor:
+            cursor.itersize = batch_size
             cursor.execute(
                 """
-                           SELECT * FROM records;
-                           """
+                           SELECT * FROM records
+                           ORDER BY record_id;
+                           """, name="export_records_db"
             )
-            result = cursor.fetchall()
-            return result
+            while batch := cursor.fetchmany(batch_size):
+                yield batch
+
+
+CREATE_RECORD = prepared.register('create_record', """
+    INSERT INTO records(workout_id, user_id,record_date ,record_time)
+    VALUES(%s,%s,%s,%s)
+    RETURNING record_id
+""")
 
 
 def create_record_db(con, workout_id, user_id, record_date, record_time):
@@ -304,19 +606,12 @@ def create_record_db(con, workout_id, user_id, record_date, record_time):
     """
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO records(workout_id, user_id,record_date ,record_time)
-                    VALUES(%s,%s,%s)
-                    RETURNING record_id
-                    """,
-                    (workout_id, user_id, record_date, record_time),
-                )
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+                prepared.execute(cursor, CREATE_RECORD, (workout_id, user_id, record_date, record_time))
                 result = cursor.fetchone()
                 if result:
-                    print(f"Record for workout with id:{
-                          workout_id} was created successfully!")
+                    logger.info("Record for workout %s was created", workout_id,
+                                extra={"entity": "record", "id": result['record_id']})
                     return result['record_id']
     except ForeignKeyViolation:
         # Transaction will automatically rollback due to the context manager
@@ -326,6 +621,59 @@ def create_record_db(con, workout_id, user_id, record_date, record_time):
         )
 
 
+def create_records_bulk_db(con, records: list):
+    """
+    Creates many records at once
+
+    records is a list of (workout_id, user_id, record_date, record_time) tuples
+    """
+    ids, errors = insert_many_db(con, 'records', ('workout_id', 'user_id', 'record_date', 'record_time'),
+                                 'record_id', records)
+    logger.info("%s records were created", len(records) - len(errors), extra={"entity": "record"})
+    return ids, errors
+
+
+def create_ingested_records_db(con, records: list, receipt_ids: list):
+    """
+    Creates records queued by ingest.py and stores their receipts in the same transaction
+
+    records is a list of (workout_id, user_id, record_date, record_time) tuples,
+    receipt_ids is aligned with it
+    """
+    def store_receipts(cursor, inserted):
+        receipts = [(receipt_ids[index], record_id) for index, record_id in inserted]
+        cursor.label = "store_receipts"
+        execute_values(cursor, "INSERT INTO ingest_receipts (receipt_id, record_id) VALUES %s;",
+                       receipts, page_size=len(receipts))
+
+    ids, errors = insert_many_db(con, 'records', ('workout_id', 'user_id', 'record_date', 'record_time'),
+                                 'record_id', records, on_inserted=store_receipts)
+    logger.info("%s queued records were created", len(records) - len(errors), extra={"entity": "record"})
+    return ids, errors
+
+
+def get_ingest_receipts_db(con, receipt_ids: list) -> dict:
+    """
+    Returns {receipt_id: record_id} for the receipts whose record was written
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT receipt_id::text, record_id FROM ingest_receipts WHERE receipt_id = ANY(%s::uuid[]);",
+                           (list(receipt_ids),), name="get_ingest_receipts_db")
+            return dict(cursor.fetchall())
+
+
+def delete_ingest_receipts_db(con, older_than: float) -> int:
+    """
+    Deletes receipts persisted more than older_than seconds ago
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("DELETE FROM ingest_receipts WHERE persisted_at < now() - make_interval(secs => %s);",
+                           (older_than,), name="delete_ingest_receipts_db")
+            return cursor.rowcount
+
+
 def update_records_db(con, record_id: int, record_time: str):
     """
     Update record_time and record_date in the records table.
@@ -341,16 +689,16 @@ def update_records_db(con, record_id: int, record_time: str):
     current_date = datetime.now()
 
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute("""
                             UPDATE records
                             SET record_time = %s, record_date = %s
                             WHERE record_id = %s
                             RETURNING record_id;
-                            """, (record_time, current_date, record_id))
+                            """, (record_time, current_date, record_id), name="update_records_db")
             result = cursor.fetchone()
             if result:
-                print(f"Record was updated successfully!")
+                logger.info("Record was updated", extra={"entity": "record", "id": record_id})
                 return result
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Record not found")
 
@@ -362,7 +710,7 @@ def delete_record_db(con, record_id: int):
     Raises exception if record is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            DELETE FROM records
@@ -370,31 +718,48 @@ def delete_record_db(con, record_id: int):
                            RETURNING record_id;
                            """,
                 (record_id,),
+                name="delete_record_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"Record was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("Record was deleted", extra={"entity": "record", "id": record_id})
+        # Cascades to the workouts of the record
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
 #                                               Repmaxes
 
-def get_repmaxs_db(con):
+REPMAXS_PAGE = prepared.register('repmaxs_page', """
+    SELECT repmax_id AS id, exercise_id, user_id, weight
+    FROM repmax
+    WHERE repmax_id > %s
+    ORDER BY repmax_id
+    LIMIT %s;
+""")
+
+
+def get_repmaxs_db(con, limit: int, after_id: int = 0):
     """
-    Fetches all repmax's
+    Fetches one page of repmax's, ordered by repmax_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM repmax;
-                           """
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, REPMAXS_PAGE, (after_id, limit + 1))
             result = cursor.fetchall()
             return result
 
 
+CREATE_REPMAX = prepared.register('create_repmax', """
+    INSERT INTO repmax(exercise_id, user_id, weight)
+    VALUES(%s,%s,%s)
+    RETURNING repmax_id
+""")
+
+
 def create_repmax_db(con, exercise_id, user_id, weight):
     """
     Creates new repmax
@@ -403,60 +768,46 @@ def create_repmax_db(con, exercise_id, user_id, weight):
     """
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO repmax(exercise_id, user_id, weight)
-                    VALUES(%s,%s,%s)
-                    RETURNING repmax_id
-                    """,
-                    (exercise_id, user_id, weight),
-                )
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+                prepared.execute(cursor, CREATE_REPMAX, (exercise_id, user_id, weight))
                 result = cursor.fetchone()
-                if result:
-                    print(f"Repmax for exercise with id:{
-                          exercise_id} was created successfully!")
-                    return result['repmax_id']
     except ForeignKeyViolation:
         # Transaction will automatically rollback due to the context manager
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid user_id or workout_id provided"
         )
+    logger.info("Repmax for exercise %s was created", exercise_id, extra={"entity": "repmax", "id": result['repmax_id']})
+    leaderboard_cache.discard_if(lambda key: key[0] == exercise_id)
+    return result['repmax_id']
 
 
-def update_repmax_db(con, repmax_id: int, update_column: str, update_value: str):
+def create_repmaxs_bulk_db(con, repmaxs: list):
     """
-    Update one or more values in repmax
+    Creates many repmaxs at once
 
-    Raises exception if no value is passed or the column name is invalid
-    Also raises exception if the record is not found 
+    repmaxs is a list of (exercise_id, user_id, weight) tuples
     """
+    ids, errors = insert_many_db(con, 'repmax', ('exercise_id', 'user_id', 'weight'),
+                                 'repmax_id', repmaxs)
+    logger.info("%s repmaxs were created", len(repmaxs) - len(errors), extra={"entity": "repmax"})
+    exercise_ids = {repmax[0] for repmax, repmax_id in zip(repmaxs, ids) if repmax_id is not None}
+    leaderboard_cache.discard_if(lambda key: key[0] in exercise_ids)
+    return ids, errors
 
-    # Validation to avoid sql-injection
-    valid_columns = {'weight'}
-    if update_column not in valid_columns:
-        raise ValueError(f"Invalid column name: {update_column}")
-
-    # Check if value is empty
-    if not update_value:
-        raise ValueError('No value was passed')
 
-    query = f"""
-            UPDATE repmax
-            SET {update_column} = %s
-            WHERE weight = %s
-            RETURNING repmax_id;
-            """
+def update_repmax_db(con, repmax_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one repmax at once
 
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (update_value, repmax_id))
-            result = cursor.fetchone()
-            if result:
-                print(f"Weight for repmax was updated successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the repmax is not found
+    """
+    result = update_row_db(con, 'repmax', repmax_id, update_data)
+    # The repmax may have moved to another exercise, so drop every leaderboard
+    leaderboard_cache.clear()
+    logger.info("Repmax was updated", extra={"entity": "repmax", "id": repmax_id})
+    return result
 
 
 def delete_repmax_db(con, repmax_id: int):
@@ -466,20 +817,88 @@ def delete_repmax_db(con, repmax_id: int):
     Raises exception if repmax is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            DELETE FROM repmax
                            WHERE repmax_id = %s
-                           RETURNING repmax_id;
+                           RETURNING repmax_id, exercise_id;
                            """,
                 (repmax_id,),
+                name="delete_repmax_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"Repmax was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("Repmax was deleted", extra={"entity": "repmax", "id": repmax_id})
+        leaderboard_cache.discard_if(lambda key: key[0] == result['exercise_id'])
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+PERSONAL_BESTS = prepared.register('personal_bests', """
+    SELECT pb.exercise_id, e.exercise_name, pb.weight, pb.repmax_id
+    FROM users u
+    LEFT JOIN personal_bests pb ON pb.user_id = u.user_id
+    LEFT JOIN exercises e ON e.exercise_id = pb.exercise_id
+    WHERE u.user_id = %s
+    ORDER BY pb.exercise_id;
+""")
+
+
+def get_personal_bests_db(con, user_id: int):
+    """
+    Fetches a user's best repmax for every exercise from personal_bests,
+    which the repmax trigger keeps up to date
+    raises: Error if user was not found
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, PERSONAL_BESTS, (user_id,))
+            result = cursor.fetchall()
+            if not result:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+            # A user without any repmax still gets one row from the LEFT JOIN
+            return [row for row in result if row['exercise_id'] is not None]
+
+
+def get_leaderboard_db(con, exercise_id: int, limit: int, weight_class: str | None = None):
+    """
+    Fetches the top lifters of one exercise, ranked by their personal best.
+    Served from leaderboard_cache while it's fresh.
+
+    Raises exception if weight_class is unknown
+    """
+    if weight_class is not None and weight_class not in WEIGHT_CLASSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown weight_class, use one of: {', '.join(WEIGHT_CLASSES)}")
+    key = (exercise_id, weight_class, limit)
+    leaderboard = leaderboard_cache.get_or_load(
+        key, lambda: _fetch_leaderboard_db(con, exercise_id, limit, weight_class), staleness(con))
+    return [dict(row) for row in leaderboard]
+
+
+LEADERBOARD = prepared.register('leaderboard', """
+    SELECT RANK() OVER (ORDER BY pb.weight DESC) AS rank,
+           u.user_id, u.name, u.weight AS bodyweight, pb.weight, pb.repmax_id
+    FROM personal_bests pb
+    JOIN users u ON u.user_id = pb.user_id
+    WHERE pb.exercise_id = %(exercise_id)s
+      AND (%(above)s::bigint IS NULL OR u.weight > %(above)s)
+      AND (%(up_to)s::bigint IS NULL OR u.weight <= %(up_to)s)
+    ORDER BY pb.weight DESC, u.user_id
+    LIMIT %(limit)s;
+""")
+
+
+def _fetch_leaderboard_db(con, exercise_id: int, limit: int, weight_class: str | None):
+    """
+    Ranks personal_bests of one exercise with a window function
+    """
+    above, up_to = WEIGHT_CLASSES.get(weight_class, (None, None))
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, LEADERBOARD, {'exercise_id': exercise_id, 'above': above, 'up_to': up_to, 'limit': limit})
+            return [dict(row) for row in cursor.fetchall()]
 
 
 #                                               Workouts
@@ -490,35 +909,103 @@ def get_workout_db(con, workout_id: int):
     Fetches one workout based on the id
     raises: Error if workout was not found
     """
+    # Copy the cached row, so callers can't change what's in the cache
+    workout = workout_cache.get_or_load(workout_id, lambda: dict(_fetch_workout_db(con, workout_id)),
+                                        staleness(con))
+    return dict(workout)
+
+
+FETCH_WORKOUT = prepared.register('fetch_workout', """
+    SELECT workout_id AS id, workout_name AS name, timecap, record_id, for_kids
+    FROM workouts
+    WHERE workout_id = %s
+""")
+
+
+def _fetch_workout_db(con, workout_id: int):
+    """
+    Fetches one workout straight from the database
+    raises: Error if workout was not found
+    """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM workouts
-                           WHERE workout_id = %s
-                           """,
-                (workout_id,),
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, FETCH_WORKOUT, (workout_id,))
             result = cursor.fetchone()
             if result:
                 return result
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-def get_workouts_db(con):
+WORKOUTS_PAGE = prepared.register('workouts_page', """
+    SELECT workout_id AS id, workout_name AS name, timecap, record_id, for_kids
+    FROM workouts
+    WHERE workout_id > %s
+    ORDER BY workout_id
+    LIMIT %s;
+""")
+
+
+def get_workouts_db(con, limit: int, after_id: int = 0):
     """
-    Fetches all workouts
+    Fetches one page of workouts, ordered by workout_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                           SELECT * FROM workouts;
-                           """
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, WORKOUTS_PAGE, (after_id, limit + 1))
             result = cursor.fetchall()
             return result
 
 
+FULL_WORKOUT = prepared.register('full_workout', """
+    SELECT w.workout_id AS id,
+           w.workout_name AS name,
+           w.timecap,
+           w.record_id,
+           w.for_kids,
+           COALESCE(
+               json_agg(json_build_object(
+                   'workout_exercise_id', we.workout_exercise_id,
+                   'exercise_id', we.exercise_id,
+                   'sets', we.sets,
+                   'reps', we.reps,
+                   'rest_time', we.rest_time,
+                   'exercise', json_build_object(
+                       'id', e.exercise_id,
+                       'name', e.exercise_name,
+                       'primary_muscle', e.primary_muscle,
+                       'secondary_muscle', e.secondary_muscle,
+                       'category_id', e.category_id,
+                       'category', c.name
+                   )
+               ) ORDER BY we.workout_exercise_id)
+               FILTER (WHERE we.workout_exercise_id IS NOT NULL),
+               '[]'
+           ) AS exercises
+    FROM workouts w
+    LEFT JOIN workout_exercises we ON we.workout_id = w.workout_id
+    LEFT JOIN exercises e ON e.exercise_id = we.exercise_id
+    LEFT JOIN categories c ON c.category_id = e.category_id
+    WHERE w.workout_id = %s
+    GROUP BY w.workout_id;
+""")
+
+
+def get_full_workout_db(con, workout_id: int):
+    """
+    Fetches a workout together with its workout_exercises, in order,
+    and the details of every exercise in one query
+    raises: Error if workout was not found
+    """
+    with con:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, FULL_WORKOUT, (workout_id,))
+            result = cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
 def create_workout_db(con, name, timecap, record_id, for_kids):
     """
     Creates new workout
@@ -527,7 +1014,7 @@ def create_workout_db(con, name, timecap, record_id, for_kids):
     """
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
                 cursor.execute(
                     """
                     INSERT INTO workouts(workout_name,timecap,record_id, for_kids)
@@ -535,10 +1022,11 @@ def create_workout_db(con, name, timecap, record_id, for_kids):
                     RETURNING workout_id
                     """,
                     (name, timecap, record_id, for_kids),
+                    name="create_workout_db",
                 )
                 result = cursor.fetchone()
                 if result:
-                    print(f"Workout {name} was created successfully!")
+                    logger.info("Workout %s was created", name, extra={"entity": "workout", "id": result['workout_id']})
                     return result['workout_id']
     except ForeignKeyViolation:
         # Transaction will automatically rollback due to the context manager
@@ -548,38 +1036,17 @@ def create_workout_db(con, name, timecap, record_id, for_kids):
         )
 
 
-def update_workout_db(con, workout_id: int, update_column: str, update_value: str):
+def update_workout_db(con, workout_id: int, update_data: dict):
     """
-    Update one or more values in workouts
+    Updates every field in update_data for one workout at once
 
-    Raises exception if no value is passed or the column name is invalid
-    Also raises exception if the record is not found 
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the workout is not found
     """
-
-    # Validation to avoid sql-injection
-    valid_columns = {'workout_name', 'timecap', 'record_id', 'for_kids'}
-    if update_column not in valid_columns:
-        raise ValueError(f"Invalid column name: {update_column}")
-
-    # Check if value is empty
-    if not update_value:
-        raise ValueError('No value was passed')
-
-    query = f"""
-            UPDATE workouts
-            SET {update_column} = %s
-            WHERE workout_id = %s
-            RETURNING workout_id;
-            """
-
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (update_value, workout_id))
-            result = cursor.fetchone()
-            if result:
-                print(f"Workout was updated successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    result = update_row_db(con, 'workouts', workout_id, update_data)
+    workout_cache.invalidate(workout_id)
+    logger.info("Workout was updated", extra={"entity": "workout", "id": workout_id})
+    return result
 
 
 def delete_workout_db(con, workout_id: int):
@@ -589,7 +1056,7 @@ def delete_workout_db(con, workout_id: int):
     Raises exception if workout is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            DELETE FROM workouts
@@ -597,12 +1064,14 @@ def delete_workout_db(con, workout_id: int):
                            RETURNING workout_id;
                            """,
                 (workout_id,),
+                name="delete_workout_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"Workout was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("Workout was deleted", extra={"entity": "workout", "id": workout_id})
+        workout_cache.invalidate(workout_id)
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
 #                                                   Categories
@@ -612,11 +1081,11 @@ def get_categories_db(con):
     Fetches all categories
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            SELECT * FROM categories;
-                           """
+                           """, name="get_categories_db"
             )
             result = cursor.fetchall()
             return result
@@ -628,18 +1097,19 @@ def create_category_db(con, name):
     """
 
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
-                INSERT INTO categories(category_name)
+                INSERT INTO categories(name)
                 VALUES(%s)
                 RETURNING category_id
                 """,
-                (name),
+                (name,),
+                name="create_category_db",
             )
             result = cursor.fetchone()
             if result:
-                print(f"Category {name} was created successfully!")
+                logger.info("Category %s was created", name, extra={"entity": "category", "id": result['category_id']})
                 return result['category_id']
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
@@ -651,59 +1121,92 @@ def delete_category_db(con, category_id: int):
     Raises exception if category is not found
     """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                            DELETE FROM categories
-                           WHERE cateogry_id = %s
+                           WHERE category_id = %s
                            RETURNING category_id;
                            """,
                 (category_id,),
+                name="delete_category_db",
             )
             result = cursor.fetchone()
-            if result:
-                print(f"Category was deleted successfully!")
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if result:
+        logger.info("Category was deleted", extra={"entity": "category", "id": category_id})
+        # Cascades to the exercises of the category and their workouts
+        exercise_cache.clear()
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
 #                                       workout_exercises
 
-def get_workout_exercises_db(con):
+WORKOUT_EXERCISES_PAGE = prepared.register('workout_exercises_page', """
+    SELECT workout_exercise_id, workout_id, exercise_id, sets, reps, rest_time
+    FROM workout_exercises
+    WHERE workout_exercise_id > %s
+    ORDER BY workout_exercise_id
+    LIMIT %s;
+""")
+
+
+def get_workout_exercises_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of workout_exercises, ordered by workout_exercise_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                SELECT * FROM workout_exercises;
-                """
-            )
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
+            prepared.execute(cursor, WORKOUT_EXERCISES_PAGE, (after_id, limit + 1))
             return cursor.fetchall()
 
 
 def get_workout_exercises_by_workout_id_db(con, workout_id: int):
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                 SELECT * FROM workout_exercises
                 WHERE workout_id = %s;
                 """,
-                (workout_id,)
+                (workout_id,), name="get_workout_exercises_by_workout_id_db"
             )
             return cursor.fetchall()
 
 
+def export_workout_exercises_db(con, batch_size: int):
+    """
+    Streams every workout_exercise in batches of batch_size rows
+
+    Uses a server-side cursor, so only one batch is held in memory at a time
+    """
+    with con:
+        with con.cursor(name="export_workout_exercises", cursor_factory=TimedDictCursor) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                """
+                SELECT * FROM workout_exercises
+                ORDER BY workout_exercise_id;
+                """, name="export_workout_exercises_db"
+            )
+            while batch := cursor.fetchmany(batch_size):
+                yield batch
+
+
 def create_workout_exercise_db(con, workout_id: int, exercise_id: int, sets: int, reps: int, rest_time: int):
     try:
         with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            with con.cursor(cursor_factory=TimedDictCursor) as cursor:
                 cursor.execute(
                     """
                     INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, rest_time)
                     VALUES (%s, %s, %s, %s, %s)
                     RETURNING workout_exercise_id;
                     """,
-                    (workout_id, exercise_id, sets, reps, rest_time)
+                    (workout_id, exercise_id, sets, reps, rest_time), name="create_workout_exercise_db"
                 )
                 return cursor.fetchone()['workout_exercise_id']
     except ForeignKeyViolation:
@@ -713,38 +1216,37 @@ def create_workout_exercise_db(con, workout_id: int, exercise_id: int, sets: int
         )
 
 
-def update_workout_exercise_db(con, workout_exercise_id: int, update_column: str, update_value: int):
-    valid_columns = {'sets', 'reps', 'rest_time'}
-    if update_column not in valid_columns:
-        raise ValueError(f"Invalid column name: {update_column}")
+def create_workout_exercises_bulk_db(con, workout_exercises: list):
+    """
+    Creates many workout-exercise relationships at once
 
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                f"""
-                UPDATE workout_exercises
-                SET {update_column} = %s
-                WHERE workout_exercise_id = %s
-                RETURNING workout_exercise_id;
-                """,
-                (update_value, workout_exercise_id)
-            )
-            result = cursor.fetchone()
-            if result:
-                return result
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    workout_exercises is a list of (workout_id, exercise_id, sets, reps, rest_time) tuples
+    """
+    return insert_many_db(con, 'workout_exercises', ('workout_id', 'exercise_id', 'sets', 'reps', 'rest_time'),
+                          'workout_exercise_id', workout_exercises)
+
+
+def update_workout_exercise_db(con, workout_exercise_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one workout-exercise at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the workout-exercise is not found
+    """
+    result = update_row_db(con, 'workout_exercises', workout_exercise_id, update_data)
+    return result
 
 
 def delete_workout_exercise_db(con, workout_exercise_id: int):
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        with con.cursor(cursor_factory=TimedDictCursor) as cursor:
             cursor.execute(
                 """
                 DELETE FROM workout_exercises
                 WHERE workout_exercise_id = %s
                 RETURNING workout_exercise_id;
                 """,
-                (workout_exercise_id,)
+                (workout_exercise_id,), name="delete_workout_exercise_db"
             )
             result = cursor.fetchone()
             if result:
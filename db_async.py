@@ -0,0 +1,1051 @@
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from psycopg.errors import ForeignKeyViolation, IntegrityError
+
+from cache import staleness
+from db import (FULL_WORKOUT, LEADERBOARD, PERSONAL_BESTS, TABLE_VERSIONS, USER_DASHBOARD, WEIGHT_CLASSES,
+                build_update_query, exercise_cache, leaderboard_cache, logger, session_cache, user_cache,
+                workout_cache)
+from metrics import TimedAsyncServerCursor
+
+# Async twins of the functions in db.py, built on psycopg 3.
+# Every function takes a connection checked out of db_setup.async_pool,
+# which hands out rows as dicts, so the results have the same shape
+# as the RealDictCursor rows returned by db.py.
+# Queries that db.py registers as prepared statements run with the same SQL
+# and name here, psycopg 3 prepares them by itself once they repeat.
+
+
+async def get_table_versions_db(con, tables) -> dict:
+    """
+    Fetches the change counter of every table in tables, the sum of its shards
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(TABLE_VERSIONS.sql, (list(tables),), name=TABLE_VERSIONS.name)
+            return {row['table_name']: row['sum'] for row in await cursor.fetchall()}
+
+
+async def update_row_db(con, table: str, row_id: int, update_data: dict):
+    """
+    Updates all fields in update_data in a single statement and transaction
+
+    Returns the updated row
+    Raises exception if the row is not found
+    """
+    query, params = build_update_query(table, row_id, update_data)
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(query, params, name="update_row_db")
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def insert_many_db(con, table: str, columns: tuple, primary_key: str, rows: list):
+    """
+    Inserts rows with one multi-row INSERT ... RETURNING in one transaction
+
+    Returns (ids, errors) like db.insert_many_db, retrying the rows one by one
+    behind savepoints if the fast path hits a constraint violation
+    """
+    if not rows:
+        return [], {}
+
+    row_placeholder = f"({', '.join(['%s'] * len(columns))})"
+    query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES {', '.join([row_placeholder] * len(rows))}
+            RETURNING {primary_key};
+            """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(query, [value for row in rows for value in row], name="insert_many_db")
+                return [row[primary_key] for row in await cursor.fetchall()], {}
+    except IntegrityError:
+        pass
+
+    single_query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES {row_placeholder}
+            RETURNING {primary_key};
+            """
+    ids, errors = [], {}
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            for index, row in enumerate(rows):
+                try:
+                    # A nested transaction is a savepoint
+                    async with con.transaction():
+                        await cursor.execute(single_query, row, name="insert_many_db")
+                        ids.append((await cursor.fetchone())[primary_key])
+                except IntegrityError as e:
+                    ids.append(None)
+                    errors[index] = e.diag.message_primary or str(e)
+    return ids, errors
+
+
+#                                                       Users
+
+
+async def get_user_db(con, user_id: int):
+    """
+    Fetches one user based on the id
+    raises: Error if user was not found
+    """
+    found, user = user_cache.lookup(user_id)
+    if not found:
+        generation = user_cache.generation
+        user = dict(await _fetch_user_db(con, user_id))
+        user_cache.store(user_id, user, generation, staleness(con))
+    return dict(user)
+
+
+async def _fetch_user_db(con, user_id: int):
+    """
+    Fetches one user straight from the database
+    raises: Error if user was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT user_id AS id, name, weight, user_record_id, height
+                           FROM users
+                           WHERE user_id = %s
+                           """,
+                (user_id,),
+                name="_fetch_user_db",
+            )
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def get_users_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of users, ordered by user_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT user_id AS id, name, weight, user_record_id, height
+                           FROM users
+                           WHERE user_id > %s
+                           ORDER BY user_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_users_db",
+            )
+            return await cursor.fetchall()
+
+
+async def get_user_dashboard_db(con, user_id: int, records_limit: int, workouts_limit: int):
+    """
+    Fetches everything the home screen shows for one user in a single round trip
+    raises: Error if user was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(USER_DASHBOARD.sql,
+                                 {'user_id': user_id, 'records_limit': records_limit, 'workouts_limit': workouts_limit},
+                                 name=USER_DASHBOARD.name)
+            result = await cursor.fetchone()
+            if result and result['user']:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def get_credentials_db(con, name: str):
+    """
+    Fetches the id and password hash of the user called name, None if there is none
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute("SELECT user_id, password FROM users WHERE name = %s;", (name,),
+                                 name="get_credentials_db")
+            return await cursor.fetchone()
+
+
+async def get_password_hash_db(con, user_id: int):
+    """
+    Fetches the password hash of one user, None if the user doesn't exist
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute("SELECT password FROM users WHERE user_id = %s;", (user_id,),
+                                 name="get_password_hash_db")
+            result = await cursor.fetchone()
+    return result['password'] if result else None
+
+
+async def update_password_hash_db(con, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """
+    Replaces the stored hash of a user, unless the password changed since old_hash was read
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s;",
+                                 (new_hash, user_id, old_hash), name="update_password_hash_db")
+            updated = cursor.rowcount == 1
+    if updated:
+        user_cache.invalidate(user_id)
+        session_cache.discard_if(lambda key: key[0] == user_id)
+    return updated
+
+
+async def create_user_db(con, password, name, weight, user_record_id, height):
+    """
+    Creates new user
+
+    Raises exception if invalid user_id is provided
+    """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO users(password,name,weight,user_record_id,height)
+                    VALUES(%s,%s,%s,%s,%s)
+                    RETURNING user_id
+                    """,
+                    (password, name, weight, user_record_id, height),
+                    name="create_user_db",
+                )
+                result = await cursor.fetchone()
+                if result:
+                    logger.info("User %s was created", name, extra={"entity": "user", "id": result['user_id']})
+                    return result['user_id']
+    except ForeignKeyViolation:
+        # Transaction will automatically rollback due to the context manager
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user_id or realtor_id provided"
+        )
+
+
+async def update_user_db(con, user_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one user at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the user is not found
+    """
+    result = await update_row_db(con, 'users', user_id, update_data)
+    user_cache.invalidate(user_id)
+    # Name and bodyweight are shown on the leaderboards
+    leaderboard_cache.clear()
+    if 'password' in update_data:
+        session_cache.discard_if(lambda key: key[0] == user_id)
+    logger.info("User was updated", extra={"entity": "user", "id": user_id})
+    return result
+
+
+async def delete_user_db(con, user_id: int):
+    """
+    Delete a user by ID
+
+    Raises exception if user is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM users
+                           WHERE user_id = %s
+                           RETURNING user_id;
+                           """,
+                (user_id,),
+                name="delete_user_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("User was deleted", extra={"entity": "user", "id": user_id})
+        user_cache.invalidate(user_id)
+        session_cache.discard_if(lambda key: key[0] == user_id)
+        # Cascades to records and from there to workouts, and to repmax
+        workout_cache.clear()
+        leaderboard_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Exercises
+
+async def get_exercises_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of exercises, ordered by exercise_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT exercise_id AS id, exercise_name AS name, exercise_weight AS weight, repmax_id,
+                                  primary_muscle, secondary_muscle, category_id, base_exercise
+                           FROM exercises
+                           WHERE exercise_id > %s
+                           ORDER BY exercise_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_exercises_db",
+            )
+            return await cursor.fetchall()
+
+
+async def get_exercise_db(con, exercise_id: int):
+    """
+    Fetches one exercise based on the id
+    raises: Error if exercise was not found
+    """
+    found, exercise = exercise_cache.lookup(exercise_id)
+    if not found:
+        generation = exercise_cache.generation
+        exercise = dict(await _fetch_exercise_db(con, exercise_id))
+        exercise_cache.store(exercise_id, exercise, generation, staleness(con))
+    return dict(exercise)
+
+
+async def _fetch_exercise_db(con, exercise_id: int):
+    """
+    Fetches one exercise straight from the database
+    raises: Error if exercise was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT exercise_id AS id, exercise_name AS name, exercise_weight AS weight, repmax_id,
+                                  primary_muscle, secondary_muscle, category_id, base_exercise
+                           FROM exercises
+                           WHERE exercise_id = %s
+                           """,
+                (exercise_id,),
+                name="_fetch_exercise_db",
+            )
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def create_exercise_db(con, name, weight, repmax_id, primary_muscle, secondary_muscle, category_id, base_exercise):
+    """
+    Creates new exercise
+
+    Raises exception if invalid repmax_id or categpory_id is provided
+    """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO exercises(exercise_name,exercise_weight,repmax_id,primary_muscle,secondary_muscle,category_id, base_exercise)
+                    VALUES(%s,%s,%s,%s,%s,%s,%s)
+                    RETURNING exercise_id
+                    """,
+                    (name, weight, repmax_id,
+                     primary_muscle, secondary_muscle, category_id, base_exercise),
+                    name="create_exercise_db",
+                )
+                result = await cursor.fetchone()
+                if result:
+                    logger.info("Exercise %s was created", name, extra={"entity": "exercise", "id": result['exercise_id']})
+                    return result['exercise_id']
+    except ForeignKeyViolation:
+        # Transaction will automatically rollback due to the context manager
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid repmax_id, primary_muscle_id,secondary_muscle_id or category_id provided"
+        )
+
+
+async def update_exercise_db(con, exercise_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one exercise at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the exercise is not found
+    """
+    result = await update_row_db(con, 'exercises', exercise_id, update_data)
+    exercise_cache.invalidate(exercise_id)
+    logger.info("Exercise was updated", extra={"entity": "exercise", "id": exercise_id})
+    return result
+
+
+async def delete_exercise_db(con, exercise_id: int):
+    """
+    Delete a exercise by ID
+
+    Raises exception if exercise is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM exercises
+                           WHERE exercise_id = %s
+                           RETURNING exercise_id;
+                           """,
+                (exercise_id,),
+                name="delete_exercise_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("Exercise was deleted", extra={"entity": "exercise", "id": exercise_id})
+        exercise_cache.invalidate(exercise_id)
+        # Cascades to the workouts using the exercise
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                    Records
+
+
+async def get_record_db(con, user_id: int):
+    """
+    Fetches one record based on the id
+    raises: Error if user was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT record_id AS id, workout_id, user_id, record_date, record_time
+                           FROM records
+                           WHERE user_id = %s
+                           """,
+                (user_id,),
+                name="get_record_db",
+            )
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def get_records_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of records, ordered by record_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT record_id AS id, workout_id, user_id, record_date, record_time
+                           FROM records
+                           WHERE record_id > %s
+                           ORDER BY record_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_records_db",
+            )
+            return await cursor.fetchall()
+
+
+async def export_records_db(con, batch_size: int):
+    """
+    Streams every record in batches of batch_size rows
+
+    Uses a server-side cursor, so only one batch is held in memory at a time
+    """
+    async with con.transaction():
+        async with TimedAsyncServerCursor(con, "export_records") as cursor:
+            cursor.itersize = batch_size
+            await cursor.execute(
+                """
+                           SELECT * FROM records
+                           ORDER BY record_id;
+                           """, name="export_records_db"
+            )
+            while batch := await cursor.fetchmany(batch_size):
+                yield batch
+
+
+async def create_record_db(con, workout_id, user_id, record_date, record_time):
+    """
+    Creates new record
+
+    Raises exception if invalid user_id is provided
+    """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO records(workout_id, user_id,record_date ,record_time)
+                    VALUES(%s,%s,%s,%s)
+                    RETURNING record_id
+                    """,
+                    (workout_id, user_id, record_date, record_time),
+                    name="create_record_db",
+                )
+                result = await cursor.fetchone()
+                if result:
+                    logger.info("Record for workout %s was created", workout_id, extra={"entity": "record", "id": result['record_id']})
+                    return result['record_id']
+    except ForeignKeyViolation:
+        # Transaction will automatically rollback due to the context manager
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user_id or workout_id provided"
+        )
+
+
+async def create_records_bulk_db(con, records: list):
+    """
+    Creates many records at once
+
+    records is a list of (workout_id, user_id, record_date, record_time) tuples
+    """
+    ids, errors = await insert_many_db(con, 'records', ('workout_id', 'user_id', 'record_date', 'record_time'),
+                                       'record_id', records)
+    logger.info("%s records were created", len(records) - len(errors), extra={"entity": "record"})
+    return ids, errors
+
+
+async def update_records_db(con, record_id: int, record_time: str):
+    """
+    Update record_time and record_date in the records table.
+
+    Raises:
+        ValueError: If record_time is empty.
+        HTTPException: If the record is not found.
+    """
+    if not record_time:
+        raise ValueError("No value was passed")
+
+    # Get the current timestamp
+    current_date = datetime.now()
+
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute("""
+                            UPDATE records
+                            SET record_time = %s, record_date = %s
+                            WHERE record_id = %s
+                            RETURNING record_id;
+                            """, (record_time, current_date, record_id), name="update_records_db")
+            result = await cursor.fetchone()
+            if result:
+                logger.info("Record was updated", extra={"entity": "record", "id": record_id})
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Record not found")
+
+
+async def delete_record_db(con, record_id: int):
+    """
+    Delete a record by ID
+
+    Raises exception if record is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM records
+                           WHERE record_id = %s
+                           RETURNING record_id;
+                           """,
+                (record_id,),
+                name="delete_record_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("Record was deleted", extra={"entity": "record", "id": record_id})
+        # Cascades to the workouts of the record
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                               Repmaxes
+
+async def get_repmaxs_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of repmax's, ordered by repmax_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT repmax_id AS id, exercise_id, user_id, weight
+                           FROM repmax
+                           WHERE repmax_id > %s
+                           ORDER BY repmax_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_repmaxs_db",
+            )
+            return await cursor.fetchall()
+
+
+async def create_repmax_db(con, exercise_id, user_id, weight):
+    """
+    Creates new repmax
+
+    Raises exception if invalid user_id is provided
+    """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO repmax(exercise_id, user_id, weight)
+                    VALUES(%s,%s,%s)
+                    RETURNING repmax_id
+                    """,
+                    (exercise_id, user_id, weight),
+                    name="create_repmax_db",
+                )
+                result = await cursor.fetchone()
+    except ForeignKeyViolation:
+        # Transaction will automatically rollback due to the context manager
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user_id or workout_id provided"
+        )
+    logger.info("Repmax for exercise %s was created", exercise_id, extra={"entity": "repmax", "id": result['repmax_id']})
+    leaderboard_cache.discard_if(lambda key: key[0] == exercise_id)
+    return result['repmax_id']
+
+
+async def create_repmaxs_bulk_db(con, repmaxs: list):
+    """
+    Creates many repmaxs at once
+
+    repmaxs is a list of (exercise_id, user_id, weight) tuples
+    """
+    ids, errors = await insert_many_db(con, 'repmax', ('exercise_id', 'user_id', 'weight'),
+                                       'repmax_id', repmaxs)
+    logger.info("%s repmaxs were created", len(repmaxs) - len(errors), extra={"entity": "repmax"})
+    exercise_ids = {repmax[0] for repmax, repmax_id in zip(repmaxs, ids) if repmax_id is not None}
+    leaderboard_cache.discard_if(lambda key: key[0] in exercise_ids)
+    return ids, errors
+
+
+async def update_repmax_db(con, repmax_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one repmax at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the repmax is not found
+    """
+    result = await update_row_db(con, 'repmax', repmax_id, update_data)
+    # The repmax may have moved to another exercise, so drop every leaderboard
+    leaderboard_cache.clear()
+    logger.info("Repmax was updated", extra={"entity": "repmax", "id": repmax_id})
+    return result
+
+
+async def delete_repmax_db(con, repmax_id: int):
+    """
+    Delete a repmax by ID
+
+    Raises exception if repmax is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM repmax
+                           WHERE repmax_id = %s
+                           RETURNING repmax_id, exercise_id;
+                           """,
+                (repmax_id,),
+                name="delete_repmax_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("Repmax was deleted", extra={"entity": "repmax", "id": repmax_id})
+        leaderboard_cache.discard_if(lambda key: key[0] == result['exercise_id'])
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def get_personal_bests_db(con, user_id: int):
+    """
+    Fetches a user's best repmax for every exercise from personal_bests,
+    which the repmax trigger keeps up to date
+    raises: Error if user was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(PERSONAL_BESTS.sql, (user_id,), name=PERSONAL_BESTS.name)
+            result = await cursor.fetchall()
+            if not result:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+            # A user without any repmax still gets one row from the LEFT JOIN
+            return [row for row in result if row['exercise_id'] is not None]
+
+
+async def get_leaderboard_db(con, exercise_id: int, limit: int, weight_class: str | None = None):
+    """
+    Fetches the top lifters of one exercise, ranked by their personal best.
+    Served from leaderboard_cache while it's fresh.
+
+    Raises exception if weight_class is unknown
+    """
+    if weight_class is not None and weight_class not in WEIGHT_CLASSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown weight_class, use one of: {', '.join(WEIGHT_CLASSES)}")
+    key = (exercise_id, weight_class, limit)
+    found, leaderboard = leaderboard_cache.lookup(key)
+    if not found:
+        generation = leaderboard_cache.generation
+        leaderboard = await _fetch_leaderboard_db(con, exercise_id, limit, weight_class)
+        leaderboard_cache.store(key, leaderboard, generation, staleness(con))
+    return [dict(row) for row in leaderboard]
+
+
+async def _fetch_leaderboard_db(con, exercise_id: int, limit: int, weight_class: str | None):
+    """
+    Ranks personal_bests of one exercise with a window function
+    """
+    above, up_to = WEIGHT_CLASSES.get(weight_class, (None, None))
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(LEADERBOARD.sql,
+                                 {'exercise_id': exercise_id, 'above': above, 'up_to': up_to, 'limit': limit},
+                                 name=LEADERBOARD.name)
+            return await cursor.fetchall()
+
+
+#                                               Workouts
+
+
+async def get_workout_db(con, workout_id: int):
+    """
+    Fetches one workout based on the id
+    raises: Error if workout was not found
+    """
+    found, workout = workout_cache.lookup(workout_id)
+    if not found:
+        generation = workout_cache.generation
+        workout = dict(await _fetch_workout_db(con, workout_id))
+        workout_cache.store(workout_id, workout, generation, staleness(con))
+    return dict(workout)
+
+
+async def _fetch_workout_db(con, workout_id: int):
+    """
+    Fetches one workout straight from the database
+    raises: Error if workout was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT workout_id AS id, workout_name AS name, timecap, record_id, for_kids
+                           FROM workouts
+                           WHERE workout_id = %s
+                           """,
+                (workout_id,),
+                name="_fetch_workout_db",
+            )
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def get_workouts_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of workouts, ordered by workout_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT workout_id AS id, workout_name AS name, timecap, record_id, for_kids
+                           FROM workouts
+                           WHERE workout_id > %s
+                           ORDER BY workout_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_workouts_db",
+            )
+            return await cursor.fetchall()
+
+
+async def get_full_workout_db(con, workout_id: int):
+    """
+    Fetches a workout together with its workout_exercises, in order,
+    and the details of every exercise in one query
+    raises: Error if workout was not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(FULL_WORKOUT.sql, (workout_id,), name=FULL_WORKOUT.name)
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def create_workout_db(con, name, timecap, record_id, for_kids):
+    """
+    Creates new workout
+
+    Raises exception if invalid user_id is provided
+    """
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO workouts(workout_name,timecap,record_id, for_kids)
+                    VALUES(%s,%s,%s,%s)
+                    RETURNING workout_id
+                    """,
+                    (name, timecap, record_id, for_kids),
+                    name="create_workout_db",
+                )
+                result = await cursor.fetchone()
+                if result:
+                    logger.info("Workout %s was created", name, extra={"entity": "workout", "id": result['workout_id']})
+                    return result['workout_id']
+    except ForeignKeyViolation:
+        # Transaction will automatically rollback due to the context manager
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user_id or exercise_id provided"
+        )
+
+
+async def update_workout_db(con, workout_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one workout at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the workout is not found
+    """
+    result = await update_row_db(con, 'workouts', workout_id, update_data)
+    workout_cache.invalidate(workout_id)
+    logger.info("Workout was updated", extra={"entity": "workout", "id": workout_id})
+    return result
+
+
+async def delete_workout_db(con, workout_id: int):
+    """
+    Delete a workout by ID
+
+    Raises exception if workout is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM workouts
+                           WHERE workout_id = %s
+                           RETURNING workout_id;
+                           """,
+                (workout_id,),
+                name="delete_workout_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("Workout was deleted", extra={"entity": "workout", "id": workout_id})
+        workout_cache.invalidate(workout_id)
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                                   Categories
+
+async def get_categories_db(con):
+    """
+    Fetches all categories
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT * FROM categories;
+                           """, name="get_categories_db"
+            )
+            return await cursor.fetchall()
+
+
+async def create_category_db(con, name):
+    """
+    Creates new category
+    """
+
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO categories(name)
+                VALUES(%s)
+                RETURNING category_id
+                """,
+                (name,),
+                name="create_category_db",
+            )
+            result = await cursor.fetchone()
+            if result:
+                logger.info("Category %s was created", name, extra={"entity": "category", "id": result['category_id']})
+                return result['category_id']
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+
+
+async def delete_category_db(con, category_id: int):
+    """
+    Delete a category by ID
+
+    Raises exception if category is not found
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           DELETE FROM categories
+                           WHERE category_id = %s
+                           RETURNING category_id;
+                           """,
+                (category_id,),
+                name="delete_category_db",
+            )
+            result = await cursor.fetchone()
+    if result:
+        logger.info("Category was deleted", extra={"entity": "category", "id": category_id})
+        # Cascades to the exercises of the category and their workouts
+        exercise_cache.clear()
+        workout_cache.clear()
+        return result
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+#                                       workout_exercises
+
+async def get_workout_exercises_db(con, limit: int, after_id: int = 0):
+    """
+    Fetches one page of workout_exercises, ordered by workout_exercise_id
+
+    Returns up to limit + 1 rows, the extra row signals that there is a next page
+    """
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                           SELECT workout_exercise_id, workout_id, exercise_id, sets, reps, rest_time
+                           FROM workout_exercises
+                           WHERE workout_exercise_id > %s
+                           ORDER BY workout_exercise_id
+                           LIMIT %s;
+                           """,
+                (after_id, limit + 1),
+                name="get_workout_exercises_db",
+            )
+            return await cursor.fetchall()
+
+
+async def get_workout_exercises_by_workout_id_db(con, workout_id: int):
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT * FROM workout_exercises
+                WHERE workout_id = %s;
+                """,
+                (workout_id,), name="get_workout_exercises_by_workout_id_db"
+            )
+            return await cursor.fetchall()
+
+
+async def create_workout_exercise_db(con, workout_id: int, exercise_id: int, sets: int, reps: int, rest_time: int):
+    try:
+        async with con.transaction():
+            async with con.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, rest_time)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING workout_exercise_id;
+                    """,
+                    (workout_id, exercise_id, sets, reps, rest_time), name="create_workout_exercise_db"
+                )
+                return (await cursor.fetchone())['workout_exercise_id']
+    except ForeignKeyViolation:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid workout_id or exercise_id provided"
+        )
+
+
+async def export_workout_exercises_db(con, batch_size: int):
+    """
+    Streams every workout_exercise in batches of batch_size rows
+
+    Uses a server-side cursor, so only one batch is held in memory at a time
+    """
+    async with con.transaction():
+        async with TimedAsyncServerCursor(con, "export_workout_exercises") as cursor:
+            cursor.itersize = batch_size
+            await cursor.execute(
+                """
+                SELECT * FROM workout_exercises
+                ORDER BY workout_exercise_id;
+                """, name="export_workout_exercises_db"
+            )
+            while batch := await cursor.fetchmany(batch_size):
+                yield batch
+
+
+async def create_workout_exercises_bulk_db(con, workout_exercises: list):
+    """
+    Creates many workout-exercise relationships at once
+
+    workout_exercises is a list of (workout_id, exercise_id, sets, reps, rest_time) tuples
+    """
+    return await insert_many_db(con, 'workout_exercises', ('workout_id', 'exercise_id', 'sets', 'reps', 'rest_time'),
+                                'workout_exercise_id', workout_exercises)
+
+
+async def update_workout_exercise_db(con, workout_exercise_id: int, update_data: dict):
+    """
+    Updates every field in update_data for one workout-exercise at once
+
+    Raises exception if no value is passed or a field can't be updated
+    Also raises exception if the workout-exercise is not found
+    """
+    result = await update_row_db(con, 'workout_exercises', workout_exercise_id, update_data)
+    return result
+
+
+async def delete_workout_exercise_db(con, workout_exercise_id: int):
+    async with con.transaction():
+        async with con.cursor() as cursor:
+            await cursor.execute(
+                """
+                DELETE FROM workout_exercises
+                WHERE workout_exercise_id = %s
+                RETURNING workout_exercise_id;
+                """,
+                (workout_exercise_id,), name="delete_workout_exercise_db"
+            )
+            result = await cursor.fetchone()
+            if result:
+                return result
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
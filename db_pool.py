@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+
+from custom_exceptions import PoolTimeoutError
+
+# A small thread-safe connection pool.
+# Connections are handed out LIFO so the busiest ones stay warm and the
+# ones at the bottom of the stack age out and get reaped when traffic drops.
+# A connection that sat idle longer than check_idle is tested with a SELECT 1
+# before it is handed out, so one the server closed in the meantime (restart,
+# idle timeout) is replaced instead of failing the request.
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size: int = 2, max_size: int = 10,
+                 timeout: float = 5.0, max_idle: float = 300.0,
+                 reap_interval: float = 30.0, check_idle: float = 30.0):
+        """
+        connect is a callable returning a new psycopg2 connection.
+
+        min_size connections are opened on startup and kept alive,
+        the pool grows on demand up to max_size.
+        Callers wait up to timeout seconds for a free connection.
+        Idle connections above min_size are closed after max_idle seconds,
+        ones idle for more than check_idle seconds are tested before reuse.
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.reap_interval = reap_interval
+        self.check_idle = check_idle
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._waiting = 0
+        self._closed = True
+        self._reaper = None
+        self._stop = threading.Event()
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._broken = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def open(self):
+        """
+        Warms up the pool with min_size connections and starts the idle reaper
+        """
+        with self._lock:
+            if not self._closed:
+                return
+            self._closed = False
+            self._stop.clear()
+
+        warm = []
+        try:
+            for _ in range(self.min_size):
+                warm.append(self._new_connection())
+        except Exception:
+            # Leave the pool closed and empty, so open() can be retried
+            with self._lock:
+                self._size -= len(warm)
+                self._closed = True
+            for con in warm:
+                con.close()
+            raise
+        with self._lock:
+            for con in warm:
+                self._idle.append((con, time.monotonic()))
+            self._lock.notify_all()
+
+        self._reaper = threading.Thread(
+            target=self._reap_loop, name="db-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def close(self):
+        """
+        Closes every idle connection and stops the reaper.
+        Connections still checked out are closed when they are returned.
+        """
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        self._stop.set()
+        for con, _ in idle:
+            con.close()
+        if self._reaper:
+            self._reaper.join(timeout=self.reap_interval)
+            self._reaper = None
+
+    def getconn(self):
+        """
+        Checks out a connection
+
+        Raises PoolTimeoutError if none becomes available within the timeout
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            con, returned_at = self._take(deadline)
+            if con is None:
+                try:
+                    con = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                break
+            if self._alive(con, returned_at):
+                break
+            with self._lock:
+                self._broken += 1
+            self.putconn(con, discard=True)
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return con
+
+    def _take(self, deadline: float):
+        """
+        Pops an idle connection and when it was returned, or reserves a slot
+        for a new one and returns (None, None)
+        """
+        with self._lock:
+            if self._closed:
+                raise PoolTimeoutError("Connection pool is closed")
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._size < self.max_size:
+                        # Reserve the slot and connect outside the lock
+                        self._size += 1
+                        return None, None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {self.timeout}s")
+                    self._lock.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _alive(self, con, returned_at: float) -> bool:
+        if con.closed or con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - returned_at <= self.check_idle:
+            return True
+        try:
+            # A plain cursor, the check is not a query worth timing
+            with con.cursor(cursor_factory=extensions.cursor) as cursor:
+                cursor.execute("SELECT 1;")
+            con.rollback()
+            return True
+        except Exception:
+            return False
+
+    def putconn(self, con, discard: bool = False):
+        """
+        Returns a connection to the pool
+
+        Broken connections, or connections left inside a transaction that
+        can't be rolled back, are closed instead of being reused.
+        """
+        if not discard and not con.closed:
+            try:
+                if con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    con.rollback()
+            except Exception:
+                discard = True
+        if con.closed:
+            discard = True
+
+        with self._lock:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((con, time.monotonic()))
+            self._lock.notify()
+
+        if (discard or self._closed) and not con.closed:
+            con.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of the with-block and
+        always returns it, even if the block raises
+        """
+        con = self.getconn()
+        try:
+            yield con
+        finally:
+            self.putconn(con)
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of the pool state for monitoring
+        """
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "broken": self._broken,
+                "avg_checkout_ms": (self._checkout_time_total / checkouts * 1000) if checkouts else 0.0,
+                "max_checkout_ms": self._checkout_time_max * 1000,
+            }
+
+    def reap(self):
+        """
+        Closes connections that have been idle longer than max_idle,
+        never shrinking the pool below min_size
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            # The oldest connections sit at the left end of the deque
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0][1] > self.max_idle):
+                con, _ = self._idle.popleft()
+                self._size -= 1
+                expired.append(con)
+        for con in expired:
+            con.close()
+        return len(expired)
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            self.reap()
+
+    def _new_connection(self):
+        con = self.connect()
+        with self._lock:
+            self._size += 1
+        return con
@@ -1,129 +1,142 @@
+import argparse
 import os
 
 import psycopg2
 from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from db_pool import ConnectionPool
+from metrics import TimedAsyncCursor, TimedCursor
+from migrations import migrate, migration_status
+from prepared import PreparedConnection
 
 load_dotenv(override=True)
 
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 PASSWORD = os.getenv("PASSWORD")
+DATABASE_USER = os.getenv("DATABASE_USER", "postgres")
+DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
+DATABASE_PORT = os.getenv("DATABASE_PORT", "5432")
 
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
 
-def get_connection():
+# "sync" serves requests from psycopg2 in the thread pool,
+# "async" from psycopg 3 on the event loop
+DB_MODE = os.getenv("DB_MODE", "sync")
+if DB_MODE not in ("sync", "async"):
+    raise ValueError(f"DB_MODE must be 'sync' or 'async', got {DB_MODE!r}")
+
+
+def connect(host: str = DATABASE_HOST, port: str = DATABASE_PORT, **kwargs):
     """
-    Function that returns a single connection
-    In reality, we might use a connection pool, since
-    this way we'll start a new connection each time
-    someone hits one of our endpoints, which isn't great for performance
+    Opens a brand new connection to the database.
+    Only the pools and one-off scripts should call this directly.
+    host and port default to the primary, the read replicas pass their own.
     """
     return psycopg2.connect(
         dbname=DATABASE_NAME,
-        user="postgres",
+        user=DATABASE_USER,
         password=PASSWORD,
-        host="localhost",
-        port="5432",
+        host=host,
+        port=port,
+        connection_factory=PreparedConnection,
+        cursor_factory=TimedCursor,
+        **kwargs,
     )
 
 
-def create_tables():
-    """
-    A function to create the necessary tables for the project.
+pool = ConnectionPool(
+    connect,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    check_idle=DB_POOL_CHECK_IDLE,
+)
+
+
+def get_connection():
     """
-    connection = get_connection()
-
-    # Define the SQL statements to create the tables
-    user_table = """ 
-    CREATE TABLE IF NOT EXISTS users (
-        user_id SERIAL PRIMARY KEY,
-        password VARCHAR(100) NOT NULL,
-        name VARCHAR(250) UNIQUE NOT NULL,
-        weight BIGINT NOT NULL,
-        user_record_id BIGINT,
-        height BIGINT
-    );
+    FastAPI dependency that checks a connection out of the pool
+    for the duration of a request.
+    The connection is always handed back to the pool afterwards,
+    even if the endpoint raised.
     """
+    with pool.connection() as con:
+        yield con
 
-    categories_table = """
-    CREATE TABLE IF NOT EXISTS categories (
-        category_id SERIAL PRIMARY KEY,
-        name VARCHAR(100) UNIQUE NOT NULL
-    );
-    """
 
-    exercises_table = """
-    CREATE TABLE IF NOT EXISTS exercises (
-        exercise_id SERIAL PRIMARY KEY,
-        exercise_name VARCHAR(250) NOT NULL,
-        exercise_weight BIGINT NOT NULL,
-        repmax_id BIGINT,
-        primary_muscle VARCHAR(100),
-        secondary_muscle VARCHAR(100),
-        category_id INT NOT NULL,
-        base_exercise BOOL NOT NULL,
-        FOREIGN KEY (category_id) REFERENCES categories (category_id) ON DELETE CASCADE
-    );
+def make_async_pool(host: str = DATABASE_HOST, port: str = DATABASE_PORT,
+                    min_size: int = DB_POOL_MIN_SIZE, configure=None, **kwargs) -> AsyncConnectionPool:
     """
-
-    records_table = """
-    CREATE TABLE IF NOT EXISTS records (
-        record_id SERIAL PRIMARY KEY,
-        workout_id BIGINT NOT NULL,
-        user_id INT NOT NULL,
-        record_time TIMESTAMP NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-    );
+    Creates a closed psycopg 3 pool for the primary, or for a read replica
     """
+    return AsyncConnectionPool(
+        make_conninfo(
+            dbname=DATABASE_NAME,
+            user=DATABASE_USER,
+            password=PASSWORD,
+            host=host,
+            port=port,
+            **kwargs,
+        ),
+        min_size=min_size,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        kwargs={"row_factory": dict_row, "cursor_factory": TimedAsyncCursor},
+        configure=configure,
+        open=False,
+    )
 
-    repmax_table = """
-    CREATE TABLE IF NOT EXISTS repmax (
-        repmax_id SERIAL PRIMARY KEY,
-        exercise_id INT NOT NULL,
-        user_id INT NOT NULL,
-        weight BIGINT NOT NULL,
-        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE,
-        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-    );
-    """
 
-    workouts_table = """
-    CREATE TABLE IF NOT EXISTS workouts (
-        workout_id SERIAL PRIMARY KEY,
-        workout_name VARCHAR(250) NOT NULL,
-        timecap BIGINT NOT NULL,
-        record_id INT NOT NULL,
-        exercise_id INT NOT NULL,
-        for_kids BOOL,
-        FOREIGN KEY (record_id) REFERENCES records (record_id) ON DELETE CASCADE,
-        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE
-    );
-    """,
-
-    workout_exercises_table = """
-    CREATE TABLE workout_exercises (
-    workout_exercise_id SERIAL PRIMARY KEY,
-    workout_id INT NOT NULL,
-    exercise_id INT NOT NULL,
-    sets INT DEFAULT 0,
-    reps INT DEFAULT 0,
-    rest_time BIGINT DEFAULT 0,
-    FOREIGN KEY (workout_id) REFERENCES workouts (workout_id) ON DELETE CASCADE,
-    FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE
-    );
+async_pool = make_async_pool()
+
+
+async def get_async_connection():
+    """
+    Async counterpart of get_connection, used by the endpoints in async_routes.py
     """
+    async with async_pool.connection() as con:
+        yield con
 
 
-    # Execute the table creation statements
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(user_table)
-            cursor.execute(categories_table)
-            cursor.execute(exercises_table)
-            cursor.execute(records_table)
-            cursor.execute(repmax_table)
-            cursor.execute(workouts_table)
-            cursor.execute(workout_exercises_table)
+def create_tables():
+    """
+    A function to create the necessary tables for the project.
+    Brings the schema up to date by applying every pending migration.
+    """
+    connection = connect()
+    try:
+        return migrate(connection)
+    finally:
+        connection.close()
+
 
 if __name__ == "__main__":
-    # Execute the script to create tables
-    create_tables()
-    print("Tables created successfully.")
+    parser = argparse.ArgumentParser(description="Create and migrate the Trainify database schema")
+    parser.add_argument("command", nargs="?", default="migrate", choices=["migrate", "status"],
+                        help="migrate applies pending migrations (default), status lists them")
+    parser.add_argument("--target", type=int, default=None,
+                        help="only migrate up to and including this version")
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        if args.command == "status":
+            for version, description, applied_at in migration_status(connection):
+                state = applied_at.isoformat(timespec="seconds") if applied_at else "pending"
+                print(f"{version:>4}  {state:<19}  {description}")
+        else:
+            applied = migrate(connection, target=args.target)
+            for migration in applied:
+                print(f"Applied migration {migration.version}: {migration.description}")
+            print("Schema is up to date." if not applied else f"{len(applied)} migration(s) applied.")
+    finally:
+        connection.close()
@@ -0,0 +1,153 @@
+import hashlib
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+from cache import TTLCache, read_through
+from compression import COMPRESSION_MIN_SIZE, compress_async, negotiate
+import db_async
+from db import get_table_versions_db
+from db_setup import DB_MODE
+from replicas import pinned_to_primary, replica_router
+from routing import route_path
+
+# Strong ETags for the GET routes.
+# Every table has a version in table_versions that a statement level trigger
+# bumps on each write (see migrations 6 and 9). A response only depends on the tables
+# listed for its route below, so hashing their versions together with the url
+# gives an ETag that changes exactly when the answer can change.
+# A matching If-None-Match gets a 304 without running the endpoint at all,
+# and the serialized body is kept per (url, versions) for clients without an ETag.
+# Next to it the cache keeps the body compressed with every encoding asked for so far,
+# each variant has its own ETag, as a strong ETag names exact bytes.
+# Endpoints run under cache.read_through(), the per-process caches may still hold
+# a row another worker changed, and that row must not end up under the new versions.
+# The versions themselves are kept for ETAG_VERSIONS_TTL, so a burst of GETs shares
+# one read. Writes through this process clear them, and clients pinned to the
+# primary after a write always read them fresh, so only writes of other clients
+# through other workers can go unseen for that long.
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAXSIZE = int(os.getenv("RESPONSE_CACHE_MAXSIZE", "2000"))
+ETAG_VERSIONS_TTL = float(os.getenv("ETAG_VERSIONS_TTL", "1"))
+
+# Route path -> tables the endpoint reads
+ROUTE_TABLES = {
+    "/users": ("users",),
+    "/users/{user_id}": ("users",),
+    "/users/{user_id}/dashboard": ("users", "records", "repmax", "workouts"),
+    "/users/{user_id}/personal-bests": ("users", "personal_bests", "exercises"),
+    "/records": ("records",),
+    "/records/{user_id}": ("records",),
+    "/exercises": ("exercises",),
+    "/exercises/{exercise_id}": ("exercises",),
+    "/exercises/{exercise_id}/leaderboard": ("exercises", "personal_bests", "users"),
+    "/workouts": ("workouts",),
+    "/workouts/{workout_id}": ("workouts",),
+    "/workouts/{workout_id}/full": ("workouts", "workout_exercises", "exercises", "categories"),
+    "/repmaxs": ("repmax",),
+    "/categories": ("categories",),
+    "/workout_exercises": ("workout_exercises",),
+    "/workout_exercises/{id}": ("workout_exercises",),
+}
+
+response_cache = TTLCache('responses', maxsize=RESPONSE_CACHE_MAXSIZE, ttl=RESPONSE_CACHE_TTL)
+# Route tables -> their versions
+versions_cache = TTLCache('table_versions', maxsize=len(ROUTE_TABLES), ttl=ETAG_VERSIONS_TTL)
+
+
+def _read_versions_sync(scope, tables: tuple) -> dict:
+    with replica_router.connection(scope) as con:
+        return get_table_versions_db(con, tables)
+
+
+async def _read_versions(scope, tables: tuple) -> tuple:
+    if not pinned_to_primary(scope):
+        found, versions = versions_cache.lookup(tables)
+        if found:
+            return versions
+    generation = versions_cache.generation
+    if DB_MODE == "async":
+        async with replica_router.async_connection(scope) as con:
+            versions = await db_async.get_table_versions_db(con, tables)
+    else:
+        versions = await run_in_threadpool(_read_versions_sync, scope, tables)
+    versions = tuple(versions.get(table, 0) for table in tables)
+    versions_cache.store(tables, versions, generation)
+    return versions
+
+
+def make_etag(url: str, versions: tuple) -> str:
+    digest = hashlib.blake2b(f"{url}|{versions}".encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def variant_etag(etag: str, encoding: str | None) -> str:
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def _encoded_response(bodies: dict, etag: str, encoding: str | None) -> Response:
+    """
+    Answers with the body in encoding, compressing and caching it on first use
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    body = bodies[None]
+    if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+        return Response(content=body, media_type="application/json", headers=headers)
+    encoded = bodies.get(encoding)
+    if encoded is None:
+        encoded = bodies[encoding] = await compress_async(body, encoding)
+    headers["ETag"] = variant_etag(etag, encoding)
+    headers["Content-Encoding"] = encoding
+    return Response(content=encoded, media_type="application/json", headers=headers)
+
+
+class ETagMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if request.method != "GET":
+            response = await call_next(request)
+            if request.method not in ("HEAD", "OPTIONS"):
+                # The write has committed, the next GET reads the versions it bumped
+                versions_cache.clear()
+            return response
+        # Also lets the metrics label 304s and cached bodies, which never reach the router
+        tables = ROUTE_TABLES.get(route_path(request.scope))
+        if tables is None:
+            return await call_next(request)
+
+        # Versions are read before the endpoint runs, so a write that commits
+        # in between can only make the stored body newer than its key, never older
+        versions = await _read_versions(request.scope, tables)
+        query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+        url = f"{request.url.path}?{query}"
+        etag = make_etag(url, versions)
+        encoding = negotiate(request.headers.get("accept-encoding"))
+
+        if_none_match = request.headers.get("if-none-match")
+        for candidate in {etag, variant_etag(etag, encoding)}:
+            if etag_matches(if_none_match, candidate):
+                return Response(status_code=304, headers={"ETag": candidate, "Cache-Control": "no-cache",
+                                                          "Vary": "Accept-Encoding"})
+
+        # encoding -> body, None holds the uncompressed one
+        found, bodies = response_cache.lookup(etag)
+        if found:
+            return await _encoded_response(bodies, etag, encoding)
+
+        generation = response_cache.generation
+        with read_through():
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            bodies = {None: b"".join([chunk async for chunk in response.body_iterator])}
+        response_cache.store(etag, bodies, generation)
+        return await _encoded_response(bodies, etag, encoding)
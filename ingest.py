@@ -0,0 +1,429 @@
+import fcntl
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import orjson
+import psycopg2
+from fastapi import HTTPException, status
+
+from custom_exceptions import PoolTimeoutError
+from db import create_ingested_records_db, delete_ingest_receipts_db, get_ingest_receipts_db
+from db_setup import pool
+from schemas import RecordCreate
+
+# Write-behind ingestion for POST /records.
+# With RECORD_INGEST on, an accepted record is appended to a local spill file
+# and to an in-memory queue, and the client gets a 202 with a receipt id right
+# away. One background thread writes the queue to Postgres in batches of up to
+# INGEST_BATCH_SIZE, at least every INGEST_FLUSH_INTERVAL seconds, so one
+# commit covers hundreds of records instead of one.
+# Spill appends are fsynced before the 202 goes out. Requests arriving while
+# another one fsyncs share the next fsync, so under load one fsync covers many
+# records too. The spill is split into segment files, a segment is deleted once
+# every record in it is in the database.
+# Every process spills into a directory of its own under INGEST_SPILL_DIR and
+# holds an flock on its lock file while it runs. On startup a process adopts
+# the directories whose lock it can take, those of processes that crashed or
+# couldn't write everything before they stopped, and replays their segments.
+# Each batch stores its receipt ids in ingest_receipts in the same transaction
+# as the records, so replaying never writes a record twice and
+# GET /records/ingest/{receipt_id} can confirm a record after a restart.
+
+RECORD_INGEST = os.getenv("RECORD_INGEST", "false").lower() in ("1", "true", "yes")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100000"))
+INGEST_SPILL_DIR = os.getenv("INGEST_SPILL_DIR", "ingest_spill")
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "true").lower() in ("1", "true", "yes")
+# Seconds receipts are kept in the database for status checks
+INGEST_RECEIPT_TTL = float(os.getenv("INGEST_RECEIPT_TTL", "86400"))
+
+# Records per spill segment before a new one is started
+SEGMENT_RECORDS = INGEST_BATCH_SIZE * 20
+# Outcomes of recent receipts kept in memory, older ones are looked up in ingest_receipts
+RECEIPTS_KEPT = 100000
+RETRY_DELAY = 1.0
+PRUNE_INTERVAL = 3600
+LOCK_FILE = "lock"
+
+logger = logging.getLogger("trainify.ingest")
+
+
+class Segment:
+    """
+    One spill file, deleted once every record written to it is persisted
+    """
+
+    def __init__(self, path: str, pending: int = 0, replayed: bool = False):
+        self.path = path
+        # Unbuffered, so a written line survives a crash of the process even before its fsync
+        self.file = None if replayed else open(path, "ab", buffering=0)
+        self.written = 0
+        self.synced = 0
+        self.pending = pending
+        self.sync_lock = threading.Lock()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+
+
+class RecordIngester:
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._queue = deque()  # (receipt_id, RecordCreate, Segment)
+        self._current = None
+        self._segments = []
+        self._next_segment = 0
+        self._dir = None
+        self._lock_file = None
+        # Receipts of batches whose commit may or may not have gone through
+        self._uncertain = set()
+        self._done = OrderedDict()  # receipt_id -> (status, record_id, error)
+        self._pending = set()
+        self._flusher = None
+        self._stopping = False
+        self.persisted = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_ms = None
+
+    def start(self):
+        """
+        Claims a spill directory, replays the ones crashed processes left behind and starts the flusher thread
+        """
+        os.makedirs(INGEST_SPILL_DIR, exist_ok=True)
+        self._dir = os.path.join(INGEST_SPILL_DIR, f"worker-{uuid.uuid4().hex[:12]}")
+        os.mkdir(self._dir)
+        self._lock_file = _try_lock(os.path.join(self._dir, LOCK_FILE), create=True)
+        self._next_segment = 0
+        _fsync_dir(INGEST_SPILL_DIR)
+        for path in glob.glob(os.path.join(INGEST_SPILL_DIR, "worker-*")):
+            if path != self._dir:
+                self._adopt(path)
+        self._stopping = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="record-ingest", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """
+        Writes out everything queued and stops the flusher
+
+        The spill directory is removed when everything was written, otherwise it
+        is left unlocked for the next process to adopt
+        """
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            if not self._segments:
+                _remove_dir(self._dir)
+            self._lock_file.close()
+            self._segments = []
+            self._current = None
+
+    def _adopt(self, path: str):
+        """
+        Moves the segments of another process's spill directory into ours if that process is gone
+        """
+        lock_file = _try_lock(os.path.join(path, LOCK_FILE))
+        if lock_file is None:
+            # Still running
+            return
+        try:
+            paths = sorted(glob.glob(os.path.join(path, "segment-*.ndjson")), key=_segment_number)
+            adopted = []
+            for old_path in paths:
+                new_path = os.path.join(self._dir, f"segment-{self._next_segment:08d}.ndjson")
+                self._next_segment += 1
+                os.rename(old_path, new_path)
+                adopted.append(new_path)
+            _fsync_dir(self._dir)
+            _fsync_dir(path)
+            for new_path in adopted:
+                self._replay(new_path)
+            _remove_dir(path)
+        finally:
+            lock_file.close()
+
+    def _replay(self, path: str):
+        entries = []
+        with open(path, "rb") as file:
+            for line in file:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Torn write at the end of the file, its request never got a 202
+                    continue
+                entries.append((entry["receipt_id"], RecordCreate.model_validate(entry["record"])))
+        with pool.connection() as con:
+            written = get_ingest_receipts_db(con, [receipt_id for receipt_id, _ in entries])
+        entries = [(receipt_id, record) for receipt_id, record in entries if receipt_id not in written]
+        if not entries:
+            os.remove(path)
+            _fsync_dir(self._dir)
+            return
+        segment = Segment(path, pending=len(entries), replayed=True)
+        self._segments.append(segment)
+        for receipt_id, record in entries:
+            self._pending.add(receipt_id)
+            self._queue.append((receipt_id, record, segment))
+        logger.warning("Replaying %s records from %s", len(entries), path, extra={"path": path})
+
+    def _rotate(self) -> Segment:
+        segment = Segment(os.path.join(self._dir, f"segment-{self._next_segment:08d}.ndjson"))
+        self._next_segment += 1
+        # The new file's directory entry has to be on disk before its first 202 goes out
+        _fsync_dir(self._dir)
+        self._segments.append(segment)
+        self._current = segment
+        return segment
+
+    def accept(self, record: RecordCreate) -> str:
+        """
+        Queues record and returns its receipt id once it is safely on disk
+
+        Raises 503 while the queue is full
+        """
+        receipt_id = str(uuid.uuid4())
+        line = orjson.dumps({"receipt_id": receipt_id, "record": record.model_dump(mode="json")}) + b"\n"
+        with self._lock:
+            if len(self._queue) >= INGEST_QUEUE_SIZE:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many records waiting to be written", headers={"Retry-After": "1"})
+            segment = self._current
+            if segment is None or segment.written >= SEGMENT_RECORDS:
+                segment = self._rotate()
+            segment.file.write(line)
+            segment.written += 1
+            segment.pending += 1
+            written = segment.written
+            self._pending.add(receipt_id)
+            self._queue.append((receipt_id, record, segment))
+            if len(self._queue) >= INGEST_BATCH_SIZE:
+                self._lock.notify_all()
+        if INGEST_FSYNC:
+            self._sync(segment, written)
+        return receipt_id
+
+    def _sync(self, segment: Segment, written: int):
+        # Whoever holds sync_lock fsyncs every line written so far, the requests
+        # waiting for it usually find their own line already covered
+        with segment.sync_lock:
+            if segment.synced >= written:
+                return
+            with self._lock:
+                if segment.file.closed:
+                    # Deleted, so every record in it is already persisted
+                    return
+                fd = segment.file.fileno()
+                target = segment.written
+            try:
+                os.fsync(fd)
+            except OSError:
+                if not segment.file.closed:
+                    raise
+            segment.synced = target
+
+    def _take_batch(self) -> list:
+        with self._lock:
+            deadline = time.monotonic() + INGEST_FLUSH_INTERVAL
+            while len(self._queue) < INGEST_BATCH_SIZE and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(INGEST_BATCH_SIZE, len(self._queue)))]
+
+    def _flush_loop(self):
+        pruned_at = 0.0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            try:
+                unwritten = self._write(self._skip_written(batch))
+            except Exception:
+                # Never let the flusher die while POST /records keeps accepting
+                logger.exception("Writing %s queued records failed, retrying", len(batch))
+                unwritten = batch
+            if unwritten:
+                if self._stopping:
+                    # Still in the spill, the next start replays them
+                    return
+                with self._lock:
+                    unwritten = [item for item in unwritten if item[0] in self._pending]
+                    self._uncertain.update(receipt_id for receipt_id, _, _ in unwritten)
+                    self._queue.extendleft(reversed(unwritten))
+                time.sleep(RETRY_DELAY)
+                continue
+            if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                try:
+                    with pool.connection() as con:
+                        delete_ingest_receipts_db(con, INGEST_RECEIPT_TTL)
+                except (psycopg2.Error, PoolTimeoutError):
+                    logger.exception("Deleting old ingest receipts failed")
+
+    def _skip_written(self, batch: list) -> list:
+        """
+        Finishes the records of a failed attempt that were committed after all, returns the rest
+        """
+        uncertain = [receipt_id for receipt_id, _, _ in batch if receipt_id in self._uncertain]
+        if not uncertain:
+            return batch
+        with pool.connection() as con:
+            written = get_ingest_receipts_db(con, uncertain)
+        self._uncertain.difference_update(uncertain)
+        done = [item for item in batch if item[0] in written]
+        if done:
+            self._finish(done, [written[receipt_id] for receipt_id, _, _ in done], {})
+        return [item for item in batch if item[0] not in written]
+
+    def _write(self, batch: list) -> list:
+        """
+        Writes batch and returns the part of it that has to be retried later
+        """
+        if not batch:
+            return []
+        started = time.perf_counter()
+        try:
+            with pool.connection() as con:
+                ids, errors = create_ingested_records_db(
+                    con, [(r.workout_id, r.user_id, r.record_date, r.record_time) for _, r, _ in batch],
+                    [receipt_id for receipt_id, _, _ in batch])
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeoutError) as exc:
+            # The database is unreachable, the records stay queued and on disk
+            logger.warning("Writing %s queued records failed, retrying: %s", len(batch), exc)
+            return batch
+        except psycopg2.Error as exc:
+            if len(batch) > 1:
+                # Only constraint violations are retried row by row in the database,
+                # split the batch so a bad value only fails its own record
+                for index, item in enumerate(batch):
+                    if self._write([item]):
+                        return batch[index:]
+                return []
+            ids, errors = [None], {0: exc.diag.message_primary or str(exc)}
+        self.batches += 1
+        self.last_batch_ms = round((time.perf_counter() - started) * 1000, 3)
+        self._finish(batch, ids, errors)
+        return []
+
+    def _finish(self, batch: list, ids: list, errors: dict):
+        with self._lock:
+            for index, ((receipt_id, _, segment), record_id) in enumerate(zip(batch, ids)):
+                if index in errors:
+                    self._done[receipt_id] = ("failed", None, errors[index])
+                    self.failed += 1
+                    logger.warning("Queued record %s was rejected: %s", receipt_id, errors[index],
+                                   extra={"entity": "record", "receipt_id": receipt_id})
+                else:
+                    self._done[receipt_id] = ("persisted", record_id, None)
+                    self.persisted += 1
+                self._pending.discard(receipt_id)
+                segment.pending -= 1
+            while len(self._done) > RECEIPTS_KEPT:
+                self._done.popitem(last=False)
+            self._drop_finished_segments()
+
+    def _drop_finished_segments(self):
+        for segment in [segment for segment in self._segments if segment.pending == 0]:
+            if segment is self._current:
+                # Drop the active segment too when it is all written, so an idle app keeps no spill
+                self._current = None
+            segment.close()
+            os.remove(segment.path)
+            self._segments.remove(segment)
+            _fsync_dir(self._dir)
+
+    def receipt(self, receipt_id: str) -> dict | None:
+        """
+        Returns the state of a receipt, None if it is unknown or too old
+        """
+        try:
+            receipt_id = str(uuid.UUID(receipt_id))
+        except ValueError:
+            return None
+        with self._lock:
+            if receipt_id in self._pending:
+                return {"receipt_id": receipt_id, "status": "queued"}
+            done = self._done.get(receipt_id)
+        if done is None:
+            with pool.connection() as con:
+                record_id = get_ingest_receipts_db(con, [receipt_id]).get(receipt_id)
+            if record_id is None:
+                return None
+            done = ("persisted", record_id, None)
+        state, record_id, error = done
+        return {"receipt_id": receipt_id, "status": state, "record_id": record_id, "error": error}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": RECORD_INGEST,
+                "queued": len(self._queue),
+                "segments": len(self._segments),
+                "persisted": self.persisted,
+                "failed": self.failed,
+                "batches": self.batches,
+                "last_batch_ms": self.last_batch_ms,
+            }
+
+
+def _try_lock(path: str, create: bool = False):
+    """
+    Opens path and takes an exclusive flock on it, returns None if another process holds it
+    """
+    try:
+        lock_file = open(path, "a" if create else "r")
+    except FileNotFoundError:
+        # Removed by whoever adopted the directory
+        return None
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _remove_dir(path: str):
+    """
+    Removes an empty spill directory and its lock file, the caller holds the lock
+    """
+    try:
+        os.remove(os.path.join(path, LOCK_FILE))
+        os.rmdir(path)
+    except FileNotFoundError:
+        return
+    _fsync_dir(INGEST_SPILL_DIR)
+
+
+def _fsync_dir(path: str):
+    if not INGEST_FSYNC:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _segment_number(path: str) -> int:
+    return int(os.path.basename(path)[len("segment-"):-len(".ndjson")])
+
+
+ingester = RecordIngester()
@@ -0,0 +1,191 @@
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from metrics import LOG_RECORDS_DROPPED
+
+# Structured, non-blocking logging for the "trainify" loggers.
+# Request threads only put the LogRecord on a bounded queue. A background
+# QueueListener thread formats it (JSON by default) and writes it to stdout,
+# so a slow log sink never stalls a worker. When the queue is full the record
+# is dropped and counted instead of blocking.
+# Messages use lazy %-style arguments, so a disabled level costs one level check
+# and nothing is ever formatted on the request thread.
+# LogContextMiddleware tags every record with the request id, route and time
+# spent in the request so far.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of records kept per level, e.g. "INFO=0.1,DEBUG=0.01". Unlisted levels are always kept.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# (request id, ASGI scope, perf_counter at start) of the request being handled
+_request = ContextVar("request", default=None)
+
+# Attributes every LogRecord has, anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_listener = None
+
+
+def parse_sample_rates(value: str) -> dict:
+    """
+    Parses "INFO=0.1,DEBUG=0.01" into {logging.INFO: 0.1, logging.DEBUG: 0.01}
+
+    Raises ValueError for an unknown level name
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        level, _, rate = item.partition("=")
+        levelno = logging.getLevelName(level.strip().upper())
+        # getLevelName answers "Level X" for names it doesn't know
+        if not isinstance(levelno, int):
+            raise ValueError(f"Unknown log level {level.strip()!r} in LOG_SAMPLE_RATES")
+        rates[levelno] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a random share of the records of the sampled levels
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record) -> bool:
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    QueueHandler that attaches the request context instead of formatting the record
+    """
+
+    def prepare(self, record):
+        request = _request.get()
+        if request is not None:
+            request_id, scope, started = request
+            record.request_id = request_id
+            record.route = _route(scope)
+            record.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        if record.exc_info:
+            # Rendered here so the listener doesn't keep the frames alive
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with every extra= field as a key of its own
+    """
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("route_path") or scope.get("path")
+
+
+def configure_logging():
+    """
+    Sends the trainify loggers through the queue, the listener starts with start_logging()
+    """
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    _listener = QueueListener(_queue, handler)
+
+    queue_handler = ContextQueueHandler(_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    logger = logging.getLogger("trainify")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+
+def start_logging():
+    configure_logging()
+    if _listener._thread is None:
+        _listener.start()
+
+
+def stop_logging():
+    """
+    Writes out everything still queued and stops the listener thread
+    """
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+class LogContextMiddleware:
+    """
+    Pure ASGI middleware giving each request an id for its log records
+
+    An incoming X-Request-ID is reused, the id is sent back in the same header
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = _request.set((request_id, scope, time.perf_counter()))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
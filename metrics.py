@@ -0,0 +1,191 @@
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from psycopg import AsyncCursor, AsyncServerCursor
+from psycopg2.extensions import cursor as Cursor
+from psycopg2.extras import RealDictCursor
+from starlette.responses import Response
+
+import slowlog
+
+# Prometheus metrics, served in text format by GET /metrics.
+# Requests are measured by MetricsMiddleware, queries by the cursor classes
+# below (db_setup makes them the default for every connection), and the pool
+# numbers are read only when Prometheus scrapes, so they cost nothing per request.
+# The cursors also hand statements over SLOW_QUERY_MS to the slow-query log in slowlog.py.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+HTTP_REQUESTS = Counter("trainify_http_requests_total", "HTTP requests handled",
+                        ["method", "route", "status"])
+HTTP_LATENCY = Histogram("trainify_http_request_duration_seconds", "Time spent handling an HTTP request",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("trainify_http_requests_in_flight", "HTTP requests being handled right now")
+QUERY_LATENCY = Histogram("trainify_db_query_duration_seconds", "Time spent executing a database query",
+                          ["query"], buckets=LATENCY_BUCKETS)
+QUERY_ROWS = Histogram("trainify_db_query_rows", "Rows returned or changed by a database query",
+                       ["query"], buckets=ROW_BUCKETS)
+LOG_RECORDS_DROPPED = Counter("trainify_log_records_dropped_total", "Log records dropped because the log queue was full")
+HTTP_REQUESTS_SHED = Counter("trainify_http_requests_shed_total", "Requests rejected by admission control",
+                             ["reason"])
+
+# A query is labelled with the name its caller passes to execute, the db.py
+# function it runs in, or for prepared statements the statement name. Queries a
+# helper such as execute_values runs get the cursor's label instead, set it
+# before calling one. Scripts that don't name their queries share "unnamed".
+UNNAMED = "unnamed"
+
+_query_metrics = {}
+
+
+def observe_query(name: str, seconds: float, rows: int, query=None, params=None):
+    if seconds >= slowlog.SLOW_QUERY_SECONDS:
+        slowlog.record(name, query, params, seconds, rows)
+    metrics = _query_metrics.get(name)
+    if metrics is None:
+        metrics = _query_metrics[name] = (QUERY_LATENCY.labels(name), QUERY_ROWS.labels(name))
+    metrics[0].observe(seconds)
+    if rows >= 0:
+        metrics[1].observe(rows)
+
+
+class TimedCursor(Cursor):
+    """
+    psycopg2 cursor that records how long every query takes
+    """
+    label = UNNAMED
+
+    def execute(self, query, vars=None, name=None):
+        name = name or self.label
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_query(name, time.perf_counter() - started, self.rowcount, query, vars)
+
+
+class TimedDictCursor(RealDictCursor):
+    """
+    RealDictCursor that records how long every query takes
+    """
+    label = UNNAMED
+
+    def execute(self, query, vars=None, name=None):
+        name = name or self.label
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_query(name, time.perf_counter() - started, self.rowcount, query, vars)
+
+
+class TimedAsyncCursor(AsyncCursor):
+    """
+    psycopg 3 cursor that records how long every query takes
+    """
+    label = UNNAMED
+
+    async def execute(self, query, params=None, name=None, **kwargs):
+        name = name or self.label
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            observe_query(name, time.perf_counter() - started, self.rowcount, query, params)
+
+
+class TimedAsyncServerCursor(AsyncServerCursor):
+    """
+    psycopg 3 server-side cursor that records how long every query takes,
+    the connection's cursor() can't be given a factory for these
+    """
+    label = UNNAMED
+
+    async def execute(self, query, params=None, name=None, **kwargs):
+        name = name or self.label
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            observe_query(name, time.perf_counter() - started, self.rowcount, query, params)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware counting and timing every HTTP request per route
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            # The route template keeps the label count bounded, unknown paths share one label
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("route_path") or "unmatched"
+            HTTP_REQUESTS.labels(scope["method"], path, status).inc()
+            HTTP_LATENCY.labels(scope["method"], path).observe(elapsed)
+
+
+class PoolCollector:
+    """
+    Reports connection pool saturation whenever /metrics is scraped
+    """
+
+    def __init__(self, pool, async_pool=None):
+        self.pool = pool
+        self.async_pool = async_pool
+
+    def collect(self):
+        gauges = {key: GaugeMetricFamily(f"trainify_db_pool_{key}", f"Connection pool {key.replace('_', ' ')}",
+                                         labels=["pool"])
+                  for key in ("size", "idle", "in_use", "waiting", "max_size")}
+        counters = {key: CounterMetricFamily(f"trainify_db_pool_{key}", f"Connection pool {key}", labels=["pool"])
+                    for key in ("checkouts", "timeouts")}
+
+        if self.pool is not None:
+            stats = self.pool.stats()
+            for key, family in (*gauges.items(), *counters.items()):
+                family.add_metric(["sync"], stats[key])
+
+        if self.async_pool is not None and not self.async_pool.closed:
+            stats = self.async_pool.get_stats()
+            size, idle = stats.get("pool_size", 0), stats.get("pool_available", 0)
+            gauges["size"].add_metric(["async"], size)
+            gauges["idle"].add_metric(["async"], idle)
+            gauges["in_use"].add_metric(["async"], size - idle)
+            gauges["waiting"].add_metric(["async"], stats.get("requests_waiting", 0))
+            gauges["max_size"].add_metric(["async"], stats.get("pool_max", 0))
+            counters["checkouts"].add_metric(["async"], stats.get("requests_num", 0))
+            counters["timeouts"].add_metric(["async"], stats.get("requests_errors", 0))
+
+        yield from gauges.values()
+        yield from counters.values()
+
+
+def register_pool_metrics(pool, async_pool=None):
+    REGISTRY.register(PoolCollector(pool, async_pool))
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,378 @@
+from typing import NamedTuple
+
+# Versioned schema migrations.
+# Migrations are applied in order and recorded in the schema_version table,
+# so running them again only applies what is missing.
+# Never edit a migration that has shipped, add a new one instead.
+
+# Arbitrary key for the advisory lock that keeps two migrators from racing
+MIGRATION_LOCK_ID = 7413
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: tuple
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block,
+    # so migrations using it run statement by statement in autocommit mode
+    transactional: bool = True
+
+
+BASE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id SERIAL PRIMARY KEY,
+        password VARCHAR(100) NOT NULL,
+        name VARCHAR(250) UNIQUE NOT NULL,
+        weight BIGINT NOT NULL,
+        user_record_id BIGINT,
+        height BIGINT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS categories (
+        category_id SERIAL PRIMARY KEY,
+        name VARCHAR(100) UNIQUE NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exercises (
+        exercise_id SERIAL PRIMARY KEY,
+        exercise_name VARCHAR(250) NOT NULL,
+        exercise_weight BIGINT NOT NULL,
+        repmax_id BIGINT,
+        primary_muscle VARCHAR(100),
+        secondary_muscle VARCHAR(100),
+        category_id INT NOT NULL,
+        base_exercise BOOL NOT NULL,
+        FOREIGN KEY (category_id) REFERENCES categories (category_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS records (
+        record_id SERIAL PRIMARY KEY,
+        workout_id BIGINT NOT NULL,
+        user_id INT NOT NULL,
+        record_time TIMESTAMP NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS repmax (
+        repmax_id SERIAL PRIMARY KEY,
+        exercise_id INT NOT NULL,
+        user_id INT NOT NULL,
+        weight BIGINT NOT NULL,
+        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS workouts (
+        workout_id SERIAL PRIMARY KEY,
+        workout_name VARCHAR(250) NOT NULL,
+        timecap BIGINT NOT NULL,
+        record_id INT NOT NULL,
+        exercise_id INT NOT NULL,
+        for_kids BOOL,
+        FOREIGN KEY (record_id) REFERENCES records (record_id) ON DELETE CASCADE,
+        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS workout_exercises (
+        workout_exercise_id SERIAL PRIMARY KEY,
+        workout_id INT NOT NULL,
+        exercise_id INT NOT NULL,
+        sets INT DEFAULT 0,
+        reps INT DEFAULT 0,
+        rest_time BIGINT DEFAULT 0,
+        FOREIGN KEY (workout_id) REFERENCES workouts (workout_id) ON DELETE CASCADE,
+        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE
+    );
+    """,
+)
+
+
+# personal_bests holds the heaviest repmax of every (user, exercise) pair.
+# A trigger on repmax keeps it current for every write path (single, bulk, async),
+# an insert only compares against the stored best, an update or delete only
+# rescans that pair's history when it touched the current best.
+PERSONAL_BESTS = (
+    """
+    CREATE TABLE IF NOT EXISTS personal_bests (
+        user_id INT NOT NULL,
+        exercise_id INT NOT NULL,
+        weight BIGINT NOT NULL,
+        repmax_id INT NOT NULL,
+        PRIMARY KEY (user_id, exercise_id),
+        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+        FOREIGN KEY (exercise_id) REFERENCES exercises (exercise_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION refresh_personal_best(p_user_id INT, p_exercise_id INT) RETURNS void AS $$
+    BEGIN
+        DELETE FROM personal_bests WHERE user_id = p_user_id AND exercise_id = p_exercise_id;
+        INSERT INTO personal_bests (user_id, exercise_id, weight, repmax_id)
+        SELECT user_id, exercise_id, weight, repmax_id FROM repmax
+        WHERE user_id = p_user_id AND exercise_id = p_exercise_id
+        ORDER BY weight DESC, repmax_id
+        LIMIT 1;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION repmax_personal_best() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND EXISTS (
+            SELECT 1 FROM personal_bests
+            WHERE user_id = OLD.user_id AND exercise_id = OLD.exercise_id AND repmax_id = OLD.repmax_id
+        ) THEN
+            PERFORM refresh_personal_best(OLD.user_id, OLD.exercise_id);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO personal_bests (user_id, exercise_id, weight, repmax_id)
+            VALUES (NEW.user_id, NEW.exercise_id, NEW.weight, NEW.repmax_id)
+            ON CONFLICT (user_id, exercise_id) DO UPDATE
+            SET weight = EXCLUDED.weight, repmax_id = EXCLUDED.repmax_id
+            WHERE EXCLUDED.weight > personal_bests.weight;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS repmax_personal_best ON repmax;",
+    """
+    CREATE TRIGGER repmax_personal_best
+    AFTER INSERT OR UPDATE OR DELETE ON repmax
+    FOR EACH ROW EXECUTE FUNCTION repmax_personal_best();
+    """,
+    """
+    INSERT INTO personal_bests (user_id, exercise_id, weight, repmax_id)
+    SELECT DISTINCT ON (user_id, exercise_id) user_id, exercise_id, weight, repmax_id
+    FROM repmax
+    ORDER BY user_id, exercise_id, weight DESC, repmax_id
+    ON CONFLICT (user_id, exercise_id) DO NOTHING;
+    """,
+)
+
+
+# One change counter per table, bumped once per writing statement.
+# The ETags of the GET routes are derived from these counters.
+# Migration 9 splits each counter over VERSION_SHARDS rows, see SHARDED_TABLE_VERSIONS.
+VERSIONED_TABLES = ('users', 'categories', 'exercises', 'records', 'repmax',
+                    'workouts', 'workout_exercises', 'personal_bests')
+
+TABLE_VERSIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    *(
+        statement
+        for table in VERSIONED_TABLES
+        for statement in (
+            f"INSERT INTO table_versions (table_name) VALUES ('{table}') ON CONFLICT DO NOTHING;",
+            f"DROP TRIGGER IF EXISTS {table}_version ON {table};",
+            f"""
+            CREATE TRIGGER {table}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+            """,
+        )
+    ),
+)
+
+
+# Concurrent writers to one table used to queue on its single table_versions row
+# until the first one committed. The counter is now split over VERSION_SHARDS
+# rows and each statement bumps a shard no other open transaction holds, so
+# writers only wait once more than VERSION_SHARDS of them are open at a time.
+# The version of a table is the sum of its shards.
+VERSION_SHARDS = 16
+
+SHARDED_TABLE_VERSIONS = (
+    "ALTER TABLE table_versions ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0;",
+    "ALTER TABLE table_versions DROP CONSTRAINT IF EXISTS table_versions_pkey;",
+    "ALTER TABLE table_versions ADD PRIMARY KEY (table_name, shard);",
+    f"""
+    INSERT INTO table_versions (table_name, shard)
+    SELECT table_name, shard
+    FROM (SELECT DISTINCT table_name FROM table_versions) AS tables,
+         generate_series(1, {VERSION_SHARDS - 1}) AS shard
+    ON CONFLICT DO NOTHING;
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    DECLARE
+        setting TEXT := 'trainify.version_shard_' || TG_TABLE_NAME;
+        picked SMALLINT := NULLIF(current_setting(setting, true), '')::smallint;
+    BEGIN
+        -- Later statements of the transaction reuse the shard it already holds
+        IF picked IS NULL THEN
+            SELECT shard INTO picked FROM table_versions
+            WHERE table_name = TG_TABLE_NAME
+            ORDER BY random()
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED;
+            IF picked IS NULL THEN
+                -- Every shard is held, wait for a random one
+                picked := floor(random() * {VERSION_SHARDS})::int;
+            END IF;
+            PERFORM set_config(setting, picked::text, true);
+        END IF;
+        UPDATE table_versions SET version = version + 1
+        WHERE table_name = TG_TABLE_NAME AND shard = picked;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+)
+
+
+MIGRATIONS = (
+    Migration(1, "Create base tables", BASE_TABLES),
+    Migration(2, "Store record date and time separately, like RecordCreate", (
+        "ALTER TABLE records ADD COLUMN IF NOT EXISTS record_date TIMESTAMP;",
+        "UPDATE records SET record_date = record_time WHERE record_date IS NULL;",
+        "ALTER TABLE records ALTER COLUMN record_date SET NOT NULL;",
+        "ALTER TABLE records ALTER COLUMN record_time TYPE TIME USING record_time::time;",
+        # Exercises are linked through workout_exercises, create_workout_db never sets this
+        "ALTER TABLE workouts ALTER COLUMN exercise_id DROP NOT NULL;",
+    )),
+    Migration(3, "Index foreign keys and hot lookup columns", (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS records_user_id_idx ON records (user_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS workout_exercises_workout_id_exercise_id_idx ON workout_exercises (workout_id, exercise_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS workout_exercises_exercise_id_idx ON workout_exercises (exercise_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS repmax_user_id_exercise_id_idx ON repmax (user_id, exercise_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS repmax_exercise_id_idx ON repmax (exercise_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS exercises_category_id_idx ON exercises (category_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS workouts_record_id_idx ON workouts (record_id);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS workouts_exercise_id_idx ON workouts (exercise_id);",
+    ), transactional=False),
+    Migration(4, "Keep each user's best repmax per exercise in personal_bests", PERSONAL_BESTS),
+    Migration(5, "Index personal_bests for the exercise leaderboards", (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS personal_bests_exercise_id_weight_idx ON personal_bests (exercise_id, weight DESC);",
+    ), transactional=False),
+    Migration(6, "Count writes per table in table_versions for ETags", TABLE_VERSIONS),
+    Migration(7, "Store password hashes instead of plain passwords", (
+        # Existing plain passwords are hashed by POST /login on the user's next login
+        "ALTER TABLE users ALTER COLUMN password TYPE TEXT;",
+    )),
+    Migration(8, "Remember which queued records were written in ingest_receipts", (
+        """
+        CREATE TABLE IF NOT EXISTS ingest_receipts (
+            receipt_id UUID PRIMARY KEY,
+            record_id INT NOT NULL,
+            persisted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS ingest_receipts_persisted_at_idx ON ingest_receipts (persisted_at);",
+    )),
+    Migration(9, "Shard the table_versions counters so writers don't queue on one row", SHARDED_TABLE_VERSIONS),
+)
+
+
+def _ensure_version_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        """
+    )
+
+
+def _applied_versions(cursor) -> dict:
+    cursor.execute("SELECT version, applied_at FROM schema_version;")
+    return dict(cursor.fetchall())
+
+
+def _drop_invalid_indexes(cursor, statements):
+    """
+    A CREATE INDEX CONCURRENTLY that failed half-way leaves an INVALID index behind,
+    which IF NOT EXISTS would then silently accept. Drop those so they get rebuilt.
+    """
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid;
+        """
+    )
+    for (index_name,) in cursor.fetchall():
+        if any(f" {index_name} " in statement for statement in statements):
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+
+
+def migrate(con, target: int | None = None) -> list:
+    """
+    Applies every pending migration up to target (all of them by default)
+
+    Returns the migrations that were applied
+    """
+    applied = []
+    con.autocommit = True
+    try:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+            try:
+                _ensure_version_table(cursor)
+                done = _applied_versions(cursor)
+
+                for migration in MIGRATIONS:
+                    if migration.version in done:
+                        continue
+                    if target is not None and migration.version > target:
+                        break
+
+                    if migration.transactional:
+                        con.autocommit = False
+                        with con:
+                            for statement in migration.statements:
+                                cursor.execute(statement)
+                            cursor.execute(
+                                "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                                (migration.version, migration.description),
+                            )
+                        con.autocommit = True
+                    else:
+                        _drop_invalid_indexes(cursor, migration.statements)
+                        for statement in migration.statements:
+                            cursor.execute(statement)
+                        cursor.execute(
+                            "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                            (migration.version, migration.description),
+                        )
+                    applied.append(migration)
+            finally:
+                con.autocommit = True
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+    finally:
+        con.autocommit = False
+    return applied
+
+
+def migration_status(con) -> list:
+    """
+    Lists (version, description, applied_at) for every known migration,
+    applied_at is None for pending ones
+    """
+    with con:
+        with con.cursor() as cursor:
+            _ensure_version_table(cursor)
+            done = _applied_versions(cursor)
+    return [(m.version, m.description, done.get(m.version)) for m in MIGRATIONS]
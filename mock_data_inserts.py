@@ -1,90 +1,318 @@
-import os
+import argparse
+import io
+import itertools
+import multiprocessing
+import random
+import time
+from datetime import date, datetime, timedelta
+
 import psycopg2
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
+from db_setup import DATABASE_HOST, DATABASE_NAME, DATABASE_PORT, DATABASE_USER, PASSWORD
+from migrations import migrate
+
+# Generates a synthetic dataset of any size for development and performance work.
+#
+#     python mock_data_inserts.py --users 1000000 --records-per-user 20 --workers 8 --truncate
+#
+# Users are split into fixed size chunks and every chunk is generated from its own
+# random stream (seed, table, chunk), so the data only depends on --seed and the
+# size options, never on --workers. Chunks are streamed into Postgres with COPY
+# by a pool of worker processes.
+#
+# Distributions are skewed like real usage: a few users log most of the records
+# (Pareto distributed activity) and a few exercises get most of the lifts (Zipf).
 
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-PASSWORD = os.getenv("PASSWORD")
+CHUNK_USERS = 5000
+COPY_BUFFER_ROWS = 50000
+CATEGORIES = ('Strength', 'Cardio', 'Flexibility', 'Endurance', 'Mobility', 'Olympic')
+MUSCLES = ('Chest', 'Back', 'Legs', 'Shoulders', 'Biceps', 'Triceps', 'Core', 'Glutes', 'Calves', 'Full Body')
+FIRST_DAY = date(2024, 1, 1)
+TABLES = ('workout_exercises', 'workouts', 'repmax', 'records', 'exercises', 'categories', 'users')
+# Triggers switched off while the workers load, personal_bests is rebuilt in one statement afterwards
+DEFERRED_TRIGGERS = (
+    ('repmax', 'repmax_personal_best'),
+)
 
+_connection = None
 
-def get_connection():
+
+def get_connection(database: str | None = None):
     """
     Establishes a database connection.
     """
     return psycopg2.connect(
-        dbname=DATABASE_NAME,
-        user="postgres",
+        dbname=database or DATABASE_NAME,
+        user=DATABASE_USER,
         password=PASSWORD,
-        host="localhost",
-        port="5432",
+        host=DATABASE_HOST,
+        port=DATABASE_PORT,
     )
 
 
-def insert_data():
+def _rng(seed: int, table: str, chunk: int) -> random.Random:
+    return random.Random(f"{seed}:{table}:{chunk}")
+
+
+def _activity(rng: random.Random, mean: float, alpha: float) -> int:
+    """
+    How many rows one user gets, Pareto distributed around mean
+    """
+    if mean <= 0:
+        return 0
+    if alpha <= 1:
+        return round(mean)
+    pareto_mean = alpha / (alpha - 1)
+    return max(1, min(round(mean * rng.paretovariate(alpha) / pareto_mean), round(mean * 50)))
+
+
+def _zipf_weights(count: int, skew: float) -> list:
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def plan_records(config: dict) -> list:
+    """
+    Decides up front how many records every user gets, the workers need
+    these counts to hand out record ids without talking to each other
     """
-    Inserts data into the tables.
-    """
-    connection = get_connection()
-
-    inserts = [
-        # Users
-        """
-        INSERT INTO users (password, name, weight, user_record_id, height) VALUES
-        ('password123', 'john_doe', 75, NULL, 180),
-        ('securePass456', 'jane_smith', 68, NULL, 165),
-        ('gymLover789', 'mike_tyson', 95, NULL, 178);
-
-        """,
-
-        # Categories
-        """INSERT INTO categories (name) VALUES
-        ('Strength'),
-        ('Cardio'),
-        ('Flexibility'),
-        ('Endurance');
-        """,
-
-        # Exercises
-
-        """
-        INSERT INTO exercises (exercise_name, exercise_weight, repmax_id, primary_muscle, secondary_muscle, category_id) VALUES
-        ('Bench Press', 80, NULL, 'Chest', 'Triceps', 1),
-        ('Squats', 100, NULL, 'Legs', 'Glutes', 1),
-        ('Deadlift', 120, NULL, 'Back', 'Legs', 1),
-        ('Running', 0, NULL, 'Legs', NULL, 2),
-        ('Yoga Stretch', 0, NULL, 'Full Body', NULL, 3);
-        """,
-
-        # Records
-        """
-        INSERT INTO records (workout_id, user_id, record_time) VALUES
-        (1, 1, '2025-01-01 10:00:00'),
-        (2, 2, '2025-01-02 11:00:00'),
-        (3, 3, '2025-01-03 12:00:00');
-        """,
-        # Repmax
-        """INSERT INTO repmax (exercise_id, user_id, weight) VALUES
-        (1, 1, 80),
-        (2, 2, 100),
-        (3, 3, 120);
-        """,
-
-        # Workouts
-        """INSERT INTO workouts (workout_name, timecap, record_id, for_kids) VALUES
-        ('Full Body Workout', 30, 1, FALSE),
-        ('Leg Day', 45, 2, FALSE),
-        ('Back and Core', 50, 3, TRUE);
-        """,
-    ]
-
-    with connection:
-        with connection.cursor() as cursor:
-            for sql in inserts:
-                cursor.execute(sql)
+    counts = []
+    for chunk_start in range(1, config['users'] + 1, CHUNK_USERS):
+        rng = _rng(config['seed'], 'record_counts', chunk_start)
+        chunk_end = min(chunk_start + CHUNK_USERS, config['users'] + 1)
+        counts.extend(_activity(rng, config['records_per_user'], config['activity_alpha'])
+                      for _ in range(chunk_start, chunk_end))
+    return counts
+
+
+def _copy(cursor, table: str, columns: tuple, rows):
+    """
+    Streams rows into table with COPY, a buffer at a time
+    """
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    buffer = io.StringIO()
+    buffered = 0
+    total = 0
+    for row in rows:
+        buffer.write('\t'.join(r'\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+        buffered += 1
+        if buffered == COPY_BUFFER_ROWS:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            total += buffered
+            buffer = io.StringIO()
+            buffered = 0
+    if buffered:
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        total += buffered
+    return total
+
+
+def _init_worker(database: str):
+    global _connection
+    _connection = get_connection(database)
+
+
+def _generate_chunk(task: tuple) -> dict:
+    """
+    Generates and loads every user-owned row of users chunk_start..chunk_end - 1
+    """
+    config, chunk_start, chunk_end, first_record_id, record_counts, exercise_weights = task
+    seed = config['seed']
+    exercises = config['exercises']
+    exercise_ids = range(1, exercises + 1)
+    workouts_per_user = config['workouts_per_user']
+    days = config['days']
+    loaded = {}
+
+    with _connection:
+        with _connection.cursor() as cursor:
+            rng = _rng(seed, 'users', chunk_start)
+            loaded['users'] = _copy(cursor, 'users', ('user_id', 'password', 'name', 'weight', 'height'), (
+                (user_id, f"pw_{user_id}", f"user_{user_id}",
+                 max(40, min(180, round(rng.gauss(80, 15)))), max(140, min(215, round(rng.gauss(175, 10)))))
+                for user_id in range(chunk_start, chunk_end)))
+
+            def records():
+                rng = _rng(seed, 'records', chunk_start)
+                record_id = first_record_id
+                for user_id, count in zip(range(chunk_start, chunk_end), record_counts):
+                    first_workout_id = (user_id - 1) * workouts_per_user + 1
+                    for _ in range(count):
+                        day = FIRST_DAY + timedelta(days=rng.randrange(days))
+                        started = datetime(day.year, day.month, day.day, rng.randint(5, 21), rng.randrange(60))
+                        yield (record_id, first_workout_id if workouts_per_user else 0, user_id, started.isoformat(),
+                               f"{rng.randint(0, 1):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}")
+                        record_id += 1
+
+            loaded['records'] = _copy(cursor, 'records',
+                                      ('record_id', 'workout_id', 'user_id', 'record_date', 'record_time'), records())
 
+            def repmaxs():
+                rng = _rng(seed, 'repmax', chunk_start)
+                for user_id in range(chunk_start, chunk_end):
+                    lifted = set(rng.choices(exercise_ids, cum_weights=exercise_weights,
+                                             k=config['repmax_exercises_per_user']))
+                    for exercise_id in lifted:
+                        # A history of slowly improving maxes, the last one is the current best
+                        weight = rng.randint(20, 150)
+                        for _ in range(_activity(rng, config['repmax_depth'], config['activity_alpha'])):
+                            yield exercise_id, user_id, weight
+                            weight += rng.choice((0, 2, 2, 5, 5, 10))
+
+            loaded['repmax'] = _copy(cursor, 'repmax', ('exercise_id', 'user_id', 'weight'), repmaxs())
+
+            rng = _rng(seed, 'workouts', chunk_start)
+            workouts = []
+            workout_exercises = []
+            record_id = first_record_id
+            for user_id, count in zip(range(chunk_start, chunk_end), record_counts):
+                if not count:
+                    continue
+                for i in range(workouts_per_user):
+                    workout_id = (user_id - 1) * workouts_per_user + i + 1
+                    # Every workout points at one of its owner's records
+                    workouts.append((workout_id, f"Workout {i + 1} of user {user_id}", rng.choice((20, 30, 45, 60, 90)),
+                                     record_id + rng.randrange(count), rng.random() < 0.05))
+                    for exercise_id in rng.choices(exercise_ids, cum_weights=exercise_weights,
+                                                   k=config['exercises_per_workout']):
+                        workout_exercises.append((workout_id, exercise_id, rng.randint(1, 6), rng.randint(1, 15),
+                                                  rng.choice((30, 60, 90, 120, 180))))
+                record_id += count
+
+            loaded['workouts'] = _copy(cursor, 'workouts',
+                                       ('workout_id', 'workout_name', 'timecap', 'record_id', 'for_kids'), workouts)
+            loaded['workout_exercises'] = _copy(cursor, 'workout_exercises',
+                                                ('workout_id', 'exercise_id', 'sets', 'reps', 'rest_time'),
+                                                workout_exercises)
+    return loaded
+
+
+def _load_catalog(cursor, config: dict):
+    """
+    Loads the categories and exercises every user-owned row refers to
+    """
+    rng = _rng(config['seed'], 'exercises', 0)
+    _copy(cursor, 'categories', ('category_id', 'name'), enumerate(CATEGORIES, start=1))
+    _copy(cursor, 'exercises', ('exercise_id', 'exercise_name', 'exercise_weight', 'primary_muscle',
+                                'secondary_muscle', 'category_id', 'base_exercise'), (
+        (exercise_id, f"Exercise {exercise_id}", rng.choice((0, 0, 10, 20, 40, 60, 80, 100)), rng.choice(MUSCLES),
+         rng.choice(MUSCLES + (None,)), rng.randint(1, len(CATEGORIES)), 't' if exercise_id <= 20 else 'f')
+        for exercise_id in range(1, config['exercises'] + 1)))
+
+
+def _set_triggers(con, enabled: bool):
+    with con:
+        with con.cursor() as cursor:
+            for table, trigger in DEFERRED_TRIGGERS:
+                cursor.execute(f"ALTER TABLE {table} {'ENABLE' if enabled else 'DISABLE'} TRIGGER {trigger};")
+
+
+def generate(config: dict, workers: int, truncate: bool = False) -> dict:
+    """
+    Loads a synthetic dataset described by config into config['database']
+
+    Returns the number of rows loaded per table
+    """
+    started = time.monotonic()
+    con = get_connection(config['database'])
+    try:
+        migrate(con)
+        with con:
+            with con.cursor() as cursor:
+                if truncate:
+                    cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE;")
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM exercises);")
+                if cursor.fetchone()[0]:
+                    raise SystemExit("The database already has data, pass --truncate to replace it.")
+                _load_catalog(cursor, config)
+
+        record_counts = plan_records(config)
+        exercise_weights = _zipf_weights(config['exercises'], config['exercise_skew'])
+        tasks = []
+        first_record_id = 1
+        for chunk_start in range(1, config['users'] + 1, CHUNK_USERS):
+            chunk_end = min(chunk_start + CHUNK_USERS, config['users'] + 1)
+            counts = record_counts[chunk_start - 1:chunk_end - 1]
+            tasks.append((config, chunk_start, chunk_end, first_record_id, counts, exercise_weights))
+            first_record_id += sum(counts)
+
+        totals = {'categories': len(CATEGORIES), 'exercises': config['exercises']}
+        _set_triggers(con, enabled=False)
+        try:
+            with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config['database'],)) as workers_pool:
+                for done, loaded in enumerate(workers_pool.imap_unordered(_generate_chunk, tasks), start=1):
+                    for table, rows in loaded.items():
+                        totals[table] = totals.get(table, 0) + rows
+                    print(f"\r{done}/{len(tasks)} chunks, {sum(totals.values()):,} rows "
+                          f"in {time.monotonic() - started:.0f}s", end="", flush=True)
+            print()
+        finally:
+            _set_triggers(con, enabled=True)
+
+        with con:
+            with con.cursor() as cursor:
+                # What the disabled triggers would have done, in one statement each
+                cursor.execute("TRUNCATE personal_bests;")
+                cursor.execute(
+                    """
+                    INSERT INTO personal_bests (user_id, exercise_id, weight, repmax_id)
+                    SELECT DISTINCT ON (user_id, exercise_id) user_id, exercise_id, weight, repmax_id
+                    FROM repmax
+                    ORDER BY user_id, exercise_id, weight DESC, repmax_id;
+                    """
+                )
+                # Explicit ids were copied in, move the sequences past them
+                for table, column in (('users', 'user_id'), ('categories', 'category_id'),
+                                      ('exercises', 'exercise_id'), ('records', 'record_id'),
+                                      ('workouts', 'workout_id')):
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                                   f"GREATEST((SELECT max({column}) FROM {table}), 1));")
+        con.autocommit = True
+        with con.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+    finally:
+        con.close()
+    return totals
+
+
+def insert_data():
+    """
+    Inserts a small dataset, enough to click around the API in development.
+    """
+    generate({**DEFAULTS, 'database': DATABASE_NAME, 'users': 50, 'exercises': 30}, workers=1, truncate=True)
     print("Data inserted successfully.")
 
 
+DEFAULTS = {
+    'users': 10000,
+    'exercises': 200,
+    'records_per_user': 30,
+    'repmax_exercises_per_user': 8,
+    'repmax_depth': 5,
+    'workouts_per_user': 3,
+    'exercises_per_workout': 6,
+    'exercise_skew': 1.1,
+    'activity_alpha': 1.5,
+    'days': 365,
+    'seed': 1,
+}
+
+
 if __name__ == "__main__":
-    insert_data()
+    parser = argparse.ArgumentParser(description="Load a synthetic Trainify dataset with parallel COPY")
+    parser.add_argument("--database", default=DATABASE_NAME, help="database to load into (default from .env)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--truncate", action="store_true", help="empty every table first")
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    parser.epilog = ("--exercise-skew is the Zipf exponent of exercise popularity (0 is uniform), "
+                     "--activity-alpha the Pareto shape of per-user activity (<= 1 gives every user the mean)")
+    args = vars(parser.parse_args())
+    workers, truncate = args.pop('workers'), args.pop('truncate')
+
+    begin = time.monotonic()
+    rows = generate(args, workers, truncate)
+    print(", ".join(f"{table}={count:,}" for table, count in rows.items()))
+    print(f"Loaded {sum(rows.values()):,} rows in {time.monotonic() - begin:.1f}s")
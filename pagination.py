@@ -0,0 +1,53 @@
+import base64
+import binascii
+import os
+
+from fastapi import HTTPException, status
+
+# Keyset pagination helpers shared by the list endpoints.
+# A page is fetched with "WHERE <primary key> > after ORDER BY <primary key> LIMIT limit + 1",
+# the extra row only tells us whether there is a next page.
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# The primary keys are SERIAL, a cursor outside their range would fail in Postgres
+MIN_CURSOR_ID = -2**31
+MAX_CURSOR_ID = 2**31 - 1
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Turns the last primary key of a page into an opaque token
+    """
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(after: str | None) -> int:
+    """
+    Turns an opaque token back into the primary key to continue after.
+    No token means start from the beginning.
+
+    Raises exception if the token is malformed or its id is out of range
+    """
+    if not after:
+        return 0
+    try:
+        padded = after + "=" * (-len(after) % 4)
+        prefix, _, value = base64.urlsafe_b64decode(padded).decode().partition(":")
+        last_id = int(value)
+        if prefix != "id" or not MIN_CURSOR_ID <= last_id <= MAX_CURSOR_ID:
+            raise ValueError(after)
+        return last_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid pagination token")
+
+
+def make_page(rows: list, limit: int, key: str) -> dict:
+    """
+    Builds the response for one page from up to limit + 1 rows
+    """
+    items = rows[:limit]
+    next_after = encode_cursor(items[-1][key]) if len(rows) > limit else None
+    return {"items": items, "next_after": next_after}
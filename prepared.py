@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+
+import psycopg2.errors
+import psycopg2.extensions
+
+# Named prepared statements for the hot queries in db.py.
+# A query opts in by being registered once at import time:
+#
+#     FETCH_USER = register('fetch_user', "SELECT user_id AS id, name FROM users WHERE user_id = %s")
+#
+# and is then run with execute(cursor, FETCH_USER, params) instead of cursor.execute.
+# Each pooled connection PREPAREs a statement the first time it runs it and
+# EXECUTEs it from then on, so Postgres parses it once per connection and can
+# switch to a cached generic plan. Prepared statements survive rollbacks and
+# live as long as the connection, PreparedConnection remembers which exist.
+# Statements list their columns, a SELECT * would stop working once a column
+# is added ("cached plan must not change result type"). If a migration changes
+# a result anyway, the connection drops all its statements and prepares them again.
+# The async driver (psycopg 3) already prepares repeated queries by itself.
+
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "true").lower() == "true"
+# Samples the planning time of each statement once per connection with an extra
+# EXPLAIN, for the estimate in /admin/prepared
+PREPARED_PLAN_STATS = os.getenv("PREPARED_PLAN_STATS", "false").lower() == "true"
+
+# Postgres plans the first five executions of a prepared statement individually
+# before it considers the generic plan, those don't save any planning
+CUSTOM_PLAN_EXECUTIONS = 5
+
+STATEMENTS = {}
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s")
+_lock = threading.Lock()
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that tracks which statements it has prepared
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        # Set when the server side statements must be deallocated before preparing again
+        self.stale = False
+
+
+class Statement:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        # %(name)s placeholders become $n by first appearance, %s ones by position
+        self.param_names = []
+        positional = 0
+
+        def to_dollar(match):
+            nonlocal positional
+            if match.group(1):
+                if match.group(1) not in self.param_names:
+                    self.param_names.append(match.group(1))
+                return f"${self.param_names.index(match.group(1)) + 1}"
+            positional += 1
+            return f"${positional}"
+
+        body = _PLACEHOLDER.sub(to_dollar, sql).strip().rstrip(";")
+        if self.param_names and positional:
+            # psycopg2 refuses such a query too, and the $n of both kinds would collide
+            raise ValueError(f"Prepared statement {name} mixes %s and %(name)s placeholders")
+        param_count = len(self.param_names) or positional
+        self.prepare_sql = f"PREPARE {name} AS {body};"
+        self.execute_sql = f"EXECUTE {name}({', '.join(['%s'] * param_count)});" if param_count else f"EXECUTE {name};"
+
+        self.executions = 0
+        self.prepares = 0
+        self.planning_ms = 0.0
+        self.planning_samples = 0
+
+    def args(self, params) -> tuple:
+        if self.param_names:
+            return tuple(params[name] for name in self.param_names)
+        return tuple(params)
+
+
+def register(name: str, sql: str) -> Statement:
+    """
+    Registers sql, written like any other psycopg2 query, as a prepared statement
+    """
+    if name in STATEMENTS:
+        raise ValueError(f"Prepared statement {name} is already registered")
+    statement = Statement(name, sql)
+    STATEMENTS[name] = statement
+    return statement
+
+
+def _planning_time(cursor, statement: Statement, params) -> float:
+    """
+    Asks Postgres how long planning the unprepared query takes, without running it
+    """
+    cursor.execute(f"EXPLAIN (SUMMARY ON, FORMAT JSON) {statement.sql}", params, name=statement.name)
+    row = cursor.fetchone()
+    plan = row["QUERY PLAN"] if isinstance(row, dict) else row[0]
+    return plan[0]["Planning Time"]
+
+
+def evict(con):
+    """
+    Forgets every statement prepared on con, they are deallocated before the next PREPARE
+    """
+    con.prepared.clear()
+    con.stale = True
+
+
+def prepare(cursor, statement: Statement, timed: bool = True):
+    """
+    Prepares statement on the cursor's connection, timed=False for a plain psycopg2 cursor
+    """
+    con = cursor.connection
+    named = {"name": statement.name} if timed else {}
+    if con.stale:
+        cursor.execute("DEALLOCATE ALL;", **named)
+        con.stale = False
+    cursor.execute(statement.prepare_sql, **named)
+    con.prepared.add(statement.name)
+
+
+def execute(cursor, statement: Statement, params=()):
+    """
+    Runs statement on cursor, preparing it on this connection first if needed
+
+    cursor has to be one of the timed cursors from metrics.py, which label the query with the statement name
+    """
+    con = cursor.connection
+    if not PREPARED_STATEMENTS or not isinstance(con, PreparedConnection):
+        cursor.execute(statement.sql, params, name=statement.name)
+        return
+
+    if statement.name not in con.prepared:
+        # One planning sample per connection and statement, so the savings can be estimated
+        planning_ms = _planning_time(cursor, statement, params) if PREPARED_PLAN_STATS else None
+        prepare(cursor, statement)
+        with _lock:
+            statement.prepares += 1
+            if planning_ms is not None:
+                statement.planning_ms += planning_ms
+                statement.planning_samples += 1
+
+    try:
+        cursor.execute(statement.execute_sql, statement.args(params), name=statement.name)
+    except psycopg2.errors.FeatureNotSupported:
+        # The tables changed under the cached plans, this transaction is lost
+        # but the next one on this connection prepares everything again
+        evict(con)
+        raise
+    with _lock:
+        statement.executions += 1
+
+
+def prepared_stats() -> dict:
+    """
+    Returns per statement counters and an estimate of the planning time saved
+    """
+    with _lock:
+        stats = {}
+        for name, statement in STATEMENTS.items():
+            avg_planning_ms = statement.planning_ms / statement.planning_samples if statement.planning_samples else 0.0
+            reused = max(0, statement.executions - statement.prepares * CUSTOM_PLAN_EXECUTIONS)
+            stats[name] = {
+                "executions": statement.executions,
+                "prepares": statement.prepares,
+                "avg_planning_ms": round(avg_planning_ms, 3),
+                "estimated_saved_ms": round(reused * avg_planning_ms, 3),
+            }
+        return {"enabled": PREPARED_STATEMENTS, "plan_stats": PREPARED_PLAN_STATS, "statements": stats}
@@ -0,0 +1,369 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg
+import psycopg2
+import psycopg2.extensions
+from fastapi import Request
+from psycopg_pool import PoolTimeout
+from starlette.requests import cookie_parser
+
+from custom_exceptions import PoolTimeoutError
+from db_pool import ConnectionPool
+from db_setup import (DATABASE_PORT, DB_MODE, DB_POOL_CHECK_IDLE, DB_POOL_MAX_IDLE, DB_POOL_MAX_SIZE,
+                      DB_POOL_TIMEOUT, async_pool, connect, make_async_pool, pool)
+
+# Read replicas.
+# GET endpoints take their connection from get_read_connection, which spreads
+# them round-robin over the healthy replicas in DATABASE_REPLICAS, every other
+# endpoint keeps writing to the primary through get_connection.
+# A background thread checks every replica each REPLICA_HEALTH_INTERVAL seconds
+# and takes it out of rotation while it is unreachable or more than
+# REPLICA_MAX_LAG seconds behind. Without a healthy replica reads go to the primary.
+# After a successful write the client gets a cookie that pins its reads to
+# the primary for READ_YOUR_WRITES_SECONDS, so it always sees its own changes.
+# One replica is chosen per request and kept in the scope, so the table
+# versions ETagMiddleware reads and the body the endpoint builds come from the same server.
+# A replica connection that breaks while a request uses it is discarded, the
+# replica leaves rotation right away and ReplicaFallbackMiddleware runs the
+# request once more on the primary, as long as nothing was sent yet.
+
+# Comma separated host[:port] list, the port defaults to DATABASE_PORT
+DATABASE_REPLICAS = os.getenv("DATABASE_REPLICAS", "")
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# How far behind the primary a replica in rotation can be, the caches use it
+# to avoid storing rows that a recent write already replaced (see cache.staleness)
+MAX_STALENESS = REPLICA_MAX_LAG + REPLICA_HEALTH_INTERVAL
+
+PIN_COOKIE = "trainify_read_primary"
+
+# Seconds the replica is behind, 0 when it has replayed everything it received
+LAG_QUERY = """
+    SELECT CASE
+               WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END;
+"""
+
+logger = logging.getLogger("trainify.replicas")
+
+
+class Replica:
+    def __init__(self, host: str, port: str):
+        self.name = f"{host}:{port}"
+        self.host = host
+        self.port = port
+        # Replica pools start empty and grow on demand, so a replica that is down
+        # at startup doesn't keep the app from starting
+        self.pool = ConnectionPool(self.connect, min_size=0, max_size=DB_POOL_MAX_SIZE,
+                                   timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE,
+                                   check_idle=DB_POOL_CHECK_IDLE)
+        self.async_pool = (make_async_pool(host, port, min_size=0, configure=_mark_async_replica,
+                                           connect_timeout=REPLICA_CONNECT_TIMEOUT)
+                           if DB_MODE == "async" else None)
+        self.healthy = False
+        self.lag = None
+        self.last_error = None
+        self.checked_at = None
+
+    def connect(self):
+        con = connect(self.host, self.port, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        con.max_staleness = MAX_STALENESS
+        return con
+
+    def check(self):
+        """
+        Connects with a fresh connection and measures the replication lag
+        """
+        try:
+            con = self.connect()
+            try:
+                con.cursor_factory = psycopg2.extensions.cursor
+                with con.cursor() as cursor:
+                    cursor.execute(LAG_QUERY)
+                    lag = float(cursor.fetchone()[0])
+            finally:
+                con.close()
+        except psycopg2.Error as exc:
+            self.mark_down(exc)
+            return
+        finally:
+            self.checked_at = time.time()
+
+        self.lag = lag
+        if lag > REPLICA_MAX_LAG:
+            self.mark_down(f"{lag:.1f}s behind the primary")
+        else:
+            if not self.healthy:
+                logger.info("Replica %s is back in rotation", self.name, extra={"replica": self.name})
+            self.healthy = True
+            self.last_error = None
+
+    def mark_down(self, reason):
+        if self.healthy:
+            logger.warning("Replica %s taken out of rotation: %s", self.name, reason, extra={"replica": self.name})
+        self.healthy = False
+        self.last_error = str(reason).strip()
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+            "pool": self.async_pool.get_stats() if self.async_pool is not None else self.pool.stats(),
+        }
+
+
+async def _mark_async_replica(con):
+    con.max_staleness = MAX_STALENESS
+
+
+def parse_replicas(value: str) -> list:
+    replicas = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, port = item.rpartition(":")
+        if not port.isdigit():
+            host, port = item, DATABASE_PORT
+        replicas.append(Replica(host, port))
+    return replicas
+
+
+class ReplicaRouter:
+    def __init__(self, replicas: list):
+        self.replicas = replicas
+        self._next = itertools.count()
+        self._checker = None
+        self._stop = threading.Event()
+
+    def open(self):
+        """
+        Checks every replica once and starts the health check thread
+        """
+        if not self.replicas:
+            return
+        for replica in self.replicas:
+            # In async mode reads go through replica.async_pool, see open_async
+            if replica.async_pool is None:
+                replica.pool.open()
+            replica.check()
+        self._stop.clear()
+        self._checker = threading.Thread(target=self._check_loop, name="replica-health", daemon=True)
+        self._checker.start()
+
+    def close(self):
+        self._stop.set()
+        if self._checker is not None:
+            self._checker.join(timeout=REPLICA_HEALTH_INTERVAL + REPLICA_CONNECT_TIMEOUT)
+            self._checker = None
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def _check_loop(self):
+        while not self._stop.wait(REPLICA_HEALTH_INTERVAL):
+            for replica in self.replicas:
+                replica.check()
+
+    def choose(self, scope) -> Replica | None:
+        """
+        Returns the replica serving the reads of this request, None for the primary
+        """
+        if "read_replica" in scope:
+            return scope["read_replica"]
+        replica = None
+        if self.replicas and not pinned_to_primary(scope):
+            start = next(self._next)
+            for offset in range(len(self.replicas)):
+                candidate = self.replicas[(start + offset) % len(self.replicas)]
+                if candidate.healthy:
+                    replica = candidate
+                    break
+        scope["read_replica"] = replica
+        return replica
+
+    def fall_back(self, scope, replica: Replica, exc: Exception):
+        """
+        Sends the request to the primary after a failed checkout
+
+        A replica that can't be reached is taken out of rotation,
+        one whose pool is merely busy stays in
+        """
+        if not isinstance(exc, (PoolTimeoutError, PoolTimeout)):
+            replica.mark_down(exc)
+        scope["read_replica"] = None
+
+    def lost_connection(self, scope, replica: Replica, exc: Exception):
+        """
+        Takes replica out of rotation after its connection broke mid-request
+        and flags the request for ReplicaFallbackMiddleware to retry
+        """
+        replica.mark_down(exc)
+        scope["read_replica"] = None
+        scope["replica_failed"] = True
+
+    @contextmanager
+    def connection(self, scope):
+        """
+        Checks out a read connection for the request, from the primary if no replica can serve it
+        """
+        replica = self.choose(scope)
+        if replica is not None:
+            try:
+                con = replica.pool.getconn()
+            except (PoolTimeoutError, psycopg2.OperationalError) as exc:
+                self.fall_back(scope, replica, exc)
+            else:
+                discard = False
+                try:
+                    yield con
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as exc:
+                    # Only a connection psycopg2 closed is lost, not a cancelled or failed statement
+                    if con.closed:
+                        discard = True
+                        self.lost_connection(scope, replica, exc)
+                    raise
+                finally:
+                    replica.pool.putconn(con, discard=discard)
+                return
+        with pool.connection() as con:
+            yield con
+
+    @asynccontextmanager
+    async def async_connection(self, scope):
+        replica = self.choose(scope)
+        if replica is not None:
+            try:
+                con = await replica.async_pool.getconn()
+            except (PoolTimeout, psycopg.OperationalError) as exc:
+                self.fall_back(scope, replica, exc)
+            else:
+                try:
+                    yield con
+                except (psycopg.OperationalError, psycopg.InterfaceError) as exc:
+                    # The pool throws away the broken connection when it gets it back
+                    if con.broken or con.closed:
+                        self.lost_connection(scope, replica, exc)
+                    raise
+                finally:
+                    await replica.async_pool.putconn(con)
+                return
+        async with async_pool.connection() as con:
+            yield con
+
+    async def open_async(self):
+        for replica in self.replicas:
+            await replica.async_pool.open()
+
+    async def close_async(self):
+        for replica in self.replicas:
+            await replica.async_pool.close()
+
+    def stats(self) -> dict:
+        return {
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+            "replicas": {replica.name: replica.stats() for replica in self.replicas},
+        }
+
+
+def pinned_to_primary(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            return PIN_COOKIE in cookie_parser(value.decode("latin-1"))
+    return False
+
+
+replica_router = ReplicaRouter(parse_replicas(DATABASE_REPLICAS))
+
+
+def get_read_connection(request: Request):
+    """
+    FastAPI dependency for the GET endpoints, a replica connection when one is available
+    """
+    with replica_router.connection(request.scope) as con:
+        yield con
+
+
+async def get_async_read_connection(request: Request):
+    """
+    Async counterpart of get_read_connection, used by the GET endpoints in async_routes.py
+    """
+    async with replica_router.async_connection(request.scope) as con:
+        yield con
+
+
+class ReplicaFallbackMiddleware:
+    """
+    Pure ASGI middleware that retries a read on the primary once if its replica connection broke
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or not replica_router.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        original = dict(scope)
+        received = []
+        started = False
+
+        async def receive_wrapper():
+            message = await receive()
+            received.append(message)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except (psycopg2.Error, psycopg.Error):
+            if started or not scope.get("replica_failed"):
+                raise
+        else:
+            return
+
+        # The retry sees the request as it came in, only pinned to the primary
+        logger.warning("Retrying %s on the primary after its replica connection broke", scope["path"])
+        replayed = iter(received)
+
+        async def replay():
+            return next(replayed, None) or await receive()
+
+        await self.app({**original, "read_replica": None}, replay, send)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pure ASGI middleware that pins a client to the primary for a while after it wrote
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS")
+                or not replica_router.replicas or READ_YOUR_WRITES_SECONDS <= 0):
+            await self.app(scope, receive, send)
+            return
+
+        cookie = (f"{PIN_COOKIE}=1; Max-Age={READ_YOUR_WRITES_SECONDS}; Path=/; HttpOnly; SameSite=Lax"
+                  .encode("latin-1"))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie)]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
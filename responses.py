@@ -0,0 +1,40 @@
+import json
+import os
+
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from starlette.responses import Response
+
+# Fast path for the list endpoints.
+# Their queries already select columns named like the response schemas,
+# so the rows can be encoded with orjson as they come out of the cursor
+# instead of being validated into models one by one first.
+# Set STRICT_RESPONSES=true in development to validate every response again.
+
+STRICT_RESPONSES = os.getenv("STRICT_RESPONSES", "false").lower() == "true"
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+
+def json_response(content, adapter: TypeAdapter) -> Response:
+    """
+    Serializes trusted database rows, validated against adapter in strict mode
+    """
+    if STRICT_RESPONSES:
+        return Response(adapter.dump_json(adapter.validate_python(content)), media_type="application/json")
+    return ORJSONResponse(content)
+
+
+def _json_default(value):
+    """
+    Encodes the datetime/date/time values the database drivers return
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_chunk(rows) -> str:
+    """
+    Encodes one batch of an export as newline delimited JSON
+    """
+    return ''.join(json.dumps(row, default=_json_default) + '\n' for row in rows)
@@ -0,0 +1,20 @@
+from starlette.routing import Match
+
+# Middlewares that need the route before the router has run (admission limits,
+# ETags) share one lookup per request. The router only puts the route into the
+# scope once it dispatches, so the first one to ask walks the routes and stores
+# the template in scope["route_path"], where the metrics and logs find it too.
+
+
+def route_path(scope) -> str | None:
+    """
+    Template of the route the router will pick for this request, None if none matches
+    """
+    if "route_path" not in scope:
+        scope["route_path"] = None
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                scope["route_path"] = getattr(route, "path", None)
+                break
+    return scope["route_path"]
@@ -1,9 +1,34 @@
 # Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
 
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from typing import Any, Generic, List, Optional, TypeVar
 from datetime import datetime,time
 
+T = TypeVar("T")
+
+
+#                                                             Paging
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_after: Optional[str] = None
+
+
+#                                                               Bulk
+
+
+class BulkItemError(BaseModel):
+    index: int
+    errors: List[Any]
+
+
+class BulkCreateResponse(BaseModel):
+    # Aligned with the request body, None for items that were rejected
+    ids: List[Optional[int]]
+    errors: List[BulkItemError]
+
+
 #                                                               User
 
 
@@ -27,11 +52,35 @@ class UserUpdate(BaseModel):
 
 class UserResponse(BaseModel):
     id: int
+    name: str = Field(max_length=250)
+    weight: int
+    user_record_id: int | None
+    height: int | None
+
+class LoginRequest(BaseModel):
+    name: str = Field(max_length=250)
     password: str = Field(max_length=100)
+
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str
+    expires_at: int
+
+
+class DashboardUser(BaseModel):
+    id: int
     name: str = Field(max_length=250)
     weight: int
-    user_record_id: int
-    height: int
+    user_record_id: int | None
+    height: int | None
+
+
+class DashboardResponse(BaseModel):
+    user: DashboardUser
+    latest_records: List["RecordResponse"]
+    repmaxs: List["RepmaxResponse"]
+    recent_workouts: List["WorkoutResponse"]
 
 #                                                            Exercise
 class ExerciseCreate(BaseModel):
@@ -56,7 +105,7 @@ class ExerciseResponse(BaseModel):
     id: int
     name: str = Field(max_length=250)
     weight: int
-    repmax_id: int
+    repmax_id: int | None
     primary_muscle: str | None
     secondary_muscle: str | None
     category_id: int
@@ -69,6 +118,13 @@ class RecordCreate(BaseModel):
     record_date: datetime
     record_time: time
 
+class IngestReceipt(BaseModel):
+    receipt_id: str
+    # queued, persisted or failed
+    status: str
+    record_id: Optional[int] = None
+    error: Optional[str] = None
+
 class RecordUpdate(BaseModel):
     workout_id: int | None = Field(...)
     user_id: int | None = Field(...)
@@ -100,6 +156,20 @@ class RepmaxResponse(BaseModel):
     user_id: int
     weight: int
 
+class PersonalBestResponse(BaseModel):
+    exercise_id: int
+    exercise_name: str
+    weight: int
+    repmax_id: int
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    name: str
+    bodyweight: int
+    weight: int
+    repmax_id: int
+
 
 #                                                            Workout
 class WorkoutCreate(BaseModel):
@@ -122,6 +192,28 @@ class WorkoutResponse(BaseModel):
     for_kids: bool
 
 
+class WorkoutExerciseDetail(BaseModel):
+    id: int
+    name: str
+    primary_muscle: str | None
+    secondary_muscle: str | None
+    category_id: int
+    category: str | None
+
+
+class FullWorkoutExercise(BaseModel):
+    workout_exercise_id: int
+    exercise_id: int
+    sets: int | None
+    reps: int | None
+    rest_time: int | None
+    exercise: WorkoutExerciseDetail
+
+
+class FullWorkoutResponse(WorkoutResponse):
+    exercises: List[FullWorkoutExercise]
+
+
 #                                                           Category
 class CategoryCreate(BaseModel):
     name: str = Field(max_length=100)
@@ -149,6 +241,18 @@ class WorkoutExerciseResponse(BaseModel):
     workout_exercise_id: int
     workout_id: int
     exercise_id: int
-    sets: int
-    reps: int
-    rest_time: int
+    sets: int | None
+    reps: int | None
+    rest_time: int | None
+
+
+DashboardResponse.model_rebuild()
+
+
+# Built once, used by responses.json_response on the list endpoints
+user_page_adapter = TypeAdapter(Page[UserResponse])
+exercise_page_adapter = TypeAdapter(Page[ExerciseResponse])
+record_page_adapter = TypeAdapter(Page[RecordResponse])
+repmax_page_adapter = TypeAdapter(Page[RepmaxResponse])
+workout_page_adapter = TypeAdapter(Page[WorkoutResponse])
+workout_exercise_page_adapter = TypeAdapter(Page[WorkoutExerciseResponse])
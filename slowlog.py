@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import random
+import re
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import psycopg2.errors
+import psycopg2.extensions
+
+import prepared
+
+# Slow-query log.
+# The timed cursors in metrics.py hand every statement slower than SLOW_QUERY_MS
+# to record(). It keeps the last SLOW_QUERY_LOG_SIZE of them in memory for
+# GET /admin/slow-queries and logs each one. A sample of them (SLOW_QUERY_EXPLAIN_RATE)
+# is re-run under EXPLAIN (ANALYZE, BUFFERS) by one background thread on its own
+# connection, inside a transaction that is always rolled back. Only reads are
+# re-run, writes get a plain EXPLAIN, running them again would still take their
+# row locks and fire their triggers on the primary. While that thread is busy
+# new samples are dropped, so capturing plans never piles load onto a slow database.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_SECONDS = SLOW_QUERY_MS / 1000
+
+# Bounds for re-running a query under EXPLAIN ANALYZE
+EXPLAIN_STATEMENT_TIMEOUT = "10s"
+EXPLAIN_LOCK_TIMEOUT = "100ms"
+
+# prepared.py's one-off planning probe and PREPARE, the EXECUTE that follows is what gets logged
+_IGNORED_PREFIXES = ("EXPLAIN ", "PREPARE ")
+
+# Anything that changes or locks rows, also inside a WITH or a SELECT.
+# SELECT ... INTO creates a table and nextval/setval move a sequence.
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE"
+                     r"|INTO|NEXTVAL|SETVAL)\b", re.IGNORECASE)
+
+logger = logging.getLogger("trainify.slow_queries")
+
+_entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_lock = threading.Lock()
+_explain_queue = queue.Queue(maxsize=1)
+_explainer = None
+
+
+def params_shape(params):
+    """
+    Describes the parameters of a query without their values
+    """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _value_shape(value) for key, value in params.items()}
+    return [_value_shape(value) for value in params]
+
+
+def _value_shape(value) -> str:
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def record(name: str, query, params, seconds: float, rowcount: int):
+    """
+    Stores one slow statement and maybe queues it for a plan capture
+    """
+    sql = query.decode(errors="replace") if isinstance(query, bytes) else str(query)
+    if sql.startswith(_IGNORED_PREFIXES):
+        return
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "query": name,
+        "duration_ms": round(seconds * 1000, 3),
+        "rows": rowcount,
+        "params": params_shape(params),
+        "sql": sql[:2000],
+        "plan": None,
+    }
+    with _lock:
+        _entries.append(entry)
+    logger.warning("Slow query %s took %.1f ms", name, entry["duration_ms"],
+                   extra={"query": name, "query_ms": entry["duration_ms"], "rows": rowcount, "params": entry["params"]})
+
+    if _explainer is not None and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+        entry["plan"] = "pending"
+        try:
+            _explain_queue.put_nowait((entry, query, params))
+        except queue.Full:
+            entry["plan"] = None
+
+
+def is_read_only(sql: str) -> bool:
+    """
+    Whether sql is a SELECT, or a WITH, that neither writes nor locks rows
+    """
+    keyword = sql.lstrip(" \t\r\n(").split(None, 1)[0].upper() if sql.strip() else ""
+    return keyword in ("SELECT", "WITH", "VALUES", "TABLE") and not _WRITES.search(sql)
+
+
+def _explain(con, query, params) -> str:
+    if isinstance(query, bytes):
+        query = query.decode()
+    statement = None
+    if query.startswith("EXECUTE "):
+        # Prepared on the request's connection, this one needs its own copy
+        statement = prepared.STATEMENTS.get(query[len("EXECUTE "):].split("(", 1)[0].rstrip("; "))
+    explain = "EXPLAIN (ANALYZE, BUFFERS) " if is_read_only(statement.sql if statement else query) else "EXPLAIN "
+    try:
+        with con.cursor() as cursor:
+            if statement is not None and statement.name not in con.prepared:
+                prepared.prepare(cursor, statement, timed=False)
+            cursor.execute(f"SET LOCAL statement_timeout = '{EXPLAIN_STATEMENT_TIMEOUT}';")
+            cursor.execute(f"SET LOCAL lock_timeout = '{EXPLAIN_LOCK_TIMEOUT}';")
+            cursor.execute(explain + query, params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        # EXPLAIN ANALYZE really runs the statement, nothing it does may stick
+        con.rollback()
+
+
+def _explain_loop(connect):
+    con = None
+    while True:
+        job = _explain_queue.get()
+        if job is None:
+            break
+        entry, query, params = job
+        try:
+            if con is None or con.closed:
+                con = connect()
+                # Plain cursors, so the EXPLAINs don't show up in metrics or in this log
+                con.cursor_factory = psycopg2.extensions.cursor
+            entry["plan"] = _explain(con, query, params)
+        except Exception as exc:
+            entry["plan"] = f"EXPLAIN failed: {exc}"
+            if isinstance(exc, psycopg2.errors.FeatureNotSupported):
+                prepared.evict(con)
+            if con is not None and con.closed:
+                con = None
+    if con is not None:
+        con.close()
+
+
+def start_explainer(connect):
+    """
+    Starts the background thread that captures plans, connect opens its connection
+    """
+    global _explainer
+    if _explainer is None and SLOW_QUERY_EXPLAIN_RATE > 0:
+        _explainer = threading.Thread(target=_explain_loop, args=(connect,), name="slow-query-explainer",
+                                      daemon=True)
+        _explainer.start()
+
+
+def stop_explainer():
+    global _explainer
+    if _explainer is not None:
+        try:
+            _explain_queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+        _explainer.join(timeout=5)
+        _explainer = None
+
+
+def worst_queries(limit: int) -> dict:
+    """
+    Returns the slowest recent statements and per query totals
+    """
+    with _lock:
+        entries = list(_entries)
+    by_query = {}
+    for entry in entries:
+        stats = by_query.setdefault(entry["query"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] = round(stats["total_ms"] + entry["duration_ms"], 3)
+        stats["max_ms"] = max(stats["max_ms"], entry["duration_ms"])
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "worst": sorted(entries, key=lambda entry: entry["duration_ms"], reverse=True)[:limit],
+        "by_query": dict(sorted(by_query.items(), key=lambda item: item[1]["total_ms"], reverse=True)),
+    }
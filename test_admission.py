@@ -0,0 +1,72 @@
+import pytest
+
+import admission
+from admission import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_shed(clock):
+    bucket = TokenBucket(rate=2, burst=3, max_clients=10)
+    assert [bucket.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Empty, the next token comes after 1 / rate seconds
+    assert bucket.take("a") == pytest.approx(0.5)
+    assert bucket.shed == 1
+
+
+def test_refill_over_time(clock):
+    bucket = TokenBucket(rate=2, burst=3, max_clients=10)
+    for _ in range(3):
+        bucket.take("a")
+    clock.now += 0.5
+    assert bucket.take("a") == 0.0
+    assert bucket.take("a") > 0
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3, max_clients=10)
+    bucket.take("a")
+    clock.now += 3600
+    assert [bucket.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take("a") > 0
+
+
+def test_shed_requests_still_refill(clock):
+    bucket = TokenBucket(rate=1, burst=1, max_clients=10)
+    bucket.take("a")
+    assert bucket.take("a") == pytest.approx(1.0)
+    clock.now += 0.25
+    assert bucket.take("a") == pytest.approx(0.75)
+
+
+def test_clients_have_their_own_bucket(clock):
+    bucket = TokenBucket(rate=1, burst=1, max_clients=10)
+    assert bucket.take("a") == 0.0
+    assert bucket.take("a") > 0
+    assert bucket.take("b") == 0.0
+
+
+def test_least_recently_seen_client_is_evicted(clock):
+    bucket = TokenBucket(rate=1, burst=1, max_clients=2)
+    bucket.take("a")
+    bucket.take("b")
+    # Seeing "a" again makes "b" the least recently seen
+    assert bucket.take("a") > 0
+    bucket.take("c")
+    assert bucket.stats()["clients"] == 2
+    # "a" kept its empty bucket, "b" was dropped and comes back with a full one
+    assert bucket.take("a") > 0
+    assert bucket.take("b") == 0.0
@@ -0,0 +1,57 @@
+import gzip
+
+import brotli
+import pytest
+
+from compression import compress, negotiate
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("br", "br"),
+    ("GZIP", "gzip"),
+    # Preferred when both are accepted equally
+    ("gzip, br", "br"),
+    ("gzip, deflate, br, zstd", "br"),
+    # Quality decides otherwise
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("br; q=0.9, gzip; q=0.1", "br"),
+])
+def test_negotiate(accept_encoding, expected):
+    assert negotiate(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("br;q=0, gzip;q=0", None),
+    ("br;q=0.0, gzip;q=0.000", None),
+])
+def test_negotiate_q0_refuses_an_encoding(accept_encoding, expected):
+    assert negotiate(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("*", "br"),
+    ("*;q=0", None),
+    # Named encodings override the wildcard
+    ("br;q=0, *", "gzip"),
+    ("gzip;q=0, *;q=0.5", "br"),
+    ("*;q=0, gzip", "gzip"),
+    ("*;q=0.2, gzip;q=0.5", "gzip"),
+])
+def test_negotiate_wildcard(accept_encoding, expected):
+    assert negotiate(accept_encoding) == expected
+
+
+def test_negotiate_treats_a_bad_quality_as_refused():
+    assert negotiate("br;q=high, gzip") == "gzip"
+
+
+def test_compress_round_trip():
+    body = b'{"items": []}' * 200
+    assert gzip.decompress(compress(body, "gzip")) == body
+    assert brotli.decompress(compress(body, "br")) == body
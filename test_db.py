@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from db import UPDATABLE_COLUMNS, build_update_query
+
+
+def normalize(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def test_update_query_sets_every_field_once():
+    query, params = build_update_query('users', 7, {'name': 'ann', 'weight': 60})
+    assert normalize(query) == "UPDATE users SET name = %s, weight = %s WHERE user_id = %s RETURNING *;"
+    assert params == ('ann', 60, 7)
+
+
+def test_update_query_maps_fields_to_their_columns():
+    query, params = build_update_query('exercises', 3, {'name': 'Squat', 'weight': 100})
+    assert "SET exercise_name = %s, exercise_weight = %s" in normalize(query)
+    assert "WHERE exercise_id = %s" in normalize(query)
+    assert params == ('Squat', 100, 3)
+
+
+def test_update_query_keeps_none_values():
+    _, params = build_update_query('workouts', 1, {'record_id': None})
+    assert params == (None, 1)
+
+
+@pytest.mark.parametrize("table", sorted(UPDATABLE_COLUMNS))
+def test_update_query_accepts_every_whitelisted_field(table):
+    primary_key, columns = UPDATABLE_COLUMNS[table]
+    update_data = {field: index for index, field in enumerate(columns)}
+    query, params = build_update_query(table, 99, update_data)
+    for column in columns.values():
+        assert f"{column} = %s" in query
+    assert params == (*update_data.values(), 99)
+    assert normalize(query).count("%s") == len(columns) + 1
+
+
+@pytest.mark.parametrize("table", sorted(UPDATABLE_COLUMNS))
+def test_update_query_rejects_an_empty_update(table):
+    with pytest.raises(ValueError, match="No value was passed"):
+        build_update_query(table, 1, {})
+
+
+@pytest.mark.parametrize("table, update_data", [
+    ('users', {'user_id': 2}),
+    ('users', {'name': 'ann', 'is_admin': True}),
+    ('exercises', {'exercise_name': 'Squat'}),  # a column, not a field
+    ('workout_exercises', {'workout_id': 1}),
+    ('users', {'name = name; DROP TABLE users; --': 'x'}),
+])
+def test_update_query_rejects_fields_outside_the_whitelist(table, update_data):
+    with pytest.raises(ValueError, match="Invalid column name"):
+        build_update_query(table, 1, update_data)
+
+
+def test_update_query_rejects_unknown_tables():
+    with pytest.raises(KeyError):
+        build_update_query('pg_authid', 1, {'name': 'x'})
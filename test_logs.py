@@ -0,0 +1,47 @@
+import logging
+
+import pytest
+
+from logs import SamplingFilter, parse_sample_rates
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("INFO=0.1,DEBUG=0.01") == {logging.INFO: 0.1, logging.DEBUG: 0.01}
+
+
+def test_parse_sample_rates_ignores_case_spaces_and_empty_items():
+    assert parse_sample_rates(" info = 0.5 ,, warning=1 ,") == {logging.INFO: 0.5, logging.WARNING: 1.0}
+
+
+def test_parse_sample_rates_empty():
+    assert parse_sample_rates("") == {}
+
+
+@pytest.mark.parametrize("value", ["VERBOSE=0.1", "INFO=0.1,TRACE=0.5", "20=0.1", "=0.1"])
+def test_parse_sample_rates_rejects_unknown_levels(value):
+    with pytest.raises(ValueError, match="Unknown log level"):
+        parse_sample_rates(value)
+
+
+@pytest.mark.parametrize("value", ["INFO", "INFO=often"])
+def test_parse_sample_rates_rejects_bad_rates(value):
+    with pytest.raises(ValueError):
+        parse_sample_rates(value)
+
+
+def make_record(level: int) -> logging.LogRecord:
+    return logging.makeLogRecord({"levelno": level, "levelname": logging.getLevelName(level)})
+
+
+def test_sampling_filter_keeps_unlisted_levels():
+    keep = SamplingFilter({logging.INFO: 0.0})
+    assert keep.filter(make_record(logging.WARNING))
+    assert not keep.filter(make_record(logging.INFO))
+
+
+def test_sampling_filter_keeps_a_share(monkeypatch):
+    sample = SamplingFilter({logging.INFO: 0.25})
+    monkeypatch.setattr("logs.random.random", lambda: 0.2)
+    assert sample.filter(make_record(logging.INFO))
+    monkeypatch.setattr("logs.random.random", lambda: 0.3)
+    assert not sample.filter(make_record(logging.INFO))
@@ -0,0 +1,62 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import MAX_CURSOR_ID, MIN_CURSOR_ID, decode_cursor, encode_cursor, make_page
+
+
+def raw_token(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("last_id", [1, 42, MIN_CURSOR_ID, MAX_CURSOR_ID])
+def test_cursor_round_trip(last_id):
+    assert decode_cursor(encode_cursor(last_id)) == last_id
+
+
+@pytest.mark.parametrize("after", [None, ""])
+def test_no_cursor_starts_at_the_beginning(after):
+    assert decode_cursor(after) == 0
+
+
+@pytest.mark.parametrize("after", [
+    "not base64!",
+    "a",                              # not a whole byte
+    raw_token("42"),                  # no prefix
+    raw_token("user:42"),             # wrong prefix
+    raw_token("id:"),
+    raw_token("id:forty-two"),
+    raw_token("id:4.2"),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),  # not utf-8
+])
+def test_malformed_cursor_is_rejected(after):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(after)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("last_id", [MAX_CURSOR_ID + 1, MIN_CURSOR_ID - 1, 10 ** 30])
+def test_out_of_range_cursor_is_rejected(last_id):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(raw_token(f"id:{last_id}"))
+    assert error.value.status_code == 400
+
+
+def test_make_page_with_a_next_page():
+    rows = [{"id": 1}, {"id": 2}, {"id": 3}]
+    page = make_page(rows, 2, "id")
+    assert page["items"] == [{"id": 1}, {"id": 2}]
+    assert decode_cursor(page["next_after"]) == 2
+
+
+@pytest.mark.parametrize("rows", [[], [{"id": 1}], [{"id": 1}, {"id": 2}]])
+def test_make_page_without_a_next_page(rows):
+    page = make_page(rows, 2, "id")
+    assert page["items"] == rows
+    assert page["next_after"] is None
+
+
+def test_make_page_uses_the_given_key():
+    rows = [{"record_id": 7}, {"record_id": 9}]
+    assert decode_cursor(make_page(rows, 1, "record_id")["next_after"]) == 7
@@ -0,0 +1,68 @@
+import pytest
+
+import db  # noqa: F401, registers the statements of the app
+import prepared
+from prepared import Statement
+
+
+def test_positional_placeholders_are_numbered_in_order():
+    statement = Statement("page", "SELECT * FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s;")
+    assert statement.prepare_sql == "PREPARE page AS SELECT * FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2;"
+    assert statement.execute_sql == "EXECUTE page(%s, %s);"
+    assert statement.args([5, 10]) == (5, 10)
+
+
+def test_repeated_named_placeholder_gets_one_parameter():
+    statement = Statement("ranked", """
+        SELECT * FROM users
+        WHERE (%(above)s::bigint IS NULL OR weight > %(above)s)
+          AND (%(up_to)s::bigint IS NULL OR weight <= %(up_to)s)
+        LIMIT %(limit)s
+    """)
+    assert statement.param_names == ["above", "up_to", "limit"]
+    assert "$1::bigint IS NULL OR weight > $1" in statement.prepare_sql
+    assert "$2::bigint IS NULL OR weight <= $2" in statement.prepare_sql
+    assert "LIMIT $3" in statement.prepare_sql
+    assert "%" not in statement.prepare_sql
+    assert statement.execute_sql == "EXECUTE ranked(%s, %s, %s);"
+
+
+def test_named_arguments_follow_first_appearance():
+    statement = Statement("named", "SELECT %(b)s, %(a)s, %(b)s")
+    assert statement.args({"a": 1, "b": 2, "unused": 3}) == (2, 1)
+
+
+def test_missing_named_argument_raises():
+    statement = Statement("missing", "SELECT %(a)s")
+    with pytest.raises(KeyError):
+        statement.args({})
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT %(a)s, %s",
+    "SELECT %s, %(a)s, %(a)s",
+])
+def test_mixed_placeholders_are_rejected(sql):
+    with pytest.raises(ValueError, match="mixes"):
+        Statement("mixed", sql)
+
+
+def test_statement_without_parameters():
+    statement = Statement("plain", "  SELECT 1;  ")
+    assert statement.prepare_sql == "PREPARE plain AS SELECT 1;"
+    assert statement.execute_sql == "EXECUTE plain;"
+    assert statement.args(()) == ()
+
+
+def test_register_refuses_a_second_statement_with_the_same_name(monkeypatch):
+    monkeypatch.setattr(prepared, "STATEMENTS", {})
+    statement = prepared.register("once", "SELECT 1")
+    assert prepared.STATEMENTS == {"once": statement}
+    with pytest.raises(ValueError, match="already registered"):
+        prepared.register("once", "SELECT 2")
+
+
+def test_every_registered_statement_converts():
+    assert prepared.STATEMENTS
+    for statement in prepared.STATEMENTS.values():
+        assert "%s" not in statement.prepare_sql and "%(" not in statement.prepare_sql
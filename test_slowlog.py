@@ -0,0 +1,73 @@
+import pytest
+
+import db  # noqa: F401, registers the statements of the app
+import prepared
+from slowlog import is_read_only
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1",
+    "select * from users where user_id = %s",
+    "  \n\tSELECT updated_at, last_update FROM records",
+    "(SELECT 1) UNION (SELECT 2)",
+    "WITH recent AS (SELECT * FROM records) SELECT count(*) FROM recent",
+    "VALUES (1), (2)",
+    "TABLE users",
+    "SELECT name FROM users WHERE name = 'deleted_user'",
+])
+def test_reads_are_read_only(sql):
+    assert is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM users WHERE user_id = 1 FOR UPDATE",
+    "SELECT * FROM users FOR UPDATE OF users SKIP LOCKED",
+    "select * from users for no key update",
+    "SELECT * FROM users FOR SHARE",
+    "SELECT * FROM users FOR KEY SHARE NOWAIT",
+    "SELECT *\nFROM users\nFOR\n  UPDATE",
+])
+def test_locking_selects_are_not_read_only(sql):
+    assert not is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH gone AS (DELETE FROM records WHERE record_id = 1 RETURNING *) SELECT * FROM gone",
+    "WITH moved AS (UPDATE repmax SET weight = 1 RETURNING *) SELECT count(*) FROM moved",
+    "WITH new AS (INSERT INTO categories (name) VALUES ('x') RETURNING *) SELECT * FROM new",
+    "with m as (merge into users u using src s on u.user_id = s.user_id when matched then do nothing) select 1",
+])
+def test_writing_ctes_are_not_read_only(sql):
+    assert not is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * INTO users_copy FROM users",
+    "SELECT nextval('users_user_id_seq')",
+    "SELECT setval('users_user_id_seq', 1)",
+])
+def test_selects_with_side_effects_are_not_read_only(sql):
+    assert not is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "   ",
+    "INSERT INTO users (name) VALUES ('x')",
+    "UPDATE users SET name = 'x'",
+    "DELETE FROM users",
+    "EXECUTE fetch_user(1)",
+    "EXPLAIN SELECT 1",
+    "-- comment\nSELECT 1",
+    "CALL refresh()",
+])
+def test_everything_else_is_not_read_only(sql):
+    assert not is_read_only(sql)
+
+
+def test_registered_statements():
+    # Only the page and lookup queries may be re-run under EXPLAIN ANALYZE
+    assert is_read_only(prepared.STATEMENTS["leaderboard"].sql)
+    assert is_read_only(prepared.STATEMENTS["users_page"].sql)
+    assert not is_read_only(prepared.STATEMENTS["create_record"].sql)
+    assert not is_read_only(prepared.STATEMENTS["create_repmax"].sql)